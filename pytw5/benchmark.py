@@ -0,0 +1,229 @@
+"""
+Description
+===========
+
+In-process microbenchmarks for the model and integrator hot paths, run against
+a synthetic inventory and an in-memory TiddlyWiki server stub.
+
+Results are written as JSON so runs can be compared across versions:
+
+    pytw5 benchmark --sizes 1000,10000 --output new.json --baseline old.json
+
+"""
+
+import ipaddress
+import json
+import logging
+import os
+import platform
+import random
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+from click import ClickException
+from . import checkpoint
+from . import model
+from . import progress
+from . import schema
+from .config import TargetConfig
+from .integrator import Integrator
+from .testing import MemoryServer
+
+log = logging.getLogger(__name__)
+
+ADDRESSES_PER_NETWORK = 1000
+# Switch MAC addresses are numbered from here, clear of the client addresses
+SWITCH_MAC_BASE = 0xff000000
+
+
+class Inventory(NamedTuple):
+
+    networks: Tuple[str, ...]
+    # (mac, ip address, description)
+    static_maps: Tuple[Tuple[str, str, str], ...]
+    # (host, ip address, aliases)
+    dns_lookups: Tuple[Tuple[str, str, Tuple[str, ...]], ...]
+    # (mac, switch mac, switch name, port number)
+    clients: Tuple[Tuple[str, str, str, int], ...]
+
+
+def _mac(i: int) -> str:
+    return ":".join(f"{b:02x}" for b in (0x02, 0x00) + tuple(i.to_bytes(4, "big")))
+
+
+def generate_inventory(size: int, seed: int = 0) -> Inventory:
+    """
+    Generates roughly size IP addresses, spread over /22 networks, with a DHCP
+    static map per address, DNS names (some with aliases) for half of them and
+    a UniFi switch port for a third of them.
+    """
+    rng = random.Random(seed)
+    base = int(ipaddress.ip_address("10.0.0.0"))
+
+    networks = list()
+    addresses = list()
+    for n in range(max(1, size // ADDRESSES_PER_NETWORK)):
+        network = ipaddress.ip_network((base + n * 1024, 22))
+        networks.append(str(network))
+        hosts = min(size - len(addresses), ADDRESSES_PER_NETWORK)
+        addresses.extend(str(network.network_address + 1 + x) for x in range(hosts))
+
+    static_maps = tuple(
+        (_mac(i), address, f"Host {i} in rack {rng.randint(1, 40)}")
+        for i, address in enumerate(addresses)
+    )
+    dns_lookups = tuple(
+        (
+            f"host{i}.example.com",
+            address,
+            tuple(f"alias{i}-{a}.example.com" for a in range(rng.randint(0, 2))),
+        )
+        for i, address in enumerate(addresses) if i % 2 == 0
+    )
+    clients = list()
+    for i in range(0, len(addresses), 3):
+        switch = rng.randint(1, max(1, size // 1000))
+        clients.append((_mac(i), _mac(SWITCH_MAC_BASE + switch), f"sw{switch}", rng.randint(1, 48)))
+    return Inventory(networks=tuple(networks), static_maps=static_maps, dns_lookups=dns_lookups, clients=tuple(clients))
+
+
+def build_model(inventory: Inventory) -> model.Model:
+    """
+    Builds a model the same way the sources do, one record at a time.
+    """
+    m = model.create_model()
+    for network in inventory.networks:
+        m.get_network(network).add_annotation(f"Network {network}")
+    for mac, address, description in inventory.static_maps:
+        mac_obj = m.get_mac(mac)
+        mac_obj.add_annotation(description)
+        ip_address_obj = m.get_ip_address(address)
+        ip_address_obj.set_mac(mac_obj)
+        ip_address_obj.add_annotation(description)
+    for host, address, aliases in inventory.dns_lookups:
+        ip_address_obj = m.get_ip_address(address)
+        for name in (host,) + aliases:
+            dns_lookup_obj = m.get_dns_lookup(name)
+            dns_lookup_obj.add_ip_address(ip_address_obj)
+            dns_lookup_obj.add_annotation(f"Name for {address}")
+    for mac, switch_mac, switch, port in inventory.clients:
+        m.get_mac(mac).add_annotation(f"Connected to switch {switch} port #{port} - Port {port}")
+        m.set_switch_port(mac, switch_mac, port)
+    return m
+
+
+def _timed(fn: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def _run(inventory: Inventory) -> Dict[str, float]:
+    ret: Dict[str, float] = dict()
+
+    m = model.create_model()
+    ret["model.get_network"] = _timed(lambda: [m.get_network(x) for x in inventory.networks])
+    ret["model.get_ip_address"] = _timed(lambda: [m.get_ip_address(x[1]) for x in inventory.static_maps])
+
+    m = model.create_model()
+    ret["model.ingest"] = _timed(lambda: m.ingest(
+        networks=inventory.networks,
+        mac_bindings=[model.MacBinding(mac=x[0], ipv4=x[1]) for x in inventory.static_maps],
+    ))
+
+    built: List[model.Model] = []
+    ret["model.build"] = _timed(lambda: built.append(build_model(inventory)))
+    m = built[0]
+
+    ret["model.network.utilisation"] = _timed(lambda: [x.utilisation for x in m.networks])
+
+    switches = [x for x in m.topology.nodes if x.kind == "switch"]
+    ret["model.topology.downstream"] = _timed(
+        lambda: [m.topology.traverse(x, downstream=True) for x in switches]
+    )
+
+    integrator = Integrator(m)
+    rendered = dict()
+    for twit_class, process in integrator.twit_classes:
+        ret[f"integrator.render.{twit_class}"] = _timed(lambda: rendered.setdefault(twit_class, process()))
+
+    annotations = [x.annotations for x in m.ip_addresses]
+    encoded: List[str] = []
+    ret["schema.encode_list"] = _timed(lambda: encoded.extend(schema.encode_list(x) for x in annotations))
+    ret["schema.decode_list"] = _timed(lambda: [schema.decode_list(x) for x in encoded])
+
+    server = MemoryServer()
+    target = TargetConfig({"name": "benchmark", "host": "memory"})
+    digests = {k: checkpoint.digest(v) for k, v in rendered.items()}
+
+    # The same planning, prioritised writes and checkpointing as a real run,
+    # with the journal and progress file kept out of the working path
+    def _sync() -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            journal = checkpoint.Checkpoint(os.path.join(directory, "checkpoint.jsonl"))
+            journal.start()
+            integrator._sync_target(
+                target=target,
+                server=server,
+                rendered=[(k, v, digests[k]) for k, v in rendered.items()],
+                journal=journal,
+                report=progress.ProgressFile(os.path.join(directory, "progress.json"), target.name),
+                previous=dict(),
+            )
+
+    ret["integrator._sync_target.create"] = _timed(_sync)
+    ret["integrator._sync_target.unchanged"] = _timed(_sync)
+    return ret
+
+
+def run(sizes: Tuple[int, ...], repeat: int = 1, seed: int = 0) -> Dict[str, Any]:
+    results: Dict[str, Dict[str, float]] = dict()
+    for size in sizes:
+        inventory = generate_inventory(size, seed=seed)
+        best: Dict[str, float] = dict()
+        for _ in range(repeat):
+            for name, elapsed in _run(inventory).items():
+                best[name] = min(elapsed, best.get(name, elapsed))
+        results[str(size)] = best
+        log.info("Size %d: %.2fs", size, sum(best.values()))
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "seed": seed,
+        "results": results,
+    }
+
+
+def regressions(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Descriptions of the timings which are slower than the baseline by more than
+    the tolerance (a fraction, e.g. 0.25).
+    """
+    ret = list()
+    for size, timings in current["results"].items():
+        for name, elapsed in timings.items():
+            try:
+                before = baseline["results"][size][name]
+            except KeyError:
+                continue
+            if elapsed > before * (1 + tolerance):
+                ret.append(f"{name} @ {size}: {before:.4f}s -> {elapsed:.4f}s")
+    return ret
+
+
+def main(sizes: Tuple[int, ...], repeat: int, output: Optional[str], baseline: Optional[str], tolerance: float) -> Dict[str, Any]:
+    result = run(sizes=sizes, repeat=repeat)
+
+    if output:
+        with open(output, "w") as fp:
+            json.dump(result, fp, indent=4, sort_keys=True)
+
+    if baseline:
+        with open(baseline, "r") as fp:
+            slower = regressions(result, json.load(fp), tolerance)
+        if slower:
+            raise ClickException("Performance regressions:\n  " + "\n  ".join(slower))
+
+    return result
@@ -0,0 +1,160 @@
+"""
+Description
+===========
+
+A small append-only journal, one per target, of the operations planned for each
+twit class and the titles completed so far. An interrupted run can then be
+resumed without re-downloading and re-comparing everything, provided the class
+digest (the rendered target state and run scope) still matches.
+
+Each line is a JSON record, either:
+
+    {"plan": <twit_class>, "digest": <digest>, "operations": [[kind, title, current], ...]}
+    {"done": [[twit_class, title], ...]}
+
+A later plan for a class replaces an earlier one. A new journal starts with the
+plans it resumes from, so a class the run never reaches (e.g. when it is
+interrupted again) can still be resumed.
+
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+from .config import singleton
+
+log = logging.getLogger(__name__)
+
+
+class ClassCheckpoint(NamedTuple):
+
+    digest: str
+    # (kind, title, current)
+    operations: Tuple[Tuple[str, str, Optional[Dict[str, str]]], ...]
+    done: Set[str]
+
+
+def digest(target_state: List[Dict[str, str]], scope: Any = None) -> str:
+    h = hashlib.sha256()
+    h.update(json.dumps(scope, sort_keys=True).encode())
+    for item in sorted(target_state, key=lambda x: x["title"]):
+        h.update(json.dumps(item, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+class Checkpoint:
+
+    BATCH = 100
+    # The fields of the listing entry needed to write or delete the tiddler
+    CURRENT_FIELDS = ("title", "revision", "created", "bag", "tags", "twit_class", "pytw5_sources")
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[str, str]] = []
+        # Classes carried over from the previous journal and not planned since
+        self._unreached: Set[str] = set()
+
+    @classmethod
+    def for_target(cls, target_name: str) -> 'Checkpoint':
+        name = re.sub(r"[^\w.\-]", "_", target_name)
+        return cls(os.path.join(singleton.path, f"pytw5.checkpoint.{name}.jsonl"))
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def load(self) -> Dict[str, ClassCheckpoint]:
+        ret: Dict[str, ClassCheckpoint] = dict()
+        try:
+            with open(self._path, "r") as fp:
+                for line in fp:
+                    try:
+                        record = json.loads(line)
+                    except json.decoder.JSONDecodeError:
+                        # Torn final line from an interrupted write
+                        log.warning("Ignoring corrupt line in checkpoint '%s'", self._path)
+                        continue
+                    if "plan" in record:
+                        ret[record["plan"]] = ClassCheckpoint(
+                            digest=record["digest"],
+                            operations=tuple(tuple(x) for x in record["operations"]),
+                            done=set(),
+                        )
+                    for twit_class, title in record.get("done", ()):
+                        if twit_class in ret:
+                            ret[twit_class].done.add(title)
+        except FileNotFoundError:
+            pass
+        return ret
+
+    def start(self, previous: Optional[Dict[str, ClassCheckpoint]] = None) -> None:
+        """
+        Replaces the journal with the previous plans and their progress. Call
+        once the run is under way, so a run which fails to start keeps them.
+        """
+        previous = previous or dict()
+        with self._lock:
+            self._pending.clear()
+            self._unreached = set(previous)
+            tmp = f"{self._path}.tmp"
+            with open(tmp, "w") as fp:
+                for twit_class, resumed in previous.items():
+                    fp.write(self._line({"plan": twit_class, "digest": resumed.digest, "operations": resumed.operations}))
+                    if resumed.done:
+                        fp.write(self._line({"done": [(twit_class, x) for x in sorted(resumed.done)]}))
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(tmp, self._path)
+
+    @staticmethod
+    def _line(record: Dict[str, Any]) -> str:
+        return json.dumps(record, separators=(",", ":")) + "\n"
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        with open(self._path, "a") as fp:
+            fp.write(self._line(record))
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    def record_plan(self, twit_class: str, class_digest: str, operations: Iterable[Tuple[str, str, Optional[Dict[str, str]]]]) -> None:
+        operations = [
+            (kind, title, None if current is None else {k: v for k, v in current.items() if k in self.CURRENT_FIELDS})
+            for kind, title, current in operations
+        ]
+        with self._lock:
+            self._unreached.discard(twit_class)
+            self._append({"plan": twit_class, "digest": class_digest, "operations": operations})
+
+    def record_done(self, twit_class: str, title: str) -> None:
+        with self._lock:
+            self._pending.append((twit_class, title))
+            if len(self._pending) >= self.BATCH:
+                self._flush()
+
+    def _flush(self) -> None:
+        if self._pending:
+            self._append({"done": self._pending})
+            self._pending = []
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def finish(self) -> None:
+        """
+        Removes the journal, unless it still holds classes the run didn't reach.
+        """
+        with self._lock:
+            if self._unreached:
+                self._flush()
+                return
+            self._pending.clear()
+            try:
+                os.remove(self._path)
+            except FileNotFoundError:
+                pass
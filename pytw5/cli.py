@@ -25,6 +25,23 @@ def _setup_path(ctx, obj, path):
     return singleton.path
 
 
+# noinspection PyUnusedLocal
+def _setup_progress(ctx, obj, value):
+    from . import progress
+    if obj.name == "trace":
+        progress.configure(progress_interval=progress.interval, trace=value)
+    else:
+        progress.configure(progress_interval=value, trace=progress.trace_every)
+    return value
+
+
+# noinspection PyUnusedLocal
+def _setup_processes(ctx, obj, value):
+    from . import sources
+    sources.configure(process_count=value)
+    return value
+
+
 @click.group("contexts", cls=AliasedGroup, invoke_without_command=True)
 @click.option(
     "--verbose",
@@ -40,6 +57,30 @@ def _setup_path(ctx, obj, path):
     expose_value=False,
     is_eager=True,
     help="Override working path, default=\".\"")
+@click.option(
+    "--progress-interval",
+    type=float,
+    default=5.0,
+    callback=_setup_progress,
+    expose_value=False,
+    is_eager=True,
+    help="Seconds between progress summaries, 0 for every event, negative to disable, default=5")
+@click.option(
+    "--trace",
+    type=int,
+    default=0,
+    callback=_setup_progress,
+    expose_value=False,
+    is_eager=True,
+    help="Also log every Nth per-tiddler event, default=0 (off)")
+@click.option(
+    "--processes",
+    type=int,
+    default=0,
+    callback=_setup_processes,
+    expose_value=False,
+    is_eager=True,
+    help="Build the model from each source in a pool of this many processes, default=0 (in process)")
 @click.version_option("0.1")
 @click.pass_context
 def root_cmd(ctx):
@@ -49,11 +90,206 @@ def root_cmd(ctx):
         ctx.exit()
 
 
+def _split(ctx, param, value):
+    if value is None:
+        return None
+    return tuple(x.strip() for x in value.split(",") if x.strip())
+
+
 @root_cmd.command("update")
-def update():
+@click.option(
+    "--only",
+    callback=_split,
+    help="Comma separated twit classes to update (nic, ip_address, network, dns_lookup)")
+@click.option(
+    "--source",
+    callback=_split,
+    help="Comma separated source names or types to fetch. Tiddlers which other sources "
+         "contributed to, or which were written before pytw5 recorded their sources, are "
+         "left for a full run.")
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Continue an interrupted run from its checkpoint, where the model is unchanged")
+@click.option(
+    "--force",
+    is_flag=True,
+    help="Apply deletes and updates even where they exceed the targets' churn_guard limits")
+def update(only, source, resume, force):
     from . import integrator
-    updater = integrator.Integrator()
-    updater.process_network_interfaces()
-    updater.process_ip_addresses()
-    updater.process_networks()
-    updater.process_dns_lookups()
+    updater = integrator.Integrator(source_names=source, only=only)
+    results = updater.update(resume=resume, force=force)
+    for result in results:
+        if result.error:
+            click.echo(f"{result.name}: FAILED - {result.error}")
+        else:
+            refused = f", {result.refused} withheld" if result.refused else ""
+            click.echo(f"{result.name}: {result.created} created, {result.updated} updated, {result.deleted} deleted{refused}")
+        for anomaly in result.anomalies:
+            click.echo(f"{result.name}: {anomaly}")
+
+    failed = [x.name for x in results if x.error]
+    if failed:
+        raise click.ClickException(f"Failed to update targets {failed}!")
+
+
+@root_cmd.command("watch")
+@click.option("--resync-interval", type=float, default=3600.0, help="Seconds between full syncs, default=3600")
+@click.option("--batch-interval", type=float, default=2.0, help="Seconds to gather events before pushing, default=2")
+@click.option(
+    "--replay",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Apply recorded event messages (one per line) for the first unifi source, instead of following the feeds")
+def watch(resync_interval, batch_interval, replay):
+    """
+    Follow the UniFi event feeds, pushing wired client port moves as they happen.
+    """
+    from . import watch as watcher
+    from .sources import unifi_events
+    w = watcher.Watcher(resync_interval=resync_interval, batch_interval=batch_interval)
+    streams = None
+    if replay:
+        if not w.unifi_sources:
+            raise click.ClickException("No enabled unifi sources to replay events for!")
+        streams = {w.unifi_sources[0].name: {"replay": unifi_events.ReplayEventStream(replay)}}
+    w.watch(streams)
+
+
+@root_cmd.command("unifi-replay")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--port", type=int, default=8765, help="Port to listen on, default=8765")
+@click.option("--delay", type=float, default=0.0, help="Seconds between messages, default=0")
+def unifi_replay(path, port, delay):
+    """
+    Serve recorded UniFi event messages as a local websocket stand-in for the
+    controller, for use as a source's events_url.
+    """
+    from .sources import unifi_events
+    server = unifi_events.ReplayServer(path, port=port, delay=delay)
+    click.echo(f"Serving {path} on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+@root_cmd.command("serve")
+@click.option("--host", default="127.0.0.1", help="Address to listen on, default=127.0.0.1")
+@click.option("--port", type=int, default=8080, help="Port to listen on, default=8080")
+@click.option("--interval", type=float, default=300.0, help="Seconds between model rebuilds, default=300")
+def serve(host, port, interval):
+    """
+    Serve read-only IP, MAC, host and network lookups over local HTTP.
+    """
+    from . import serve as server
+    server.serve(host=host, port=port, interval=interval)
+
+
+@root_cmd.command("search")
+@click.argument("query", nargs=-1, required=True)
+def search(query):
+    """
+    Search annotations, e.g. 'switch core-sw1' or 'machine web*'.
+    """
+    from . import sources
+    from .integrator import describe_entity
+    m = sources.load_model()
+    for entity in m.search(" ".join(query)):
+        twit_class, title = describe_entity(entity)
+        click.echo(f"{twit_class:<12} {title}")
+
+
+@root_cmd.command("query")
+@click.argument("node", required=False)
+@click.option("--depth", type=int, help="Maximum number of hops from the node")
+@click.option("--downstream", is_flag=True, help="Only follow edges away from the switches, i.e. everything behind the node")
+@click.option("--kinds", callback=_split, help="Comma separated node kinds to traverse (switch, port, mac, network, ip, dns)")
+@click.option("--format", "output_format", type=click.Choice(["text", "json", "dot"]), default="text", help="Output format, default=text")
+def query(node, depth, downstream, kinds, output_format):
+    """
+    Traverse the topology graph from a node, e.g.
+    'port:aa:00:00:00:00:f1#12 --downstream' for everything behind a switch
+    port (switches are keyed by MAC address). Without a node the whole graph
+    is output.
+    """
+    from . import sources
+    from .model import Node
+    m = sources.load_model()
+    nodes = None
+    if node is not None:
+        try:
+            start = Node.parse(node)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        if start not in m.topology:
+            raise click.ClickException(f"Unknown node '{node}'!")
+        nodes = m.topology.traverse(start, max_depth=depth, kinds=kinds, downstream=downstream)
+
+    if output_format == "json":
+        click.echo(m.topology.to_json(nodes))
+    elif output_format == "dot":
+        click.echo(m.topology.to_dot(nodes))
+    else:
+        for x in (nodes if nodes is not None else sorted(m.topology.nodes)):
+            label = m.topology.label(x)
+            click.echo(f"{x}  {label}" if label else str(x))
+
+
+@root_cmd.command("history")
+@click.argument("entity")
+@click.option(
+    "--twit-class",
+    type=click.Choice(["nic", "ip_address", "network", "dns_lookup"]),
+    help="The class of the entity, by default guessed from its form")
+def history(entity, twit_class):
+    """
+    Show how an IP address, MAC address, network or host changed over the
+    recorded runs, e.g. when an IP address moved to another MAC address.
+    """
+    from . import history as model_history
+    from . import schema
+    key = model_history.entity_key(twit_class, entity) if twit_class else model_history.guess_key(entity)
+    changes = model_history.History.open().entity_history(key)
+    if not changes:
+        raise click.ClickException(f"No history for '{key}'!")
+
+    kinds = {x.name: x.kind for x in schema.SCHEMAS[key.partition(":")[0]].fields}
+    for change in changes:
+        click.echo(f"{change.time}  run {change.run}  {change.kind}")
+        for name, (old, new) in sorted(change.fields.items()):
+            if change.kind == "created":
+                click.echo(f"    {name}: {new}")
+            elif change.kind == "changed" and kinds.get(name) in ("list", "ordered"):
+                old_items = set(schema.decode_list(old or ""))
+                new_items = set(schema.decode_list(new or ""))
+                items = [f"+{x}" for x in sorted(new_items - old_items)] + [f"-{x}" for x in sorted(old_items - new_items)]
+                # An ordered list can change order alone
+                click.echo(f"    {name}: {', '.join(items) or 'reordered'}")
+            elif change.kind == "changed":
+                click.echo(f"    {name}: {old or '-'} -> {new or '-'}")
+
+
+@root_cmd.command("benchmark")
+@click.option("--sizes", default="1000,10000,100000", help="Comma separated inventory sizes, default=1000,10000,100000")
+@click.option("--repeat", type=int, default=1, help="Runs per size, the best time is kept, default=1")
+@click.option("--output", type=click.Path(dir_okay=False), help="Write the results to this JSON file")
+@click.option("--baseline", type=click.Path(exists=True, dir_okay=False), help="Fail if slower than this JSON results file")
+@click.option("--tolerance", type=float, default=0.25, help="Allowed slowdown against the baseline, default=0.25")
+def benchmark(sizes, repeat, output, baseline, tolerance):
+    """
+    Time the model and integrator hot paths against a synthetic inventory.
+    """
+    from . import benchmark as bench
+    result = bench.main(
+        sizes=tuple(int(x) for x in sizes.split(",")),
+        repeat=repeat,
+        output=output,
+        baseline=baseline,
+        tolerance=tolerance,
+    )
+    for size, timings in result["results"].items():
+        click.echo(f"Size {size}")
+        for name, elapsed in timings.items():
+            click.echo(f"  {name:<40} {elapsed:10.4f}s")
@@ -1,6 +1,7 @@
+import hashlib
 import os
 import logging
-from typing import Any, Dict
+from typing import Any, Dict, NamedTuple, Optional, Tuple
 import json
 from click import ClickException
 
@@ -11,6 +12,170 @@ class MissingConfigError(ClickException):
     pass
 
 
+class InstanceConfig:
+    """
+    A named entry from one of the configuration lists.
+    """
+
+    KIND = "instance"
+
+    def __init__(self, config: Dict[str, Any]) -> None:
+        self._config = config
+
+    def get_key(self, key: str) -> Any:
+        try:
+            return self._config[key]
+        except KeyError:
+            raise ClickException(f"Missing '{key}' configuration key for {self.KIND} '{self.name}'!") from None
+
+    def get_optional_key(self, key: str, default: Any = None) -> Any:
+        return self._config.get(key, default)
+
+    @property
+    def name(self) -> str:
+        try:
+            return self._config["name"]
+        except KeyError:
+            raise ClickException(f"Missing 'name' configuration key for {self.KIND}!") from None
+
+    def digest(self) -> str:
+        return hashlib.sha256(json.dumps(self._config, sort_keys=True, default=str).encode()).hexdigest()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._config.get("enabled", True))
+
+    @property
+    def timeout(self) -> float:
+        return float(self._config.get("timeout", 30))
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.name})"
+
+
+class SourceConfig(InstanceConfig):
+    """
+    A named instance of a source (e.g. one of several PFSense firewalls).
+    """
+
+    KIND = "source"
+    TYPES = ("dhcp_leases", "pfsense", "pfsense_config", "proxmox", "unifi")
+
+    def __init__(self, config: Dict[str, Any]) -> None:
+        super().__init__(config)
+        if self.type not in self.TYPES:
+            raise ClickException(f"Unknown type '{self.type}' for source '{self.name}'!")
+
+    @property
+    def type(self) -> str:
+        return self.get_key("type")
+
+    def __repr__(self) -> str:
+        return f"SourceConfig({self.type}:{self.name})"
+
+
+class ChurnLimit(NamedTuple):
+    """
+    The share of a class's existing tiddlers a run may delete or update,
+    unless fewer than min_count would be. Updates which only migrate tiddlers
+    to the current schema (e.g. the fields added by an upgrade, which touch
+    every tiddler on the first run after it) don't count, and are never
+    withheld.
+    """
+
+    max_delete: Optional[float] = 0.25
+    max_update: Optional[float] = 0.5
+    min_count: int = 20
+
+
+# "<kind>:<twit_class>" patterns, most urgent first
+DEFAULT_APPLY_PRIORITY = (
+    "create:network", "create:ip_address", "create:nic", "create:dns_lookup",
+    "update:network", "update:ip_address", "update:nic", "update:dns_lookup",
+    "delete:*",
+)
+
+
+class TargetConfig(InstanceConfig):
+    """
+    A named TiddlyWiki server to push the model to.
+
+    Writes carry an If-Match precondition (If-None-Match for new tiddlers), and
+    a write which conflicts is re-read and retried. The stock TW5 server
+    ignores these headers on PUT and DELETE, so against it a concurrent edit is
+    overwritten rather than detected. Conflicts are only reported by a server
+    (or proxy in front of it) which honours the preconditions.
+    """
+
+    KIND = "target"
+
+    @property
+    def host(self) -> str:
+        return self.get_key("host")
+
+    @property
+    def user(self) -> str:
+        return self._config.get("user", "")
+
+    @property
+    def password(self) -> str:
+        return self._config.get("password", "")
+
+    @property
+    def bag(self) -> str:
+        return self._config.get("bag", "default")
+
+    @property
+    def recipe(self) -> str:
+        return self._config.get("recipe", "default")
+
+    @property
+    def max_in_flight_writes(self) -> int:
+        return max(1, int(self._config.get("max_in_flight_writes", 8)))
+
+    @property
+    def apply_priority(self) -> Tuple[str, ...]:
+        """
+        The order writes are applied in, as "<kind>:<twit_class>" patterns
+        (e.g. "create:*"). Operations matching no pattern go last.
+        """
+        value = self._config.get("apply_priority", DEFAULT_APPLY_PRIORITY)
+        if isinstance(value, str) or not all(isinstance(x, str) for x in value):
+            raise ClickException(f"Expected a list of patterns for 'apply_priority' of target '{self.name}'!")
+        return tuple(value)
+
+    @property
+    def cache_listing(self) -> bool:
+        return bool(self._config.get("cache_listing", True))
+
+    def churn_limit(self, twit_class: str) -> Optional[ChurnLimit]:
+        """
+        From "churn_guard", e.g. {"max_delete": 0.1, "nic": {"max_update": null}}.
+        Keys at the top level apply to every class, and a class's own keys
+        override them. false disables the guard, for every class or for one
+        (e.g. {"nic": false}).
+        """
+        guard = self._config.get("churn_guard", dict())
+        if guard is False:
+            return None
+        if not isinstance(guard, dict):
+            raise ClickException(f"Expected an object or false for 'churn_guard' of target '{self.name}'!")
+
+        own = guard.get(twit_class, dict())
+        if own is False:
+            return None
+        if not isinstance(own, dict):
+            raise ClickException(
+                f"Expected an object or false for 'churn_guard.{twit_class}' of target '{self.name}'!"
+            )
+        values = {k: v for k, v in guard.items() if k in ChurnLimit._fields}
+        values.update(own)
+        unknown = set(values).difference(ChurnLimit._fields)
+        if unknown:
+            raise ClickException(f"Unknown 'churn_guard' keys {sorted(unknown)} for target '{self.name}'!")
+        return ChurnLimit(**values)
+
+
 class Singleton:
 
     def __init__(self) -> None:
@@ -18,10 +183,14 @@ class Singleton:
         self._config_loaded = False
         self._lazy_config = dict()  # type: Dict[str, Any]
 
-    def initialise(self, p: str) -> None:
+    def initialise(self, p: str, config: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Sets the working path, with the configuration loaded from it on first
+        use unless it is given (e.g. to a worker process).
+        """
         self._path = os.path.abspath(os.path.expanduser(p))
-        self._config_loaded = False
-        self._lazy_config.clear()
+        self._config_loaded = config is not None
+        self._lazy_config = dict() if config is None else config
         log.debug("Path: '{}'".format(self._path))
 
     @property
@@ -32,6 +201,10 @@ class Singleton:
     def server_config_path(self) -> str:
         return os.path.join(self._path, "pytw5.config")
 
+    @property
+    def config(self) -> Dict[str, Any]:
+        return self._config
+
     @property
     def _config(self) -> Dict[str, Any]:
 
@@ -52,61 +225,63 @@ class Singleton:
         except KeyError:
             raise ClickException(f"Missing '{key}' configuration key!") from None
 
-    # TiddlyWiki Server containing TWIT
+    # Sources
 
     @property
-    def twserver_host(self) -> str:
-        return self._get_key("twserver_host")
-
-    @property
-    def twserver_user(self) -> str:
-        return self._get_key("twserver_user")
-
-    @property
-    def twserver_password(self) -> str:
-        return self._get_key("twserver_password")
-
-    # PFSense
-
-    @property
-    def pfsense_host(self) -> str:
-        return self._get_key("pfsense_host")
-
-    @property
-    def pfsense_client_id(self) -> str:
-        return self._get_key("pfsense_client_id")
-
-    @property
-    def pfsense_token(self) -> str:
-        return self._get_key("pfsense_token")
-
-    # Proxmox
-
-    @property
-    def proxmox_user(self) -> str:
-        return self._get_key("proxmox_user")
+    def sources(self) -> Tuple[SourceConfig, ...]:
+        """
+        Named source instances from the 'sources' list. Configurations without
+        a 'sources' list fall back to one instance per legacy source key.
+        """
+        try:
+            configs = self._config["sources"]
+        except KeyError:
+            configs = self._legacy_sources()
 
-    @property
-    def proxmox_password(self) -> str:
-        return self._get_key("proxmox_password")
+        return self._check_unique(tuple(SourceConfig(x) for x in configs))
 
-    @property
-    def proxmox_host(self) -> str:
-        return self._get_key("proxmox_host")
+    @staticmethod
+    def _check_unique(instances: Tuple[InstanceConfig, ...]) -> Tuple[InstanceConfig, ...]:
+        names = [x.name for x in instances]
+        duplicates = sorted(set(x for x in names if names.count(x) > 1))
+        if duplicates:
+            raise ClickException(f"Duplicate {instances[0].KIND} names {duplicates}!")
+        return instances
 
-    # Unifi
+    def _legacy_sources(self) -> Tuple[Dict[str, Any], ...]:
+        legacy = (
+            ("pfsense", {"host": "pfsense_host", "client_id": "pfsense_client_id", "token": "pfsense_token"}),
+            ("proxmox", {"host": "proxmox_host", "user": "proxmox_user", "password": "proxmox_password"}),
+            ("unifi", {"host": "unifi_controller_ip", "user": "unifi_user", "password": "unifi_password"}),
+        )
+        ret = []
+        for source_type, keys in legacy:
+            d = {"name": source_type, "type": source_type}
+            for key, legacy_key in keys.items():
+                if legacy_key in self._config:
+                    d[key] = self._config[legacy_key]
+            ret.append(d)
+        return tuple(ret)
 
-    @property
-    def unifi_controller_ip(self) -> str:
-        return self._get_key("unifi_controller_ip")
+    # TiddlyWiki Servers containing TWIT
 
     @property
-    def unifi_user(self) -> str:
-        return self._get_key("unifi_user")
+    def targets(self) -> Tuple[TargetConfig, ...]:
+        """
+        Named TiddlyWiki servers from the 'targets' list. Configurations without
+        a 'targets' list fall back to a single target from the twserver_* keys.
+        """
+        try:
+            configs = self._config["targets"]
+        except KeyError:
+            configs = [{
+                "name": "twserver",
+                "host": self._get_key("twserver_host"),
+                "user": self._get_key("twserver_user"),
+                "password": self._get_key("twserver_password"),
+            }]
 
-    @property
-    def unifi_password(self) -> str:
-        return self._get_key("unifi_password")
+        return self._check_unique(tuple(TargetConfig(x) for x in configs))
 
 
 
@@ -0,0 +1,274 @@
+"""
+Description
+===========
+
+An append-only history of the rendered model, so changes over time (an IP
+address moving to another MAC address, a DNS alias disappearing) can be traced
+after the wiki has been overwritten.
+
+Each run which changes anything is stored as a delta against the previous
+run: the entities added and removed, and the fields which changed. Every
+CHECKPOINT_INTERVAL entries the full state is stored as well, so rebuilding
+the state at any entry replays at most that many deltas.
+
+Files
+=====
+
+    pytw5.history.log           one gzip member per entry, concatenated
+    pytw5.history.index.jsonl   per entry: run, time, log offset and length,
+                                and the keys of the entities it changed
+
+Entities are keyed "<twit_class>:<title>", e.g. "ip_address:10.0.0.1". The
+index lets the history of one entity be read from the first checkpoint and
+just the deltas which touched it.
+
+"""
+
+import datetime
+import gzip
+import ipaddress
+import json
+import logging
+import os
+import re
+from typing import Any, Dict, FrozenSet, IO, Iterable, List, NamedTuple, Optional, Tuple
+from .config import singleton
+
+log = logging.getLogger(__name__)
+
+RE_MAC = re.compile(r"^[0-9a-f]{2}(:[0-9a-f]{2}){5}$", re.IGNORECASE)
+
+# Carried by the key rather than repeated in the fields
+KEY_FIELDS = ("title", "twit_class")
+
+# key -> encoded fields
+State = Dict[str, Dict[str, str]]
+
+
+class IndexEntry(NamedTuple):
+
+    run: int
+    time: str
+    checkpoint: bool
+    offset: int
+    length: int
+    keys: FrozenSet[str]
+
+
+class Change(NamedTuple):
+
+    run: int
+    time: str
+    kind: str  # created, changed or removed
+    fields: Dict[str, Tuple[Optional[str], Optional[str]]]  # name: (old, new)
+
+
+def entity_key(twit_class: str, title: str) -> str:
+    return f"{twit_class}:{title}"
+
+
+def guess_key(value: str) -> str:
+    """
+    The entity key for an IP address, MAC address, network or host name.
+    """
+    if RE_MAC.match(value):
+        return entity_key("nic", value.lower())
+    try:
+        if "/" in value:
+            return entity_key("network", str(ipaddress.ip_network(value)))
+        return entity_key("ip_address", str(ipaddress.ip_address(value)))
+    except ValueError:
+        return entity_key("dns_lookup", value)
+
+
+def state_from(rendered: Iterable[Tuple[str, Iterable[Dict[str, str]]]]) -> State:
+    """
+    The state of a run from its rendered (twit_class, target state) pairs.
+    """
+    return {
+        entity_key(twit_class, item["title"]): {k: v for k, v in item.items() if k not in KEY_FIELDS}
+        for twit_class, target_state in rendered
+        for item in target_state
+    }
+
+
+def diff(old: State, new: State) -> Dict[str, Any]:
+    changed = dict()
+    for key, fields in new.items():
+        previous = old.get(key)
+        if previous is not None and previous != fields:
+            changed[key] = {
+                name: fields.get(name)
+                for name in set(previous).union(fields)
+                if previous.get(name) != fields.get(name)
+            }
+    return {
+        "added": {k: v for k, v in new.items() if k not in old},
+        "removed": sorted(k for k in old if k not in new),
+        "changed": changed,
+    }
+
+
+def apply_delta(state: State, delta: Dict[str, Any]) -> None:
+    state.update(delta["added"])
+    for key in delta["removed"]:
+        del state[key]
+    for key, fields in delta["changed"].items():
+        # Copied, as the previous state may still be referenced
+        updated = dict(state[key])
+        for name, value in fields.items():
+            if value is None:
+                updated.pop(name, None)
+            else:
+                updated[name] = value
+        state[key] = updated
+
+
+class History:
+
+    CHECKPOINT_INTERVAL = 50
+    # Checkpoints are large, the last few percent of size is not worth the time
+    COMPRESS_LEVEL = 6
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        # The latest entry and its state, so consecutive records don't re-read the log
+        self._head: Optional[Tuple[int, State]] = None
+
+    @classmethod
+    def open(cls) -> 'History':
+        return cls(os.path.join(singleton.path, "pytw5.history"))
+
+    @property
+    def log_path(self) -> str:
+        return f"{self._path}.log"
+
+    @property
+    def index_path(self) -> str:
+        return f"{self._path}.index.jsonl"
+
+    def index(self) -> List[IndexEntry]:
+        ret: List[IndexEntry] = list()
+        try:
+            with open(self.index_path, "r") as fp:
+                for line in fp:
+                    try:
+                        record = json.loads(line)
+                    except json.decoder.JSONDecodeError:
+                        # Torn final line from an interrupted write, its log entry is ignored too
+                        log.warning("Ignoring corrupt line in history index '%s'", self.index_path)
+                        continue
+                    ret.append(IndexEntry(
+                        run=record["run"],
+                        time=record["time"],
+                        checkpoint=record["checkpoint"],
+                        offset=record["offset"],
+                        length=record["length"],
+                        keys=frozenset(record["keys"]),
+                    ))
+        except FileNotFoundError:
+            pass
+        return ret
+
+    @staticmethod
+    def _read(fp: IO[bytes], entry: IndexEntry) -> Dict[str, Any]:
+        fp.seek(entry.offset)
+        return json.loads(gzip.decompress(fp.read(entry.length)))
+
+    def state_at(self, run: Optional[int] = None, index: Optional[List[IndexEntry]] = None) -> State:
+        """
+        The state as of the given run (default the latest), from the nearest
+        checkpoint at or before it.
+        """
+        if index is None:
+            index = self.index()
+        entries = [x for x in index if run is None or x.run <= run]
+        if not entries:
+            return dict()
+
+        start = max(i for i, x in enumerate(entries) if x.checkpoint)
+        with open(self.log_path, "rb") as fp:
+            state = self._read(fp, entries[start])["state"]
+            for entry in entries[start + 1:]:
+                apply_delta(state, self._read(fp, entry)["delta"])
+        return state
+
+    def record(self, state: State, now: Optional[str] = None) -> Optional[IndexEntry]:
+        """
+        Appends the state of a run, unless nothing changed since the previous one.
+        """
+        index = self.index()
+        if self._head is None or not index or self._head[0] != index[-1].run:
+            self._head = (index[-1].run, self.state_at(index=index)) if index else None
+
+        delta = diff(self._head[1], state) if self._head is not None else None
+        keys: List[str] = list()
+        if delta is not None:
+            keys = sorted(set(delta["added"]).union(delta["removed"], delta["changed"]))
+            if not keys:
+                return None
+
+        last_checkpoint = max((x.run for x in index if x.checkpoint), default=None)
+        run = index[-1].run + 1 if index else 1
+        checkpoint = last_checkpoint is None or run - last_checkpoint >= self.CHECKPOINT_INTERVAL
+        record: Dict[str, Any] = {"delta": delta}
+        if checkpoint:
+            record["state"] = state
+
+        data = gzip.compress(json.dumps(record, separators=(",", ":")).encode(), compresslevel=self.COMPRESS_LEVEL)
+        with open(self.log_path, "ab") as fp:
+            # Any bytes after the last indexed entry are from an interrupted write
+            offset = fp.seek(0, os.SEEK_END)
+            fp.write(data)
+        entry = IndexEntry(
+            run=run,
+            time=now or datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
+            checkpoint=checkpoint,
+            offset=offset,
+            length=len(data),
+            keys=frozenset(keys),
+        )
+        with open(self.index_path, "a") as fp:
+            fp.write(json.dumps({
+                "run": entry.run,
+                "time": entry.time,
+                "checkpoint": entry.checkpoint,
+                "offset": entry.offset,
+                "length": entry.length,
+                "keys": keys,
+            }, separators=(",", ":")) + "\n")
+
+        self._head = (run, state)
+        log.debug("Recorded history run %d, %d entities changed", run, len(keys))
+        return entry
+
+    def entity_history(self, key: str) -> List[Change]:
+        """
+        Each change to one entity, read from the first checkpoint and only the
+        deltas which touched it.
+        """
+        index = self.index()
+        if not index:
+            return list()
+
+        ret: List[Change] = list()
+        with open(self.log_path, "rb") as fp:
+            current = self._read(fp, index[0])["state"].get(key)
+            if current is not None:
+                ret.append(Change(index[0].run, index[0].time, "created", {k: (None, v) for k, v in current.items()}))
+
+            for entry in index[1:]:
+                if key not in entry.keys:
+                    continue
+                delta = self._read(fp, entry)["delta"]
+                if key in delta["added"]:
+                    current = delta["added"][key]
+                    ret.append(Change(entry.run, entry.time, "created", {k: (None, v) for k, v in current.items()}))
+                elif key in delta["removed"]:
+                    ret.append(Change(entry.run, entry.time, "removed", {k: (v, None) for k, v in current.items()}))
+                    current = None
+                else:
+                    fields = delta["changed"][key]
+                    ret.append(Change(entry.run, entry.time, "changed", {k: (current.get(k), v) for k, v in fields.items()}))
+                    current = {k: v for k, v in dict(current, **fields).items() if v is not None}
+        return ret
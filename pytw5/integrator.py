@@ -1,184 +1,709 @@
 from . import twserver
 from . import sources
 from . import model
-from .config import singleton
-from typing import Dict, List
+from .config import singleton, TargetConfig
+import click
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from . import checkpoint
+from . import history
+from . import listing_cache
+from . import progress
+from . import schema
+import collections
 import datetime
-import re
+import fnmatch
+import functools
+import itertools
+import logging
+import queue
+import threading
+
+log = logging.getLogger(__name__)
+
+
+def describe_entity(entity: model.Entity) -> Tuple[str, str]:
+    """
+    Returns the (twit_class, title) of the tiddler generated for a model entity.
+    """
+    if isinstance(entity, model.MacAddress):
+        return "nic", entity.mac
+    if isinstance(entity, model.IPv4Address):
+        return "ip_address", entity.ipv4
+    if isinstance(entity, model.Network):
+        return "network", entity.network
+    if isinstance(entity, model.DNSLookup):
+        return "dns_lookup", entity.host
+    raise TypeError(f"Unexpected entity {entity!r}")
+
+
+class TargetResult(NamedTuple):
+
+    name: str
+    created: int = 0
+    updated: int = 0
+    deleted: int = 0
+    error: Optional[str] = None
+    # Operations withheld by the churn guard, and why
+    refused: int = 0
+    anomalies: Tuple[str, ...] = ()
+
+
+class Operation(NamedTuple):
+    """
+    A planned change to one tiddler on a target.
+    """
+
+    kind: str  # create, update or delete
+    twit_class: str
+    title: str
+    entity: Optional[Dict[str, str]]  # Target state fields, None for deletes
+    current: Optional[Dict[str, str]]  # Tiddler from the listing, None for creates
 
 
 class Integrator:
     TAG = "PyTw5Generated"
-    RE_LINK = re.compile('\[\[(?P<link>.*?)\]\]')
-
-
-    def __init__(self):
+    CONFLICT_RETRIES = 3
+    TWIT_CLASSES = ("nic", "ip_address", "network", "dns_lookup")
+
+    def __init__(
+            self,
+            m: Optional[model.Model] = None,
+            source_names: Optional[Iterable[str]] = None,
+            only: Optional[Iterable[str]] = None,
+    ):
+        """
+        source_names restricts the run to those source names or types, and only
+        to those twit classes. When only some sources are selected, tiddlers are
+        only deleted or rewritten if the selected sources own all of them.
+        Tiddlers written before their sources were recorded (without the
+        pytw5_sources field) are owned by no source, so they are left for a
+        full run, which records their sources.
+        """
+        self._now = ""
+
+        self._only: Optional[Set[str]] = None
+        if only is not None:
+            self._only = set(only)
+            unknown = self._only.difference(self.TWIT_CLASSES)
+            if unknown:
+                raise click.ClickException(f"Unknown twit classes {sorted(unknown)}, expected {list(self.TWIT_CLASSES)}!")
+
+        self._owners: Optional[Set[str]] = None
+        if source_names is None:
+            self._model = m if m is not None else sources.load_model()
+        else:
+            selected = sources.select_sources(source_names)
+            if len(selected) < len(sources.select_sources()):
+                self._owners = {x.name for x in selected}
+            self._model = m if m is not None else sources.load_model(selected)
+
+        # Incremental rendering state for long lived processes
+        self._rendered: Dict[str, Dict[str, Dict[str, str]]] = dict()
+        self._changed: Optional[Dict[str, List[model.Entity]]] = None
+        self._journal_position = 0
+        self._synced_targets: Set[str] = set()
+        self._history: Optional[history.History] = None
+        self._begin_cycle()
+
+    def _begin_cycle(self) -> None:
         now = datetime.datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
         # Trim to milliseconds
         self._now = now[:len("YYYYMMDDHHMMSSMMM")]
-        self._model = sources.load_model()
 
-        self._server = twserver.Server.connect(
-            url=singleton.twserver_host, 
-            user=singleton.twserver_user, 
-            password=singleton.twserver_password
+        if self._rendered:
+            self._changed = dict()
+            for entity in self._model.changed_since(self._journal_position):
+                self._changed.setdefault(describe_entity(entity)[0], []).append(entity)
+        self._journal_position = self._model.journal_position
+        # We are the only reader of the journal
+        self._model.truncate_journal(self._journal_position)
+
+    @property
+    def twit_classes(self) -> Tuple[Tuple[str, Callable[[], List[Dict[str, str]]]], ...]:
+        return tuple(
+            (twit_class, process)
+            for twit_class, process in (
+                ("nic", self.process_network_interfaces),
+                ("ip_address", self.process_ip_addresses),
+                ("network", self.process_networks),
+                ("dns_lookup", self.process_dns_lookups),
+            )
+            if self._only is None or twit_class in self._only
         )
 
-    @classmethod
-    def _decode_list(cls, value: str) -> List[str]:
-        result = []
-        matches = list(re.finditer(cls.RE_LINK, value))
-        for match in reversed(matches):
-            result.append(match.group('link'))
-            s = match.start()
-            e = match.end()
-            value = value[:s] + value[e:]
+    def update(self, resume: bool = False, force: bool = False) -> Tuple[TargetResult, ...]:
+        """
+        Renders the target state once, then diffs and pushes it to every
+        configured target in parallel. A failing target doesn't stop the others.
+
+        Each class is handed to the targets as soon as it is rendered, so
+        rendering and diffing the next class overlaps with the writes still in
+        flight for the previous one.
+
+        Progress is checkpointed per target. With resume, classes whose digest
+        matches the checkpoint continue its plan rather than being re-compared.
+
+        Runs covering every source and class are appended to the model history.
+
+        Unless forced, deletes and updates beyond each target's churn limits
+        are withheld and reported rather than applied (see _guard_class).
+        """
+        if self._rendered:
+            self._begin_cycle()
+
+        # Targets which are in sync only need the changed entities re-diffing
+        changed_titles = None
+        if self._changed is not None:
+            changed_titles = {
+                twit_class: {describe_entity(x)[1] for x in entities}
+                for twit_class, entities in self._changed.items()
+            }
+
+        targets = tuple(x for x in singleton.targets if x.enabled)
+        if not targets:
+            return tuple()
+
+        queues = [queue.Queue() for _ in targets]
+        with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+            futures = [
+                (x, executor.submit(
+                    self._update_target,
+                    x,
+                    self._drain(q),
+                    changed_titles if x.name in self._synced_targets else None,
+                    resume,
+                    force,
+                ))
+                for x, q in zip(targets, queues)
+            ]
+            rendered = list()
+            try:
+                scope = None if self._owners is None else sorted(self._owners)
+                # The most urgent classes first, so their writes can start while the others are planned
+                ranks = [self._priorities(x.apply_priority) for x in targets]
+                for twit_class, process in sorted(
+                        self.twit_classes,
+                        key=lambda x: min(r[(kind, x[0])] for r in ranks for kind in ("create", "update")),
+                ):
+                    target_state = process()
+                    class_digest = checkpoint.digest(target_state, scope)
+                    for q in queues:
+                        q.put((twit_class, target_state, class_digest))
+                    rendered.append((twit_class, target_state))
+            finally:
+                for q in queues:
+                    q.put(None)
+            # Recorded while the targets are still being written
+            if self._owners is None and self._only is None:
+                self._record_history(rendered)
+
+        ret = list()
+        for target, future in futures:
+            try:
+                ret.append(future.result())
+                self._synced_targets.add(target.name)
+            except Exception as e:
+                log.error("Failed to update target '%s': %r", target.name, e)
+                self._synced_targets.discard(target.name)
+                ret.append(TargetResult(name=target.name, error=str(e) or repr(e)))
+        return tuple(ret)
+
+    def _record_history(self, rendered: List[Tuple[str, List[Dict[str, str]]]]) -> None:
+        if self._history is None:
+            self._history = history.History.open()
+        try:
+            self._history.record(history.state_from(rendered))
+        except Exception as e:
+            # The history is a record of the runs, it mustn't stop them
+            log.error("Failed to record the model history: %r", e)
+
+    @staticmethod
+    def _drain(q: queue.Queue) -> Iterator[Tuple[str, List[Dict[str, str]], str]]:
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            yield item
+
+    def _update_target(
+            self,
+            target: TargetConfig,
+            rendered: Iterable[Tuple[str, List[Dict[str, str]], str]],
+            changed_titles: Optional[Dict[str, Set[str]]] = None,
+            resume: bool = False,
+            force: bool = False,
+    ) -> TargetResult:
+        journal = checkpoint.Checkpoint.for_target(target.name)
+        previous = journal.load() if resume else dict()
+
+        server = twserver.Server.connect(
+            url=target.host,
+            user=target.user,
+            password=target.password,
+            bag=target.bag,
+            recipe=target.recipe,
+            pool_size=target.max_in_flight_writes,
+            listing_cache=listing_cache.ListingCache.for_target(target.name) if target.cache_listing else None,
+        )
+        # Not until connected, so a run which can't connect keeps the checkpoint
+        journal.start(previous)
+        return self._sync_target(
+            target=target,
+            server=server,
+            rendered=rendered,
+            journal=journal,
+            report=progress.ProgressFile.for_target(target.name),
+            previous=previous,
+            changed_titles=changed_titles,
+            force=force,
+        )
+
+    def _sync_target(
+            self,
+            target: TargetConfig,
+            server: twserver.Server,
+            rendered: Iterable[Tuple[str, List[Dict[str, str]], str]],
+            journal: checkpoint.Checkpoint,
+            report: progress.ProgressFile,
+            previous: Dict[str, checkpoint.ClassCheckpoint],
+            changed_titles: Optional[Dict[str, Set[str]]] = None,
+            force: bool = False,
+    ) -> TargetResult:
+        """
+        Plans and applies the rendered classes against a connected server,
+        recording the progress in the started journal and the report.
+        """
+        # Only downloaded if a class has to be planned from scratch
+        listing = None
+        refused = 0
+        anomalies: List[str] = list()
+
+        priorities = self._priorities(target.apply_priority)
+
+        def _done(operation: Operation, future: Future) -> None:
+            ok = future.exception() is None
+            if ok:
+                journal.record_done(operation.twit_class, operation.title)
+            report.record(operation.kind, operation.twit_class, ok, changed=ok and future.result() is not None)
+
+        # The writes for every class share one pool of workers, which take the
+        # most urgent operation planned so far. Sentinels rank after everything.
+        pending: queue.PriorityQueue = queue.PriorityQueue()
+        workers = [
+            threading.Thread(target=self._write_worker, args=(server, pending), name=f"write-{target.name}-{i}", daemon=True)
+            for i in range(target.max_in_flight_writes)
+        ]
+        for worker in workers:
+            worker.start()
+        sequence = itertools.count()
+        futures = list()
+        # Operations are held back while a class yet to be planned could outrank them
+        unplanned = {x for x, _ in self.twit_classes}
+        held: List[Tuple[int, int, Operation, Future]] = list()
+        try:
+            for twit_class, target_state, class_digest in rendered:
+                resumed = previous.get(twit_class)
+                if resumed is not None and resumed.digest == class_digest:
+                    operations = self._resume_class(server, twit_class, target_state, resumed)
+                    log.info("%s: resuming %d %s operations", target.name, len(operations), twit_class)
+                else:
+                    if listing is None:
+                        listing = server.all_tiddlers
+                    operations = self._plan_class(
+                        listing=listing,
+                        twit_class=twit_class,
+                        target_state=target_state,
+                        titles=None if changed_titles is None else changed_titles.get(twit_class, set()),
+                        owners=self._owners,
+                    )
+                    if not force:
+                        planned = len(operations)
+                        operations, class_anomalies = self._guard_class(target, listing, twit_class, operations)
+                        refused += planned - len(operations)
+                        for anomaly in class_anomalies:
+                            log.error("%s: %s, use --force to apply them", target.name, anomaly)
+                        anomalies.extend(class_anomalies)
+                journal.record_plan(twit_class, class_digest, ((x.kind, x.title, x.current) for x in operations))
+                report.planned((x.kind, x.twit_class) for x in operations)
+
+                for operation in operations:
+                    future = Future()
+                    future.add_done_callback(functools.partial(_done, operation))
+                    held.append((priorities[(operation.kind, twit_class)], next(sequence), operation, future))
+                    futures.append(future)
+
+                unplanned.discard(twit_class)
+                threshold = min((v for k, v in priorities.items() if k[1] in unplanned), default=None)
+                releasing = [x for x in held if threshold is None or x[0] < threshold]
+                held = [x for x in held if not (threshold is None or x[0] < threshold)]
+                # In order, so a worker taking the first released can't jump ahead of a more urgent one
+                for item in sorted(releasing, key=lambda x: x[:2]):
+                    pending.put(item)
+        finally:
+            for item in sorted(held, key=lambda x: x[:2]):
+                pending.put(item)
+            for _ in workers:
+                pending.put((max(priorities.values()) + 1, next(sequence), None, None))
+            for worker in workers:
+                worker.join()
+
+        try:
+            counts = collections.Counter(x.result() for x in futures)
+        except Exception as e:
+            journal.flush()
+            report.finish(error=str(e) or repr(e))
+            raise
+        finally:
+            server.save_listing_cache()
+        journal.finish()
+        report.finish()
+        server.progress.finish()
+        return TargetResult(
+            name=target.name,
+            created=counts["created"],
+            updated=counts["updated"],
+            deleted=counts["deleted"],
+            refused=refused,
+            anomalies=tuple(anomalies),
+        )
 
-        result += value.split()
+    def _write_worker(self, server: twserver.Server, pending: queue.PriorityQueue) -> None:
+        while True:
+            _, _, operation, future = pending.get()
+            if operation is None:
+                return
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(self._apply_operation(server, operation))
+            except Exception as e:
+                future.set_exception(e)
 
-        return result        
+    @classmethod
+    def _priorities(cls, patterns: Tuple[str, ...]) -> Dict[Tuple[str, str], int]:
+        """
+        The rank of each (kind, twit_class), the index of the first pattern it
+        matches, e.g. "create:*".
+        """
+        ret = dict()
+        for kind in ("create", "update", "delete"):
+            for twit_class in cls.TWIT_CLASSES:
+                ret[(kind, twit_class)] = next(
+                    (i for i, x in enumerate(patterns) if fnmatch.fnmatchcase(f"{kind}:{twit_class}", x)),
+                    len(patterns),
+                )
+        return ret
 
-    def _find_tiddlers(self, tag: str, twit_class: str) -> Dict[str, str]:
+    def search(self, query: str) -> Tuple[Tuple[str, str], ...]:
+        return tuple(describe_entity(x) for x in self._model.search(query))
+
+    @staticmethod
+    def _guard_class(
+            target: TargetConfig,
+            listing: Tuple[Dict[str, str], ...],
+            twit_class: str,
+            operations: List[Operation],
+    ) -> Tuple[List[Operation], List[str]]:
+        """
+        Withholds the deletes or updates of a class when they exceed the
+        target's churn limit. A source returning partial data (a timed out
+        call, an empty client list) would otherwise delete or strip thousands
+        of tiddlers, only for the next good run to write them all back. The
+        withheld tiddlers keep their last good state.
+
+        Updates which only migrate a tiddler to the current schema (adding
+        new fields, e.g. after an upgrade) are neither counted nor withheld.
+        """
+        limit = target.churn_limit(twit_class)
+        if limit is None:
+            return operations, list()
+
+        codec = schema.SCHEMAS[twit_class]
+        migrations = {
+            x.title for x in operations
+            if x.kind == "update" and codec.migrates(x.entity, x.current)
+        }
+        existing = sum(1 for x in listing if x.get("twit_class") == twit_class)
+        counts = collections.Counter(x.kind for x in operations if x.title not in migrations)
+        refused = set()
+        anomalies = list()
+        for kind, share in (("delete", limit.max_delete), ("update", limit.max_update)):
+            if share is None or counts[kind] < limit.min_count or counts[kind] <= share * existing:
+                continue
+            refused.add(kind)
+            anomalies.append(
+                f"{twit_class}: withheld {counts[kind]} {kind}s of {existing} existing tiddlers (limit {share:.0%})"
+            )
+        if not refused:
+            return operations, anomalies
+        return [x for x in operations if x.kind not in refused or x.title in migrations], anomalies
+
+    def _find_tiddlers(self, listing: Tuple[Dict[str, str], ...], tag: str, twit_class: str) -> Dict[str, str]:
         ret = dict()
-        for t in self._server.all_tiddlers:
-            if tag in self._decode_list(t.get("tags", "")) and t.get("twit_class") == twit_class:
+        for t in listing:
+            if tag in schema.decode_list(t.get("tags", "")) and t.get("twit_class") == twit_class:
                 ret[t["title"]] = t
         return ret
 
-    def _process_class(self, twit_class: str, target_state: List[Dict[str, str]]) -> None:
-        all_tiddler_lookup = {x["title"]: x for x in self._server.all_tiddlers}
+    def _resume_class(
+            self,
+            server: twserver.Server,
+            twit_class: str,
+            target_state: List[Dict[str, str]],
+            resumed: checkpoint.ClassCheckpoint,
+    ) -> List[Operation]:
+        """
+        The checkpointed operations not yet completed, with the entity fields
+        taken from the (identical) target state.
+        """
+        entities = {x["title"]: x for x in target_state}
+        ret = list()
+        for kind, title, current in resumed.operations:
+            if title in resumed.done:
+                continue
+            entity = None if kind == "delete" else entities[title]
+            if current is not None:
+                server.remember(current)
+            ret.append(Operation(kind=kind, twit_class=twit_class, title=title, entity=entity, current=current))
+        return ret
+
+    def _plan_class(
+            self,
+            listing: Tuple[Dict[str, str], ...],
+            twit_class: str,
+            target_state: List[Dict[str, str]],
+            titles: Optional[Set[str]] = None,
+            owners: Optional[Set[str]] = None,
+    ) -> List[Operation]:
+        """
+        Works out the operations which bring one twit_class on the server into
+        line with the target state. If titles is given only those tiddlers are
+        compared, and nothing is deleted (entities are never removed from a model).
+        If owners is given, only tiddlers produced solely by those sources are
+        deleted or rewritten.
+        """
+        all_tiddler_lookup = {x["title"]: x for x in listing}
 
         # We identity existing tiddlers using the TAG
         existing_entities = self._find_tiddlers(
+            listing=listing,
             twit_class=twit_class,
             tag=self.TAG,
         )
 
-        # Replace the target state setting the tags and twit_class fields
-        old_target_state = target_state
-        target_state = dict()
-        for item in old_target_state:
-            assert "tags" not in item
-            assert "twit_class" not in item
-            d = dict()
-            # Note that TW5 stores field values as strings. So, we need to 
-            #      convert them here to ensure we know if they have been changed.
-            for k, v in item.items():
-                d[k] = str(v)
-            d["twit_class"] = twit_class
-            target_state[item["title"]] = d
+        # The target state is already encoded, so it can be compared with the listing as is
+        target_state = {
+            x["title"]: x for x in target_state
+            if titles is None or x["title"] in titles
+        }
+
+        ret = list()
+
+        not_owned = 0
 
         # Anything in existing which isn't in target state should be deleted.
-        to_delete = set(existing_entities.keys()).difference(target_state.keys())
-        for title in to_delete:
-            # Sanity check...
-            self._server.delete_tiddler(title)
+        if titles is None:
+            for title in sorted(set(existing_entities.keys()).difference(target_state.keys())):
+                if owners is not None and not self._owned_by(existing_entities[title], owners):
+                    not_owned += 1
+                    continue
+                ret.append(Operation(
+                    kind="delete",
+                    twit_class=twit_class,
+                    title=title,
+                    entity=None,
+                    current=existing_entities[title],
+                ))
 
         for entity in target_state.values():
             title = entity["title"]
+            current = all_tiddler_lookup.get(title)
+            if current is not None:
+                # Sanity check...
+                if self.TAG not in schema.decode_list(current.get("tags", "")):
+                    log.warning("Unable to update '%s' - missing tag %s", title, self.TAG)
+                    continue
+
+                if not schema.differs(entity, current):
+                    continue
+
+                # Rewriting would drop what the other sources contributed
+                if owners is not None and not self._owned_by(current, owners):
+                    not_owned += 1
+                    continue
+
+            ret.append(Operation(
+                kind="create" if current is None else "update",
+                twit_class=twit_class,
+                title=title,
+                entity=entity,
+                current=current,
+            ))
+
+        if not_owned:
+            log.info("Skipped %d %s tiddlers partly owned by unselected sources", not_owned, twit_class)
+        return ret
+
+    def _owned_by(self, tiddler: Dict[str, str], owners: Set[str]) -> bool:
+        # Without recorded sources any source may have contributed
+        recorded = set(schema.decode_list(tiddler.get(schema.OWNER_FIELD, "")))
+        return bool(recorded) and recorded.issubset(owners)
+
+    def _apply_operation(self, server: twserver.Server, operation: Operation) -> Optional[str]:
+        """
+        Returns "created", "updated", "deleted" or None if nothing was changed.
+        """
+        if operation.kind == "delete":
+            return "deleted" if self._delete_tiddler(server, operation.current) else None
+        return self._sync_tiddler(server, operation.entity, operation.current)
+
+    def _sync_tiddler(self, server: twserver.Server, entity: Dict[str, str], current: Optional[Dict[str, str]]) -> Optional[str]:
+        """
+        Writes the entity if it is new or differs from the current tiddler,
+        re-reading and retrying if someone else changed it in the meantime.
+        Returns "created", "updated" or None if nothing was written.
+        """
+        title = entity["title"]
+        for attempt in range(self.CONFLICT_RETRIES + 1):
+            try:
+                return self._write_tiddler(server, entity, current)
+            except twserver.ConflictError:
+                log.info("Conflict writing '%s', re-reading (attempt %d)", title, attempt + 1)
+                current = server.get_tiddler(title) or None
+        log.warning("Unable to update '%s' - still conflicting after %d attempts", title, self.CONFLICT_RETRIES + 1)
+        return None
+
+    def _write_tiddler(self, server: twserver.Server, entity: Dict[str, str], current: Optional[Dict[str, str]]) -> Optional[str]:
+        title = entity["title"]
+        if current is not None:
+            # Sanity check...
+            if self.TAG not in schema.decode_list(current.get("tags", "")):
+                log.warning("Unable to update '%s' - missing tag %s", title, self.TAG)
+                return None
+
+            if not schema.differs(entity, current):
+                return None
+
+        tiddler = dict()
+        tiddler.update(entity)
+        tiddler["revision"] = 0
+        tiddler["created"] = self._now
+        tiddler["modified"] = self._now
+        tiddler["tags"] = f"[[{self.TAG}]]"
+
+        if current is not None:
             try:
-                existing = all_tiddler_lookup[title]
+                tiddler["revision"] = int(current["revision"]) + 1
             except KeyError:
-                existing = None
-            else:
-                # Sanity check...
-                if self.TAG not in self._decode_list(existing.get("tags", "")):
-                    print(f"WARNING: Unable to update '{title}' - missing tag {self.TAG}")
-                    entity = None
-
-                for meta_field in ("revision", "created", "modified", "type", "text", "tags"):
-                    if meta_field in existing:
-                        del existing[meta_field]
-            
-            # If we have something to set and either (1) it's new of (2) it is different
-            if entity and (existing is None or entity != existing):
-
-                if existing and False:
-                    import json
-                    print("DEBUG UPDATING...")
-                    print("EXISTING:")
-                    print(json.dumps(existing, indent=4))
-                    print("NEW")
-                    print(json.dumps(entity, indent=4))
-
-
-                tiddler = dict()
-                tiddler.update(entity)
-                tiddler["revision"] = 0
-                tiddler["created"] = self._now
-                tiddler["modified"] = self._now
-                tiddler["tags"] = f"[[{self.TAG}]]"
-
-                try:
-                    tiddler["revision"] = int(existing_entities[title]["revision"]) + 1
-                except KeyError:
-                    pass
-                try:
-                    tiddler["created"] = existing_entities[title]["created"]
-                except KeyError:
-                    pass
-                self._server.update_tiddler(tiddler)
-
-    def process_network_interfaces(self) -> None:
-        target_state = list()
-
-        for mac in self._model.mac_addresses:
-            target_state.append({
-                "title": mac.mac,
-                "mac": mac.mac,
-                "ip_addresses": self._encode_list([x.ipv4 for x in mac.ip_addresses]),
-                "annotations": self._encode_list(mac.annotations),
-            })
-
-        self._process_class(twit_class="nic", target_state=target_state)
-
-    def process_ip_addresses(self) -> None:
-        target_state = list()
-
-        for ip_address in self._model.ip_addresses:
-            target_state.append({
-                "title": ip_address.ipv4,
-                "annotations": self._encode_list(ip_address.annotations),
-                "ip_address": ip_address.ipv4,
-                "mac": ip_address.mac.mac if ip_address.mac else "",
-                "network": ip_address.network.network if ip_address.network else "",
-                "hosts": self._encode_list([x.host for x in ip_address.dns_lookups]),
-            })
-
-        self._process_class(twit_class="ip_address", target_state=target_state)
+                pass
+            try:
+                tiddler["created"] = current["created"]
+            except KeyError:
+                pass
 
-    @classmethod
-    def _encode_list(cls, value: List[str]) -> str:
-        def _del_str(v: str) -> str:
-            if " " in v:
-                return f"[[{v}]]"
-            return v
-        return " ".join([_del_str(x) for x in value])
-
-    def process_networks(self) -> None:
-        target_state = list()
-
-        for network in self._model.networks:
-            target_state.append({
-                "title": network.network,
-                "network": network.network,
-                "vlan": network.vlan or "",  # Note - convert from None to empty string.
-                "prefix_length": network.prefix_length,
-                "annotations": self._encode_list(network.annotations),
-                "ip_addresses": self._encode_list([x.ipv4 for x in network.ip_addresses]),
-            })
-
-        self._process_class(twit_class="network", target_state=target_state)
-
-    def process_dns_lookups(self) -> None:
-        target_state = list()
-
-        for dns_lookup in self._model.dns_lookups:
-            target_state.append({
-                "title": dns_lookup.host,
-                "host": dns_lookup.host,
-                "ip_addresses": self._encode_list([x.ipv4 for x in dns_lookup.ip_addresses]),
-                "annotations": self._encode_list(dns_lookup.annotations),
-            })
-
-        self._process_class(twit_class="dns_lookup", target_state=target_state)
+        server.update_tiddler(tiddler)
+        return "created" if current is None else "updated"
+
+    def _delete_tiddler(self, server: twserver.Server, current: Dict[str, str]) -> bool:
+        title = current["title"]
+        twit_class = current.get("twit_class")
+        for attempt in range(self.CONFLICT_RETRIES + 1):
+            try:
+                server.delete_tiddler(title)
+                return True
+            except twserver.ConflictError:
+                log.info("Conflict deleting '%s', re-reading (attempt %d)", title, attempt + 1)
+                current = server.get_tiddler(title)
+                # Gone, or no longer ours to delete
+                if not current:
+                    return False
+                if self.TAG not in schema.decode_list(current.get("tags", "")) or current.get("twit_class") != twit_class:
+                    log.warning("Not deleting '%s' - it was changed by someone else", title)
+                    return False
+        log.warning("Unable to delete '%s' - still conflicting after %d attempts", title, self.CONFLICT_RETRIES + 1)
+        return False
+
+    def _render(
+            self,
+            twit_class: str,
+            entities: Iterable[model.Entity],
+            render: Callable[[model.Entity], Dict[str, Any]],
+    ) -> List[Dict[str, str]]:
+        """
+        Renders and encodes the target state for a class. After the first
+        render only the entities changed since the start of the previous cycle
+        are re-rendered.
+        """
+        codec = schema.SCHEMAS[twit_class]
+
+        def _render_owned(entity: model.Entity) -> Dict[str, str]:
+            item = render(entity)
+            item[schema.OWNER_FIELD] = entity.sources
+            return codec.encode(item)
+
+        cache = self._rendered.get(twit_class)
+        if cache is None or self._changed is None:
+            cache = dict()
+            for entity in entities:
+                item = _render_owned(entity)
+                cache[item["title"]] = item
+            self._rendered[twit_class] = cache
+        else:
+            for entity in self._changed.get(twit_class, ()):
+                item = _render_owned(entity)
+                cache[item["title"]] = item
+        return list(cache.values())
+
+    def _render_network_interface(self, mac: model.MacAddress) -> Dict[str, Any]:
+        return {
+            "title": mac.mac,
+            "mac": mac.mac,
+            "ip_addresses": [x.ipv4 for x in mac.ip_addresses],
+            "annotations": mac.annotations,
+        }
+
+    def process_network_interfaces(self) -> List[Dict[str, str]]:
+        return self._render("nic", self._model.mac_addresses, self._render_network_interface)
+
+    def _render_ip_address(self, ip_address: model.IPv4Address) -> Dict[str, Any]:
+        return {
+            "title": ip_address.ipv4,
+            "annotations": ip_address.annotations,
+            "ip_address": ip_address.ipv4,
+            "mac": ip_address.mac.mac if ip_address.mac else None,
+            "network": ip_address.network.network if ip_address.network else None,
+            "hosts": [x.host for x in ip_address.dns_lookups],
+        }
+
+    def process_ip_addresses(self) -> List[Dict[str, str]]:
+        return self._render("ip_address", self._model.ip_addresses, self._render_ip_address)
+
+    def _render_network(self, network: model.Network) -> Dict[str, Any]:
+        utilisation = network.utilisation
+        return {
+            "title": network.network,
+            "network": network.network,
+            "vlan": network.vlan or None,
+            "prefix_length": network.prefix_length,
+            "annotations": network.annotations,
+            "ip_addresses": [x.ipv4 for x in network.ip_addresses],
+            "used": utilisation.used,
+            "free": utilisation.free,
+            "utilisation": f"{utilisation.percent:.1f}",
+            # Largest first
+            "free_ranges": [f"{x.first}-{x.last}" for x in utilisation.largest_free_ranges],
+        }
+
+    def process_networks(self) -> List[Dict[str, str]]:
+        return self._render("network", self._model.networks, self._render_network)
+
+    def _render_dns_lookup(self, dns_lookup: model.DNSLookup) -> Dict[str, Any]:
+        return {
+            "title": dns_lookup.host,
+            "host": dns_lookup.host,
+            "ip_addresses": [x.ipv4 for x in dns_lookup.ip_addresses],
+            "annotations": dns_lookup.annotations,
+        }
+
+    def process_dns_lookups(self) -> List[Dict[str, str]]:
+        return self._render("dns_lookup", self._model.dns_lookups, self._render_dns_lookup)
@@ -0,0 +1,123 @@
+"""
+Description
+===========
+
+A local copy of a target's tiddler listing, with the ETag and Last-Modified of
+the listing response. The next GET of the listing is conditional, and the copy
+is only used when the server answers 304 Not Modified. Servers which send
+neither validator aren't cached.
+
+The copy must match the server exactly: a stale entry makes the planner skip a
+write it believes is unneeded, and the stock TW5 server ignores the If-Match
+precondition which would otherwise catch it. So any write or delete through
+pytw5 invalidates the copy rather than patching it, and the listing is
+downloaded in full on the next run. The copy is also downloaded in full once
+it is older than MAX_AGE.
+
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+from .config import singleton
+
+log = logging.getLogger(__name__)
+
+
+class ListingCache:
+
+    MAX_AGE = 24 * 3600.0
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._lock = threading.Lock()
+        self._tiddlers: Optional[Dict[str, Dict[str, Any]]] = None
+        self._validators: Dict[str, str] = dict()
+        self._fetched = 0.0
+        self._modified = False
+        self._invalidated = False
+        self._load()
+
+    @classmethod
+    def for_target(cls, target_name: str) -> 'ListingCache':
+        name = re.sub(r"[^\w.\-]", "_", target_name)
+        return cls(os.path.join(singleton.path, f"pytw5.listing.{name}.json"))
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def _load(self) -> None:
+        try:
+            with open(self._path, "r") as fp:
+                record = json.load(fp)
+        except FileNotFoundError:
+            return
+        except json.decoder.JSONDecodeError:
+            log.warning("Ignoring corrupt listing cache '%s'", self._path)
+            return
+        self._tiddlers = {x["title"]: x for x in record["tiddlers"]}
+        self._validators = record["validators"]
+        self._fetched = record["fetched"]
+
+    @property
+    def usable(self) -> bool:
+        return self._tiddlers is not None and time.time() - self._fetched < self.MAX_AGE
+
+    def conditional_headers(self) -> Dict[str, str]:
+        ret = dict()
+        if "etag" in self._validators:
+            ret["If-None-Match"] = self._validators["etag"]
+        if "last_modified" in self._validators:
+            ret["If-Modified-Since"] = self._validators["last_modified"]
+        return ret
+
+    @property
+    def tiddlers(self) -> Tuple[Dict[str, Any], ...]:
+        with self._lock:
+            # Copies, as callers may hold on to them while the cache is updated
+            return tuple(dict(x) for x in self._tiddlers.values())
+
+    def replace(self, tiddlers: Tuple[Dict[str, Any], ...], validators: Dict[str, str]) -> None:
+        with self._lock:
+            if self._invalidated:
+                return
+            self._tiddlers = {x["title"]: dict(x) for x in tiddlers}
+            self._validators = dict(validators)
+            self._fetched = time.time()
+            self._modified = True
+
+    def invalidate(self) -> None:
+        """
+        Drops the copy for good, e.g. once the listing has been written to.
+        """
+        with self._lock:
+            self._invalidated = True
+            self._tiddlers = None
+            self._validators = dict()
+
+    def save(self) -> None:
+        with self._lock:
+            if self._invalidated:
+                try:
+                    os.remove(self._path)
+                except FileNotFoundError:
+                    pass
+                return
+            if not self._modified or self._tiddlers is None:
+                return
+            record = {
+                "fetched": self._fetched,
+                "validators": self._validators,
+                "tiddlers": list(self._tiddlers.values()),
+            }
+            self._modified = False
+
+        temp_path = self._path + ".tmp"
+        with open(temp_path, "w") as fp:
+            json.dump(record, fp, separators=(",", ":"))
+        os.replace(temp_path, self._path)
@@ -1,2 +1,3 @@
 from .model import create_model
-from .interface import Model, MacAddress, IPv4Address, DNSLookup, Network
+from .interface import Model, MacAddress, IPv4Address, DNSLookup, Network, Entity, MacBinding, IngestError, CompactModel, FreeRange, Utilisation
+from .topology import Node, TopologyIndex
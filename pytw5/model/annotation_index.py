@@ -0,0 +1,92 @@
+from typing import Dict, Iterable, List, Optional, Set
+import bisect
+import re
+
+
+class AnnotationIndex:
+    """
+    Token level inverted index over entity annotations.
+
+    Queries are whitespace separated terms which must all match (AND). A term
+    ending in '*' matches any token starting with the preceding prefix.
+    """
+
+    RE_TOKEN = re.compile(r"[a-z0-9_][a-z0-9_.:/\-]*")
+    TRAILING_PUNCTUATION = ".:/-"
+
+    def __init__(self) -> None:
+        self._postings: Dict[str, Set[object]] = {}
+        self._sorted_tokens: Optional[List[str]] = None
+
+    @classmethod
+    def tokenise(cls, value: str) -> List[str]:
+        ret = []
+        for match in cls.RE_TOKEN.finditer(value.lower()):
+            token = match.group(0).rstrip(cls.TRAILING_PUNCTUATION)
+            if token:
+                ret.append(token)
+        return ret
+
+    def add(self, entity: object, annotation: str) -> None:
+        for token in self.tokenise(annotation):
+            try:
+                self._postings[token].add(entity)
+            except KeyError:
+                self._postings[token] = {entity}
+                self._sorted_tokens = None
+
+    def remove(self, entity: object, annotation: str, remaining: Iterable[str]) -> None:
+        """
+        Removes an annotation, keeping any tokens also in the entity's remaining annotations.
+        """
+        kept = set(token for x in remaining for token in self.tokenise(x))
+        for token in set(self.tokenise(annotation)).difference(kept):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.discard(entity)
+            if not postings:
+                del self._postings[token]
+                self._sorted_tokens = None
+
+    def _prefix_matches(self, prefix: str) -> Set[object]:
+        if self._sorted_tokens is None:
+            self._sorted_tokens = sorted(self._postings)
+        ret: Set[object] = set()
+        i = bisect.bisect_left(self._sorted_tokens, prefix)
+        while i < len(self._sorted_tokens) and self._sorted_tokens[i].startswith(prefix):
+            ret.update(self._postings[self._sorted_tokens[i]])
+            i += 1
+        return ret
+
+    def _term_matches(self, term: str) -> Set[object]:
+        prefix = term.endswith("*")
+        tokens = self.tokenise(term.rstrip("*"))
+        if not tokens:
+            # A bare '*' matches everything indexed
+            return self._prefix_matches("") if prefix else set()
+
+        # Terms such as "port#12" tokenise into several tokens, all of which must match
+        ret: Optional[Set[object]] = None
+        for i, token in enumerate(tokens):
+            if prefix and i == len(tokens) - 1:
+                matches = self._prefix_matches(token)
+            else:
+                matches = self._postings.get(token, set())
+            ret = set(matches) if ret is None else ret.intersection(matches)
+        return ret
+
+    def search(self, query: str) -> Set[object]:
+        terms = query.split()
+        if not terms:
+            return set()
+
+        # Intersect starting from the most selective term
+        matches = sorted((self._term_matches(t) for t in terms), key=len)
+        ret = set(matches[0])
+        for m in matches[1:]:
+            if not ret:
+                break
+            ret.intersection_update(m)
+        return ret
+
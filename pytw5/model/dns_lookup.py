@@ -1,21 +1,45 @@
 from . import interface
-from typing import Tuple
+from typing import AbstractSet, Iterable, List, Optional, Set, Tuple, TYPE_CHECKING
 import logging
 
+if TYPE_CHECKING:
+    from .model import Model
+
 log = logging.getLogger(__name__)
 
 
 class DnsLookup(interface.DNSLookup):
 
-    def __init__(self, host: str) -> None:
+    def __init__(self, host: str, owner: Optional['Model'] = None) -> None:
         self._host = host
+        self._owner = owner
+        self._version = 0
+        self._sources: Set[str] = set()
         self._annotations: List[str] = []
         self._ip_addresses: List[interface.IPv4Address] = []
-        log.debug(f"{self} created")
+        log.debug("%r created", self)
 
     def __repr__(self) -> str:
         return f"DnsLookup({self._host})"
 
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def internal_touch(self, sources: Iterable[str] = ()) -> bool:
+        self._version += 1
+        count = len(self._sources)
+        self._sources.update(sources)
+        return len(self._sources) != count
+
+    @property
+    def sources(self) -> Tuple[str, ...]:
+        return tuple(sorted(self._sources))
+
+    @property
+    def internal_own_sources(self) -> AbstractSet[str]:
+        return self._sources
+
     @property
     def host(self) -> str:
         return self._host
@@ -34,6 +58,8 @@ class DnsLookup(interface.DNSLookup):
         assert isinstance(value, ip_address.IpAddress)
         self._ip_addresses.append(value)
         value.internal_add_dns_lookup(self)
+        if self._owner is not None:
+            self._owner.internal_linked(self, value)
 
     @property
     def annotations(self) -> Tuple[str, ...]:
@@ -42,3 +68,5 @@ class DnsLookup(interface.DNSLookup):
     def add_annotation(self, annotation: str) -> None:
         if annotation:
             self._annotations.append(annotation)
+            if self._owner is not None:
+                self._owner.internal_annotation_added(self, annotation)
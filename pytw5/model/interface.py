@@ -1,9 +1,81 @@
 from abc import ABC, abstractmethod
-from typing import Tuple, Optional
+from typing import Any, Iterable, NamedTuple, Tuple, Optional, Union
+from .topology import TopologyIndex
+
+
+class MacBinding(NamedTuple):
+    mac: str
+    ipv4: str
+
+
+class IngestError(NamedTuple):
+    record: Any
+    reason: str
+
+
+class FreeRange(NamedTuple):
+    first: str
+    last: str
+    size: int
+
+
+class Utilisation(NamedTuple):
+    """
+    Address usage of a network. The network and broadcast addresses of IPv4
+    networks larger than a /31 are not usable.
+    """
+    usable: int
+    used: int
+    free: int
+    percent: float
+    largest_free_ranges: Tuple[FreeRange, ...]
+
+
+class CompactModel(NamedTuple):
+    """
+    A model as plain tuples, which pickle compactly between processes. Entity
+    records end with their own annotations and the sources which produced them.
+    """
+    # (network, vlan, annotations, sources)
+    networks: Tuple[Tuple[str, Optional[int], Tuple[str, ...], Tuple[str, ...]], ...] = ()
+    # (mac, annotations, sources)
+    mac_addresses: Tuple[Tuple[str, Tuple[str, ...], Tuple[str, ...]], ...] = ()
+    # (ipv4, mac, annotations, sources)
+    ip_addresses: Tuple[Tuple[str, Optional[str], Tuple[str, ...], Tuple[str, ...]], ...] = ()
+    # (host, ip addresses, annotations, sources)
+    dns_lookups: Tuple[Tuple[str, Tuple[str, ...], Tuple[str, ...], Tuple[str, ...]], ...] = ()
+    # (mac, name, ((port number, port name), ...))
+    switches: Tuple[Tuple[str, Optional[str], Tuple[Tuple[int, str], ...]], ...] = ()
+    # (mac, switch mac, port number)
+    switch_ports: Tuple[Tuple[str, str, int], ...] = ()
+
+
+class JournalEntry(NamedTuple):
+    sequence: int
+    kind: str  # created, annotation, linked, unlinked, updated or sourced
+    entities: Tuple[Any, ...]
 
 
 class DNSLookup(ABC):
 
+    @property
+    @abstractmethod
+    def version(self) -> int:
+        """
+        Incremented each time the entity, or one of its relationships, changes.
+        """
+        raise NotImplementedError()
+
+    @property
+    @abstractmethod
+    def sources(self) -> Tuple[str, ...]:
+        """
+        Names of the source instances which contributed to the entity, by
+        creating, looking up, annotating or linking it. IP addresses and
+        networks also include each other's, as their tiddlers show each other.
+        """
+        raise NotImplementedError()
+
     @property
     @abstractmethod
     def host(self) -> str:
@@ -30,6 +102,16 @@ class DNSLookup(ABC):
 
 class IPv4Address(ABC):
 
+    @property
+    @abstractmethod
+    def version(self) -> int:
+        raise NotImplementedError()
+
+    @property
+    @abstractmethod
+    def sources(self) -> Tuple[str, ...]:
+        raise NotImplementedError()
+
     @property
     @abstractmethod
     def ipv4(self) -> str:
@@ -66,6 +148,16 @@ class IPv4Address(ABC):
 
 class Network(ABC):
 
+    @property
+    @abstractmethod
+    def version(self) -> int:
+        raise NotImplementedError()
+
+    @property
+    @abstractmethod
+    def sources(self) -> Tuple[str, ...]:
+        raise NotImplementedError()
+
     @property
     @abstractmethod
     def network(self) -> str:
@@ -90,6 +182,15 @@ class Network(ABC):
     def ip_addresses(self) -> Tuple[IPv4Address, ...]:
         raise NotImplementedError()
 
+    @property
+    @abstractmethod
+    def utilisation(self) -> Utilisation:
+        """
+        Computed from the member addresses rather than the size of the
+        network, and cached until they change.
+        """
+        raise NotImplementedError()
+
     @property
     @abstractmethod
     def annotations(self) -> Tuple[str, ...]:
@@ -103,6 +204,16 @@ class Network(ABC):
 
 class MacAddress(ABC):
 
+    @property
+    @abstractmethod
+    def version(self) -> int:
+        raise NotImplementedError()
+
+    @property
+    @abstractmethod
+    def sources(self) -> Tuple[str, ...]:
+        raise NotImplementedError()
+
     @property
     @abstractmethod
     def mac(self) -> str:
@@ -122,6 +233,13 @@ class MacAddress(ABC):
     def add_annotation(self, annotation: str) -> None:
         raise NotImplementedError()
 
+    @abstractmethod
+    def remove_annotation(self, annotation: str) -> None:
+        """
+        Removes a previously added annotation, e.g. when a client moves switch port.
+        """
+        raise NotImplementedError()
+
 
 class Model(ABC):
 
@@ -160,3 +278,113 @@ class Model(ABC):
     @abstractmethod
     def get_dns_lookup(self, host: str) -> DNSLookup:
         raise NotImplementedError()
+
+    @abstractmethod
+    def set_source(self, name: Optional[str]) -> None:
+        """
+        Attributes subsequent changes, and the existing entities looked up, to
+        the named source instance.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def ingest(
+            self,
+            networks: Iterable[str] = (),
+            ip_addresses: Iterable[str] = (),
+            mac_bindings: Iterable[MacBinding] = (),
+    ) -> Tuple[IngestError, ...]:
+        """
+        Bulk load networks, IP addresses and MAC bindings (binding IP addresses
+        are created as required). Invalid records are returned rather than raised.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def compact(self) -> CompactModel:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def merge(self, other: Union['Model', CompactModel]) -> Tuple[IngestError, ...]:
+        """
+        Merges another model into this one, giving the same model as building
+        the other model's sources into this one in turn: annotations are added
+        (each source's, even if alike), sources are unioned, and IP addresses
+        are re-homed into the most specific network.
+
+        Where the models disagree the conflict is returned, and resolved as a
+        sequential build would: an IP address bound to another MAC address
+        keeps its binding (as for ingest), while a network on another VLAN or
+        a MAC address on another switch port takes the other model's (as for
+        set_vlan and set_switch_port). A source built on its own can't see
+        that its data conflicts, so it may still contribute what a sequential
+        build would have skipped (e.g. the annotations of a rejected binding).
+        """
+        raise NotImplementedError()
+
+    @property
+    @abstractmethod
+    def journal_position(self) -> int:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def journal(self, since: int = 0) -> Tuple[JournalEntry, ...]:
+        """
+        Mutations (entity created, annotation added, relationship linked, ...)
+        after the given journal position, which must be one journal_position
+        returned. An entity changed again before journal_position is next
+        read keeps its first entry, so each entity changed since any position
+        appears at least once, but not once per change.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def truncate_journal(self, position: int) -> None:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def changed_since(self, since: int) -> Tuple['Entity', ...]:
+        """
+        Entities whose rendered state may have changed after the given journal
+        position, including IP addresses whose MAC annotations changed.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def search(self, query: str) -> Tuple['Entity', ...]:
+        """
+        Search entity annotations, e.g. "switch core-sw1" or "machine web*".
+        """
+        raise NotImplementedError()
+
+    @property
+    @abstractmethod
+    def topology(self) -> TopologyIndex:
+        """
+        Adjacency index over the switches, switch ports and entities.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def add_switch(self, mac: str, name: Optional[str] = None, ports: Iterable[Tuple[int, str]] = ()) -> None:
+        """
+        Adds a switch node, keyed by its MAC address and labelled with its
+        name (which may be missing, or shared by switches on other sites),
+        linked to its own MAC address and (port number, port name) nodes.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def set_switch_port(self, mac: str, switch_mac: str, port: int) -> None:
+        """
+        Connects a MAC address to a port of the switch with the given MAC
+        address, replacing any previous port.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def clear_switch_port(self, mac: str) -> None:
+        raise NotImplementedError()
+
+
+Entity = Union[MacAddress, IPv4Address, Network, DNSLookup]
@@ -1,25 +1,56 @@
 from . import interface
-from typing import Optional, cast, Tuple
+from typing import AbstractSet, Iterable, List, Optional, Set, cast, Tuple, TYPE_CHECKING
 import ipaddress
 import logging
 
+if TYPE_CHECKING:
+    from .model import Model
+
 log = logging.getLogger(__name__)
 
 
 class IpAddress(interface.IPv4Address):
 
-    def __init__(self, ipv4: str, network: Optional[interface.Network]) -> None:
+    def __init__(self, ipv4: str, network: Optional[interface.Network], owner: Optional['Model'] = None) -> None:
         self._ipv4 = ipv4
+        self._owner = owner
+        self._version = 0
+        self._sources: Set[str] = set()
         if network is not None:
             assert isinstance(network, interface.Network)
         self._network = network
         self._mac: Optional[interface.MacAddress] = None
         self._annotations: List[str] = []
         self._dns_lookups: List[interface.DNSLookup] = []
-        log.debug(f"{self} created")
+        log.debug("%r created", self)
 
     def __repr__(self) -> str:
-        return f"IpAddress(ipv4={self._ipv4}, network={self._network}) created"
+        return f"IpAddress(ipv4={self._ipv4}, network={self._network})"
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def internal_touch(self, sources: Iterable[str] = ()) -> bool:
+        self._version += 1
+        count = len(self._sources)
+        self._sources.update(sources)
+        return len(self._sources) != count
+
+    @property
+    def sources(self) -> Tuple[str, ...]:
+        # Includes the mac address sources, as we pull in its annotations,
+        # and the network's own sources, as we show which network we are in
+        x = set(self._sources)
+        if self._mac:
+            x.update(self._mac.sources)
+        if self._network:
+            x.update(self._network.internal_own_sources)
+        return tuple(sorted(x))
+
+    @property
+    def internal_own_sources(self) -> AbstractSet[str]:
+        return self._sources
 
     @property
     def dns_lookups(self) -> Tuple[interface.DNSLookup, ...]:
@@ -52,6 +83,8 @@ class IpAddress(interface.IPv4Address):
         else:
             value.internal_add_ip_address(value=cast(interface.MacAddress, self))
             self._mac = value
+            if self._owner is not None:
+                self._owner.internal_linked(self, value)
 
     @property
     def annotations(self) -> Tuple[str, ...]:
@@ -62,6 +95,12 @@ class IpAddress(interface.IPv4Address):
             x.extend(self._mac.annotations)
         return tuple(sorted(x))
 
+    @property
+    def internal_own_annotations(self) -> Tuple[str, ...]:
+        return tuple(sorted(self._annotations))
+
     def add_annotation(self, annotation: str) -> None:
         if annotation:
             self._annotations.append(annotation)
+            if self._owner is not None:
+                self._owner.internal_annotation_added(self, annotation)
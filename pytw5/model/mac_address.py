@@ -1,25 +1,49 @@
 from . import interface
-from typing import List, Tuple
+from typing import AbstractSet, Dict, Iterable, List, Optional, Set, Tuple, TYPE_CHECKING
 import logging
 
+if TYPE_CHECKING:
+    from .model import Model
+
 log = logging.getLogger(__name__)
 
 
 class MacAddress(interface.MacAddress):
 
-    def __init__(self, mac: str) -> None:
+    def __init__(self, mac: str, owner: Optional['Model'] = None) -> None:
         self._mac = mac
-        self._ip_addresses: List[interface.IPv4Address] = []
+        self._owner = owner
+        self._version = 0
+        self._sources: Set[str] = set()
+        self._ip_addresses: Dict[str, interface.IPv4Address] = {}
         self._annotations: List[str] = []
-        log.debug(f"{self} created")
+        log.debug("%r created", self)
     
     def __repr__(self) -> str:
         return f"MacAddress({self._mac})"
 
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def internal_touch(self, sources: Iterable[str] = ()) -> bool:
+        self._version += 1
+        count = len(self._sources)
+        self._sources.update(sources)
+        return len(self._sources) != count
+
+    @property
+    def sources(self) -> Tuple[str, ...]:
+        return tuple(sorted(self._sources))
+
+    @property
+    def internal_own_sources(self) -> AbstractSet[str]:
+        return self._sources
+
     def internal_add_ip_address(self, value: interface.IPv4Address) -> None:
         assert isinstance(value, interface.IPv4Address)
-        assert value.ipv4 not in [x.ipv4 for x in self._ip_addresses]
-        self._ip_addresses.append(value)
+        assert value.ipv4 not in self._ip_addresses
+        self._ip_addresses[value.ipv4] = value
 
     @property
     def mac(self) -> str:
@@ -27,7 +51,7 @@ class MacAddress(interface.MacAddress):
 
     @property
     def ip_addresses(self) -> Tuple[interface.IPv4Address, ...]:
-        return tuple(sorted(self._ip_addresses, key=lambda x: x.ipv4))
+        return tuple(sorted(self._ip_addresses.values(), key=lambda x: x.ipv4))
 
     @property
     def annotations(self) -> Tuple[str, ...]:
@@ -36,3 +60,13 @@ class MacAddress(interface.MacAddress):
     def add_annotation(self, annotation: str) -> None:
         if annotation:
             self._annotations.append(annotation)
+            if self._owner is not None:
+                self._owner.internal_annotation_added(self, annotation)
+
+    def remove_annotation(self, annotation: str) -> None:
+        try:
+            self._annotations.remove(annotation)
+        except ValueError:
+            return
+        if self._owner is not None:
+            self._owner.internal_annotation_removed(self, annotation)
@@ -3,7 +3,9 @@ from .mac_address import MacAddress
 from .network import Network
 from .ip_address import IpAddress
 from .dns_lookup import DnsLookup
-from typing import Dict, cast, Optional, Tuple
+from .annotation_index import AnnotationIndex
+from .topology import Node, TopologyIndex
+from typing import Dict, Iterable, List, Set, cast, Optional, Tuple, Union
 import ipaddress
 
 
@@ -14,6 +16,17 @@ class Model(interface.Model):
         self._network_lookup: Dict[str, Network] = {}
         self._ip_address_lookup: Dict[str, IpAddress] = {}
         self._dns_lookups: Dict[str, DnsLookup] = {}
+        self._annotation_index = AnnotationIndex()
+        self._journal_entries: List[interface.JournalEntry] = []
+        self._journal_base = 0
+        # The latest position handed out, and the sequence of each entity's latest entry
+        self._journal_read = 0
+        self._journal_recorded: Dict[object, int] = {}
+        self._source: Optional[str] = None
+        self._source_names: Tuple[str, ...] = ()
+        self._topology = TopologyIndex()
+        # The switch port node each MAC address is connected to
+        self._switch_ports: Dict[str, Node] = {}
 
     @property
     def mac_addresses(self) -> Tuple[interface.MacAddress, ...]:
@@ -22,11 +35,14 @@ class Model(interface.Model):
     def get_mac(self, mac: str) -> interface.MacAddress:
         assert mac == mac.lower()
         try:
-            return cast(interface.MacAddress, self._mac_lookup[mac])
+            m = self._mac_lookup[mac]
         except KeyError:
-            m = MacAddress(mac=mac)
+            m = MacAddress(mac=mac, owner=self)
             self._mac_lookup[mac] = m
+            self._journal("created", m)
             return cast(interface.MacAddress, m)
+        self._reported(m)
+        return cast(interface.MacAddress, m)
 
     @property
     def networks(self) -> Tuple[interface.Network, ...]:
@@ -34,24 +50,31 @@ class Model(interface.Model):
 
     def get_network(self, network: str) -> interface.Network:
         try:
-            return cast(interface.Network, self._network_lookup[network])
+            n = self._network_lookup[network]
         except KeyError:
-            n = Network(network)
+            n = Network(network, owner=self)
             self._network_lookup[network] = n
-            # Capture IP addresses
+            self._journal("created", n)
+            # Capture IP addresses, unless they are in a more specific network
             for ip_address in self._ip_address_lookup.values():
-                if n.internal_contains_ip_address(ipaddress.ip_address(ip_address.ipv4)):
-                    ip_address.internal_set_network(n)
-                    n.internal_add_ip_address(ip_address)
+                if n.internal_contains_ip_address(ipaddress.ip_address(ip_address.ipv4)) and \
+                        (ip_address.network is None or ip_address.network.prefix_length < n.prefix_length):
+                    self._internal_set_network(ip_address, n)
 
             return cast(interface.Network, n)
+        self._reported(n)
+        return cast(interface.Network, n)
 
     def internal_find_network(self, ip_address: str) -> Optional[Network]:
+        """
+        The most specific network containing the IP address.
+        """
         i = ipaddress.ip_address(ip_address)
+        ret = None
         for n in self._network_lookup.values():
-            if n.internal_contains_ip_address(i):
-                return n
-        return None
+            if n.internal_contains_ip_address(i) and (ret is None or n.prefix_length > ret.prefix_length):
+                ret = n
+        return ret
 
     @property
     def ip_addresses(self) -> Tuple[interface.IPv4Address, ...]:
@@ -59,15 +82,18 @@ class Model(interface.Model):
 
     def get_ip_address(self, ip_address: str) -> interface.IPv4Address:
         try:
-            return cast(interface.IPv4Address, self._ip_address_lookup[ip_address])
+            i = self._ip_address_lookup[ip_address]
         except KeyError:
             # Find the network...
             n = self.internal_find_network(ip_address)
-            i = IpAddress(ipv4=ip_address, network=n)
-            if n:
-                n.internal_add_ip_address(i)
+            i = IpAddress(ipv4=ip_address, network=None, owner=self)
             self._ip_address_lookup[ip_address] = i
+            self._journal("created", i)
+            if n:
+                self._internal_set_network(i, n)
             return cast(interface.IPv4Address, i)
+        self._reported(i)
+        return cast(interface.IPv4Address, i)
 
     @property
     def dns_lookups(self) -> Tuple[interface.DNSLookup]:
@@ -75,11 +101,382 @@ class Model(interface.Model):
 
     def get_dns_lookup(self, host: str) -> interface.DNSLookup:
         try:
-            return cast(interface.DNSLookup, self._dns_lookups[host])
+            d = self._dns_lookups[host]
         except KeyError:
-            d = DnsLookup(host)
+            d = DnsLookup(host, owner=self)
             self._dns_lookups[host] = d
+            self._journal("created", d)
             return cast(interface.DNSLookup, d)
+        self._reported(d)
+        return cast(interface.DNSLookup, d)
+
+    def set_source(self, name: Optional[str]) -> None:
+        self._source = name
+        self._source_names = () if name is None else (name,)
+
+    def _reported(self, entity: interface.Entity) -> None:
+        """
+        Attributes an existing entity to the current source, as if the source
+        had created it. The sources of an entity then don't depend on which
+        source happened to create it, so building the sources into one model
+        in turn or merging a model per source gives the same result.
+
+        Called for every lookup of an existing entity, so the check is a set
+        membership test against the entity's own sources, uncopied.
+        """
+        if self._source is not None and self._source not in entity.internal_own_sources:
+            self._journal("updated", entity)
+
+    def ingest(
+            self,
+            networks: Iterable[str] = (),
+            ip_addresses: Iterable[str] = (),
+            mac_bindings: Iterable[interface.MacBinding] = (),
+    ) -> Tuple[interface.IngestError, ...]:
+        errors: List[interface.IngestError] = []
+        mac_bindings = tuple(mac_bindings)
+
+        networks_added = False
+        for network in networks:
+            if network in self._network_lookup:
+                self._reported(self._network_lookup[network])
+                continue
+            try:
+                n = Network(network, owner=self)
+            except ValueError as e:
+                errors.append(interface.IngestError(network, str(e)))
+                continue
+            self._network_lookup[network] = n
+            self._journal("created", n)
+            networks_added = True
+
+        new_ip_addresses: List[IpAddress] = []
+        bad_ip_addresses = set()
+        for ip_address in list(ip_addresses) + [x.ipv4 for x in mac_bindings]:
+            if ip_address in self._ip_address_lookup:
+                self._reported(self._ip_address_lookup[ip_address])
+                continue
+            if ip_address in bad_ip_addresses:
+                continue
+            try:
+                ipaddress.ip_address(ip_address)
+            except ValueError as e:
+                errors.append(interface.IngestError(ip_address, str(e)))
+                bad_ip_addresses.add(ip_address)
+                continue
+            i = IpAddress(ipv4=ip_address, network=None, owner=self)
+            self._ip_address_lookup[ip_address] = i
+            self._journal("created", i)
+            new_ip_addresses.append(i)
+
+        # New networks may be more specific than those existing addresses were assigned to
+        self._internal_assign_networks(
+            self._ip_address_lookup.values() if networks_added else new_ip_addresses
+        )
+
+        for binding in mac_bindings:
+            if binding.ipv4 in bad_ip_addresses:
+                continue
+            if binding.mac != binding.mac.lower():
+                errors.append(interface.IngestError(binding, "MAC address must be lower case"))
+                continue
+            i = self._ip_address_lookup[binding.ipv4]
+            if i.mac is not None and i.mac.mac != binding.mac:
+                errors.append(interface.IngestError(
+                    binding, f"IP address {binding.ipv4} is already bound to {i.mac.mac}"
+                ))
+                continue
+            i.set_mac(self.get_mac(binding.mac))
+
+        return tuple(errors)
+
+    def _internal_assign_networks(self, ip_addresses: Iterable[IpAddress]) -> None:
+        """
+        Assigns each IP address to its most specific network in a single merge
+        sweep over the sorted addresses and the sorted networks. CIDR networks
+        either nest or are disjoint, so the open networks form a stack with the
+        most specific on top.
+        """
+        ordered_ip_addresses = sorted(
+            ((self._sweep_key(ipaddress.ip_address(x.ipv4)), x) for x in ip_addresses),
+            key=lambda x: x[0],
+        )
+        ordered_networks = sorted(
+            (
+                (
+                    self._sweep_key(n.internal_parsed_network.network_address),
+                    n.prefix_length,
+                    self._sweep_key(n.internal_parsed_network.broadcast_address),
+                    n,
+                )
+                for n in self._network_lookup.values()
+            ),
+            key=lambda x: (x[0], x[1]),
+        )
+
+        stack: List[Tuple[Tuple[int, int], Network]] = []
+        j = 0
+        for key, ip_address in ordered_ip_addresses:
+            while j < len(ordered_networks) and ordered_networks[j][0] <= key:
+                start, _, end, n = ordered_networks[j]
+                while stack and stack[-1][0] < start:
+                    stack.pop()
+                stack.append((end, n))
+                j += 1
+            while stack and stack[-1][0] < key:
+                stack.pop()
+            if not stack:
+                continue
+
+            self._internal_set_network(ip_address, stack[-1][1])
+
+    # Merging
+
+    def compact(self) -> interface.CompactModel:
+        switches = []
+        for switch in self._topology.nodes:
+            if switch.kind != "switch":
+                continue
+            ports = sorted(
+                (int(x.key.rpartition("#")[2]), self._topology.label(x))
+                for x in self._topology.neighbours(switch, "port")
+            )
+            switches.append((switch.key, self._topology.label(switch) or None, tuple(ports)))
+
+        return interface.CompactModel(
+            networks=tuple(
+                (x.network, x.vlan, x.annotations, tuple(sorted(x.internal_own_sources)))
+                for x in self._network_lookup.values()
+            ),
+            mac_addresses=tuple(
+                (x.mac, x.annotations, tuple(sorted(x.internal_own_sources))) for x in self._mac_lookup.values()
+            ),
+            ip_addresses=tuple(
+                (x.ipv4, x.mac.mac if x.mac else None, x.internal_own_annotations, tuple(sorted(x.internal_own_sources)))
+                for x in self._ip_address_lookup.values()
+            ),
+            dns_lookups=tuple(
+                (x.host, tuple(i.ipv4 for i in x.ip_addresses), x.annotations, tuple(sorted(x.internal_own_sources)))
+                for x in self._dns_lookups.values()
+            ),
+            switches=tuple(switches),
+            switch_ports=tuple(
+                (mac, port.key.rpartition("#")[0], int(port.key.rpartition("#")[2]))
+                for mac, port in self._switch_ports.items()
+            ),
+        )
+
+    def merge(self, other: Union[interface.Model, interface.CompactModel]) -> Tuple[interface.IngestError, ...]:
+        if not isinstance(other, interface.CompactModel):
+            other = other.compact()
+
+        # Networks first, so each IP address is placed in its most specific network in one sweep
+        errors = list(self.ingest(
+            networks=(x[0] for x in other.networks),
+            ip_addresses=(x[0] for x in other.ip_addresses),
+            mac_bindings=(interface.MacBinding(mac=mac, ipv4=ipv4) for ipv4, mac, _, _ in other.ip_addresses if mac),
+        ))
+
+        for network, vlan, annotations, sources in other.networks:
+            n = self._network_lookup[network]
+            # The later VLAN wins, as it does for set_vlan
+            if vlan is not None and vlan != n.vlan:
+                if n.vlan is not None:
+                    errors.append(interface.IngestError(network, f"Network {network} moved from VLAN {n.vlan} to {vlan}"))
+                n.set_vlan(vlan)
+            self._merge_entity(n, annotations, sources)
+
+        for mac, annotations, sources in other.mac_addresses:
+            self._merge_entity(self.get_mac(mac), annotations, sources)
+
+        for ipv4, _, annotations, sources in other.ip_addresses:
+            self._merge_entity(self._ip_address_lookup[ipv4], annotations, sources)
+
+        for host, ip_addresses, annotations, sources in other.dns_lookups:
+            d = cast(DnsLookup, self.get_dns_lookup(host))
+            for ipv4 in ip_addresses:
+                d.add_ip_address(self._ip_address_lookup[ipv4])
+            self._merge_entity(d, annotations, sources)
+
+        for mac, name, ports in other.switches:
+            self.add_switch(mac, name, ports)
+
+        # The later port wins, as it does for set_switch_port
+        for mac, switch, port in other.switch_ports:
+            current = self._switch_ports.get(mac)
+            if current is not None and current != Node.port(switch, port):
+                errors.append(interface.IngestError(
+                    (mac, switch, port), f"MAC address {mac} moved from {current.key} to {switch}#{port}"
+                ))
+            self.set_switch_port(mac, switch, port)
+
+        return tuple(errors)
+
+    def _merge_entity(self, entity: interface.Entity, annotations: Iterable[str], sources: Tuple[str, ...]) -> None:
+        # Every annotation, as two sources annotating an entity alike both show
+        for annotation in annotations:
+            entity.add_annotation(annotation)
+        if not entity.internal_own_sources.issuperset(sources):
+            self._journal("updated", entity, sources=sources)
+
+    def _internal_set_network(self, ip_address: IpAddress, network: Network) -> None:
+        old = ip_address.network
+        if old is network:
+            return
+        # Not attributed to the current source. Which network an address is in
+        # depends on every network, not on the source which happened to add the
+        # last one, so their sources are shared through IpAddress.sources and
+        # Network.sources instead.
+        if old is not None:
+            old.internal_remove_ip_address(ip_address)
+            self._journal("unlinked", ip_address, old, sources=())
+        ip_address.internal_set_network(network)
+        network.internal_add_ip_address(ip_address)
+        self._journal("linked", ip_address, network, sources=())
+
+    @staticmethod
+    def _sweep_key(value: Union[ipaddress.IPv4Address, ipaddress.IPv6Address]) -> Tuple[int, int]:
+        return value.version, int(value)
+
+    # Journal
+
+    def _journal(self, kind: str, *entities: interface.Entity, sources: Optional[Tuple[str, ...]] = None) -> None:
+        """
+        Records a change to the entities, attributed to the given sources (by
+        default the current source).
+        """
+        if sources is None:
+            sources = self._source_names
+        # IP addresses and networks show each other's sources
+        dependants: List[interface.Entity] = []
+        for entity in entities:
+            if not entity.internal_touch(sources):
+                continue
+            if isinstance(entity, IpAddress) and entity.network is not None:
+                dependants.append(entity.network)
+            elif isinstance(entity, Network):
+                dependants.extend(entity.ip_addresses)
+
+        # Relationship changes are mirrored in the topology index
+        if kind == "created":
+            self._topology.add(self._node(entities[0]))
+        elif kind == "linked":
+            self._topology.link(self._node(entities[0]), self._node(entities[1]))
+        elif kind == "unlinked":
+            self._topology.unlink(self._node(entities[0]), self._node(entities[1]))
+
+        self._record(kind, entities)
+        if dependants:
+            self._record("sourced", tuple(dependants))
+
+    def _record(self, kind: str, entities: Tuple[interface.Entity, ...]) -> None:
+        """
+        Appends a journal entry, unless every entity already has one after the
+        latest position handed out. The journal is only read from positions
+        handed out, so the entry would add nothing: an entity changed many
+        times between reads (e.g. while a source is applied) has one entry.
+        """
+        recorded = self._journal_recorded
+        for entity in entities:
+            if recorded.get(entity, 0) <= self._journal_read:
+                break
+        else:
+            return
+        sequence = self._journal_base + len(self._journal_entries) + 1
+        for entity in entities:
+            recorded[entity] = sequence
+        self._journal_entries.append(interface.JournalEntry(sequence=sequence, kind=kind, entities=entities))
+
+    @property
+    def journal_position(self) -> int:
+        self._journal_read = self._journal_base + len(self._journal_entries)
+        return self._journal_read
+
+    def journal(self, since: int = 0) -> Tuple[interface.JournalEntry, ...]:
+        assert since >= self._journal_base, f"Journal truncated at {self._journal_base}"
+        return tuple(self._journal_entries[since - self._journal_base:])
+
+    def truncate_journal(self, position: int) -> None:
+        position = min(position, self.journal_position)
+        if position > self._journal_base:
+            del self._journal_entries[:position - self._journal_base]
+            self._journal_base = position
+        if not self._journal_entries:
+            self._journal_recorded.clear()
+
+    def changed_since(self, since: int) -> Tuple[interface.Entity, ...]:
+        ret: Set[interface.Entity] = set()
+        for entry in self.journal(since):
+            for entity in entry.entities:
+                ret.add(entity)
+                # IP addresses inherit their MAC annotations
+                if isinstance(entity, MacAddress):
+                    ret.update(entity.ip_addresses)
+        return tuple(ret)
+
+    def internal_annotation_added(self, entity: interface.Entity, annotation: str) -> None:
+        self._annotation_index.add(entity, annotation)
+        self._journal("annotation", entity)
+
+    def internal_annotation_removed(self, entity: interface.Entity, annotation: str) -> None:
+        self._annotation_index.remove(entity, annotation, entity.annotations)
+        self._journal("annotation", entity)
+
+    def internal_linked(self, a: interface.Entity, b: interface.Entity) -> None:
+        self._journal("linked", a, b)
+
+    def internal_updated(self, entity: interface.Entity) -> None:
+        self._journal("updated", entity)
+
+    def search(self, query: str) -> Tuple[interface.Entity, ...]:
+        return tuple(sorted(self._annotation_index.search(query), key=repr))
+
+    # Topology
+
+    # Called for every journal entry, so dispatched on the exact type
+    _NODE_KEYS = {
+        MacAddress: ("mac", lambda x: x.mac),
+        IpAddress: ("ip", lambda x: x.ipv4),
+        Network: ("network", lambda x: x.network),
+        DnsLookup: ("dns", lambda x: x.host),
+    }
+
+    @classmethod
+    def _node(cls, entity: interface.Entity) -> Node:
+        kind, key = cls._NODE_KEYS[type(entity)]
+        return Node(kind, key(entity))
+
+    @property
+    def topology(self) -> TopologyIndex:
+        return self._topology
+
+    def add_switch(self, mac: str, name: Optional[str] = None, ports: Iterable[Tuple[int, str]] = ()) -> None:
+        switch = Node("switch", mac)
+        self._topology.add(switch, label=name)
+        self.get_mac(mac)
+        self._topology.link(Node("mac", mac), switch)
+        for port_num, port_name in ports:
+            port = Node.port(mac, port_num)
+            self._topology.add(port, label=port_name)
+            self._topology.link(switch, port)
+
+    def set_switch_port(self, mac: str, switch_mac: str, port: int) -> None:
+        port_node = Node.port(switch_mac, port)
+        current = self._switch_ports.get(mac)
+        if current == port_node:
+            return
+        self.get_mac(mac)
+        if current is not None:
+            self._topology.unlink(Node("mac", mac), current)
+        if port_node not in self._topology:
+            self._topology.link(Node("switch", switch_mac), port_node)
+        self._topology.link(port_node, Node("mac", mac))
+        self._switch_ports[mac] = port_node
+
+    def clear_switch_port(self, mac: str) -> None:
+        current = self._switch_ports.pop(mac, None)
+        if current is not None:
+            self._topology.unlink(Node("mac", mac), current)
 
 
 def create_model() -> interface.Model:
@@ -1,20 +1,33 @@
 from . import interface
-from typing import Optional, Tuple
+from typing import AbstractSet, Dict, Iterable, List, Optional, Set, Tuple, Union, TYPE_CHECKING
+import heapq
 import ipaddress
 import logging
 
+if TYPE_CHECKING:
+    from .model import Model
+
 log = logging.getLogger(__name__)
 
 
 class Network(interface.Network):
 
-    def __init__(self, network: str) -> None:
+    LARGEST_FREE_RANGES = 3
+
+    def __init__(self, network: str, owner: Optional['Model'] = None) -> None:
         self._parsed_network = ipaddress.ip_network(network)
         self._network = network
+        self._owner = owner
+        self._version = 0
+        self._sources: Set[str] = set()
         self._vlan: Optional[int] = None
-        self._ip_addresses: List[interface.IPv4Address] = []
+        # Keyed by ipv4
+        self._ip_addresses: Dict[str, interface.IPv4Address] = {}
         self._annotations: List[str] = []
-        log.debug(f"{self} created")
+        # Bumped when the member addresses change, to invalidate the utilisation
+        self._membership = 0
+        self._utilisation: Optional[Tuple[int, interface.Utilisation]] = None
+        log.debug("%r created", self)
 
     @property
     def prefix_length(self) -> int:
@@ -23,12 +36,43 @@ class Network(interface.Network):
     def __repr__(self) -> str:
         return f"Network({self._network})"
 
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def internal_touch(self, sources: Iterable[str] = ()) -> bool:
+        self._version += 1
+        count = len(self._sources)
+        self._sources.update(sources)
+        return len(self._sources) != count
+
+    @property
+    def sources(self) -> Tuple[str, ...]:
+        # Includes the sources of the member addresses, as we list them
+        x = set(self._sources)
+        for ip_address in self._ip_addresses.values():
+            x.update(ip_address.internal_own_sources)
+        return tuple(sorted(x))
+
+    @property
+    def internal_own_sources(self) -> AbstractSet[str]:
+        return self._sources
+
     def internal_contains_ip_address(self, value: ipaddress.ip_address) -> bool:
         return value in self._parsed_network
 
     def internal_add_ip_address(self, value: interface.IPv4Address) -> None:
-        assert value.ipv4 not in [x.ipv4 for x in self._ip_addresses]
-        self._ip_addresses.append(value)
+        assert value.ipv4 not in self._ip_addresses
+        self._ip_addresses[value.ipv4] = value
+        self._membership += 1
+
+    def internal_remove_ip_address(self, value: interface.IPv4Address) -> None:
+        del self._ip_addresses[value.ipv4]
+        self._membership += 1
+
+    @property
+    def internal_parsed_network(self) -> Union[ipaddress.IPv4Network, ipaddress.IPv6Network]:
+        return self._parsed_network
 
     @property
     def network(self) -> str:
@@ -39,11 +83,61 @@ class Network(interface.Network):
         return self._vlan
 
     def set_vlan(self, value: int) -> None:
-        self._vlan = value
+        if value != self._vlan:
+            self._vlan = value
+            if self._owner is not None:
+                self._owner.internal_updated(self)
 
     @property
     def ip_addresses(self) -> Tuple[interface.IPv4Address, ...]:
-        return tuple(self._ip_addresses)
+        return tuple(sorted(self._ip_addresses.values(), key=lambda x: x.ipv4))
+
+    @property
+    def utilisation(self) -> interface.Utilisation:
+        if self._utilisation is None or self._utilisation[0] != self._membership:
+            self._utilisation = (self._membership, self._compute_utilisation())
+        return self._utilisation[1]
+
+    def _usable_bounds(self) -> Tuple[int, int]:
+        n = self._parsed_network
+        first, last = int(n.network_address), int(n.broadcast_address)
+        if n.version == 4 and n.prefixlen < 31:
+            return first + 1, last - 1
+        return first, last
+
+    def _compute_utilisation(self) -> interface.Utilisation:
+        """
+        Range arithmetic over the sorted member addresses, so the cost depends
+        on the number of members rather than the size of the network.
+        """
+        first, last = self._usable_bounds()
+        used = sorted(
+            x for x in (int(ipaddress.ip_address(ipv4)) for ipv4 in self._ip_addresses)
+            if first <= x <= last
+        )
+        usable = last - first + 1
+
+        # The gaps before, between and after the used addresses
+        gaps = []
+        previous = first - 1
+        for address in used + [last + 1]:
+            if address > previous + 1:
+                gaps.append((previous + 1, address - 1))
+            previous = address
+        # Largest first, the lowest address breaking ties
+        largest = heapq.nlargest(self.LARGEST_FREE_RANGES, gaps, key=lambda x: (x[1] - x[0], -x[0]))
+
+        address = type(self._parsed_network.network_address)
+        return interface.Utilisation(
+            usable=usable,
+            used=len(used),
+            free=usable - len(used),
+            percent=100.0 * len(used) / usable,
+            largest_free_ranges=tuple(
+                interface.FreeRange(first=str(address(a)), last=str(address(b)), size=b - a + 1)
+                for a, b in largest
+            ),
+        )
 
     @property
     def annotations(self) -> Tuple[str, ...]:
@@ -52,3 +146,5 @@ class Network(interface.Network):
     def add_annotation(self, annotation: str) -> None:
         if annotation:
             self._annotations.append(annotation)
+            if self._owner is not None:
+                self._owner.internal_annotation_added(self, annotation)
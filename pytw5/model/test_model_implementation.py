@@ -1,5 +1,6 @@
 import unittest
 import pytw5.model
+from pytw5 import schedule
 
 
 class TestModelImplementation(unittest.TestCase):
@@ -16,4 +17,362 @@ class TestModelImplementation(unittest.TestCase):
         assert ipv4_obj.ipv4 in [x.ipv4 for x in n.ip_addresses]
         d = model.get_dns_lookup("a.b.c")
         d.add_ip_address(ipv4_obj)
-        
\ No newline at end of file
+        
+    def test_annotation_search(self) -> None:
+        model = pytw5.model.create_model()
+        sw = model.get_mac("aa:00:00:00:00:01")
+        sw.add_annotation("Connected to switch core-sw1 port #12 - Rack A")
+        vm = model.get_mac("aa:00:00:00:00:02")
+        vm.add_annotation("Attached to virtual machine web01")
+        n = model.get_network("192.168.1.0/24")
+        n.add_annotation("Web servers")
+
+        self.assertEqual((sw,), model.search("switch core-sw1"))
+        self.assertEqual((sw,), model.search("SWITCH port#12"))
+        self.assertEqual((vm,), model.search("machine web*"))
+        self.assertEqual((), model.search("switch web*"))
+        self.assertEqual({vm, n}, set(model.search("web*")))
+
+    def test_remove_annotation(self) -> None:
+        model = pytw5.model.create_model()
+        mac = model.get_mac("aa:00:00:00:00:01")
+        ip = model.get_ip_address("10.0.0.1")
+        ip.set_mac(mac)
+        mac.add_annotation("Connected to switch core-sw1 port #12 - Rack A")
+        mac.add_annotation("Attached to virtual machine core-vm")
+        position = model.journal_position
+
+        mac.remove_annotation("Connected to switch core-sw1 port #12 - Rack A")
+        mac.add_annotation("Connected to switch core-sw2 port #3 - Rack B")
+        self.assertEqual((), model.search("core-sw1"))
+        self.assertEqual((mac,), model.search("core-sw2"))
+        # Tokens shared with the remaining annotations are still indexed
+        self.assertEqual((mac,), model.search("core*"))
+        self.assertNotIn("Connected to switch core-sw1 port #12 - Rack A", ip.annotations)
+        self.assertEqual({mac, ip}, set(model.changed_since(position)))
+
+        # Removing an unknown annotation is a no-op
+        position = model.journal_position
+        mac.remove_annotation("Not an annotation")
+        self.assertEqual((), model.journal(position))
+
+    def test_topology(self) -> None:
+        model = pytw5.model.create_model()
+        Node = pytw5.model.Node
+        model.add_switch("aa:00:00:00:00:f1", name="core-sw1", ports=[(12, "Rack A"), (13, "Rack B")])
+        mac = model.get_mac("aa:00:00:00:00:01")
+        ip = model.get_ip_address("10.0.0.1")
+        ip.set_mac(mac)
+        model.get_dns_lookup("web01.example.com").add_ip_address(ip)
+        model.get_network("10.0.0.0/24")
+        model.set_switch_port(mac.mac, "aa:00:00:00:00:f1", 12)
+
+        port = Node.port("aa:00:00:00:00:f1", 12)
+        self.assertEqual("Rack A", model.topology.label(port))
+        self.assertEqual((Node("mac", mac.mac),), model.topology.neighbours(port, "mac"))
+        self.assertEqual(
+            {port, Node("mac", mac.mac), Node("ip", "10.0.0.1"), Node("dns", "web01.example.com")},
+            set(model.topology.traverse(port, downstream=True)),
+        )
+        # Networks are reached by an undirected traversal
+        self.assertIn(Node("network", "10.0.0.0/24"), model.topology.traverse(port))
+
+        # Moving port replaces the edge
+        model.set_switch_port(mac.mac, "aa:00:00:00:00:f1", 13)
+        self.assertEqual((), model.topology.neighbours(port, "mac"))
+        self.assertEqual((port,), model.topology.traverse(port, downstream=True))
+        model.clear_switch_port(mac.mac)
+        self.assertEqual((), model.topology.neighbours(Node("mac", mac.mac), "port"))
+
+    def test_switch_names(self) -> None:
+        model = pytw5.model.create_model()
+        Node = pytw5.model.Node
+        # An unadopted switch has no name, and switches on two sites share one
+        model.add_switch("aa:00:00:00:00:f1", ports=[(1, "Port 1")])
+        model.add_switch("aa:00:00:00:00:f2", name="core-sw1", ports=[(1, "Port 1")])
+        model.add_switch("aa:00:00:00:00:f3", name="core-sw1", ports=[(1, "Port 1")])
+        model.set_switch_port("aa:00:00:00:00:01", "aa:00:00:00:00:f2", 1)
+        model.set_switch_port("aa:00:00:00:00:02", "aa:00:00:00:00:f3", 1)
+
+        switches = sorted(x for x in model.topology.nodes if x.kind == "switch")
+        self.assertEqual(["aa:00:00:00:00:f1", "aa:00:00:00:00:f2", "aa:00:00:00:00:f3"], [x.key for x in switches])
+        self.assertEqual(["", "core-sw1", "core-sw1"], [model.topology.label(x) for x in switches])
+        self.assertEqual(
+            (Node("mac", "aa:00:00:00:00:02"),),
+            model.topology.neighbours(Node.port("aa:00:00:00:00:f3", 1), "mac"),
+        )
+
+        # Every output orders the nodes
+        self.assertIn('"switch:aa:00:00:00:00:f1"', model.topology.to_json())
+        self.assertIn('label="aa:00:00:00:00:f2\\ncore-sw1"', model.topology.to_dot())
+        compact = model.compact()
+        self.assertEqual(
+            (("aa:00:00:00:00:f1", None, ((1, "Port 1"),)), ("aa:00:00:00:00:f2", "core-sw1", ((1, "Port 1"),))),
+            tuple(sorted(compact.switches))[:2],
+        )
+        self.assertEqual(schedule.digest(compact), schedule.digest(compact._replace(switches=compact.switches[::-1])))
+
+        copy = pytw5.model.create_model()
+        self.assertEqual((), copy.merge(compact))
+        self.assertEqual(sorted(compact.switches), sorted(copy.compact().switches))
+
+    def test_ingest(self) -> None:
+        model = pytw5.model.create_model()
+        outer = model.get_ip_address("10.1.0.5")
+        errors = model.ingest(
+            networks=["10.0.0.0/8", "10.1.0.0/16", "10.2.0.0/24", "bad"],
+            ip_addresses=["10.2.0.1", "10.3.0.1", "192.168.0.1"],
+            mac_bindings=[
+                pytw5.model.MacBinding(mac="aa:00:00:00:00:01", ipv4="10.2.0.1"),
+                pytw5.model.MacBinding(mac="aa:00:00:00:00:02", ipv4="10.2.0.1"),
+                pytw5.model.MacBinding(mac="aa:00:00:00:00:03", ipv4="10.2.0.9"),
+            ],
+        )
+        self.assertEqual(["bad", pytw5.model.MacBinding("aa:00:00:00:00:02", "10.2.0.1")], [x.record for x in errors])
+
+        networks = {n.network: n for n in model.networks}
+        self.assertIs(networks["10.1.0.0/16"], outer.network)
+        self.assertIs(networks["10.2.0.0/24"], model.get_ip_address("10.2.0.9").network)
+        self.assertIs(networks["10.0.0.0/8"], model.get_ip_address("10.3.0.1").network)
+        self.assertIsNone(model.get_ip_address("192.168.0.1").network)
+        self.assertEqual("aa:00:00:00:00:01", model.get_ip_address("10.2.0.1").mac.mac)
+        # Canonical order, whatever order the addresses were added in
+        self.assertEqual(["10.2.0.1", "10.2.0.9"], [x.ipv4 for x in networks["10.2.0.0/24"].ip_addresses])
+
+    def test_journal(self) -> None:
+        model = pytw5.model.create_model()
+        mac = model.get_mac("aa:00:00:00:00:01")
+        ip = model.get_ip_address("10.0.0.1")
+        ip.set_mac(mac)
+        other = model.get_ip_address("10.0.0.2")
+        position = model.journal_position
+
+        self.assertEqual((), model.changed_since(position))
+        version = mac.version
+        mac.add_annotation("Attached to virtual machine web01")
+        self.assertEqual(version + 1, mac.version)
+        # The IP address inherits the MAC annotations
+        self.assertEqual({mac, ip}, set(model.changed_since(position)))
+
+        n = model.get_network("10.0.0.0/24")
+        self.assertEqual(
+            ["annotation", "created", "linked", "linked"],
+            [x.kind for x in model.journal(position)],
+        )
+        self.assertEqual({mac, ip, other, n}, set(model.changed_since(position)))
+
+        model.truncate_journal(model.journal_position)
+        self.assertEqual((), model.journal(model.journal_position))
+
+    def test_journal_coalesced(self) -> None:
+        model = pytw5.model.create_model()
+        model.set_source("fw1")
+        position = model.journal_position
+        mac = model.get_mac("aa:00:00:00:00:01")
+        for i in range(10):
+            mac.add_annotation(f"Annotation {i}")
+        # One entry until the position is next read, while every change counts
+        self.assertEqual([("created", (mac,))], [(x.kind, x.entities) for x in model.journal(position)])
+        self.assertEqual(11, mac.version)
+
+        ip = model.get_ip_address("10.0.0.1")
+        ip.set_mac(mac)
+        # Linking them changed nothing the journal doesn't already hold
+        self.assertEqual(["created", "created"], [x.kind for x in model.journal(position)])
+
+        later = model.journal_position
+        mac.add_annotation("Annotation 10")
+        self.assertEqual([("annotation", (mac,))], [(x.kind, x.entities) for x in model.journal(later)])
+        self.assertEqual({mac, ip}, set(model.changed_since(later)))
+        self.assertEqual({mac, ip}, set(model.changed_since(position)))
+
+    def test_own_sources(self) -> None:
+        model = pytw5.model.create_model()
+        for source in ("fw1", "ctl1", "fw1"):
+            model.set_source(source)
+            model.get_mac("aa:00:00:00:00:01")
+        # Unordered in the model, sorted in the compact form
+        self.assertEqual({"ctl1", "fw1"}, model.get_mac("aa:00:00:00:00:01").internal_own_sources)
+        self.assertEqual((("aa:00:00:00:00:01", (), ("ctl1", "fw1")),), model.compact().mac_addresses)
+
+    def test_sources(self) -> None:
+        model = pytw5.model.create_model()
+        model.set_source("fw1")
+        ip = model.get_ip_address("10.0.0.1")
+        model.set_source("ctl1")
+        mac = model.get_mac("aa:00:00:00:00:01")
+        mac.add_annotation("Connected to switch sw1 port #1 - Port 1")
+        self.assertEqual(("ctl1",), mac.sources)
+        self.assertEqual(("fw1",), ip.sources)
+        model.set_source("fw1")
+        ip.set_mac(mac)
+        self.assertEqual(("ctl1", "fw1"), mac.sources)
+        self.assertEqual(("ctl1", "fw1"), ip.sources)
+
+        # Networks show the sources of their addresses, so change with them
+        model.set_source(None)
+        n = model.get_network("10.0.0.0/24")
+        self.assertEqual(("fw1",), n.sources)
+        position = model.journal_position
+        model.set_source("dhcp1")
+        ip.add_annotation("DHCP Lease")
+        self.assertEqual(("dhcp1", "fw1"), n.sources)
+        self.assertIn(n, model.changed_since(position))
+        # Looking up an entity attributes it to the source too
+        model.get_mac(mac.mac)
+        self.assertEqual(("ctl1", "dhcp1", "fw1"), mac.sources)
+
+    def test_merge(self) -> None:
+        import pickle
+
+        firewall = pytw5.model.create_model()
+        firewall.set_source("fw1")
+        firewall.ingest(
+            networks=["10.0.0.0/16"],
+            mac_bindings=[
+                pytw5.model.MacBinding(mac="aa:00:00:00:00:01", ipv4="10.0.1.1"),
+                pytw5.model.MacBinding(mac="aa:00:00:00:00:02", ipv4="10.0.1.2"),
+            ],
+        )
+        firewall.get_network("10.0.0.0/16").set_vlan(10)
+        firewall.get_mac("aa:00:00:00:00:01").add_annotation("DHCP Lease")
+
+        controller = pytw5.model.create_model()
+        controller.set_source("ctl1")
+        controller.ingest(
+            networks=["10.0.1.0/24"],
+            mac_bindings=[
+                pytw5.model.MacBinding(mac="aa:00:00:00:00:01", ipv4="10.0.1.1"),
+                pytw5.model.MacBinding(mac="aa:00:00:00:00:03", ipv4="10.0.1.2"),
+            ],
+        )
+        controller.get_network("10.0.0.0/16").set_vlan(20)
+        controller.get_mac("aa:00:00:00:00:01").add_annotation("DHCP Lease")
+        controller.get_mac("aa:00:00:00:00:01").add_annotation("Connected to switch sw1 port #1 - Port 1")
+        controller.get_dns_lookup("web01").add_ip_address(controller.get_ip_address("10.0.1.1"))
+        controller.add_switch("aa:00:00:00:00:09", "sw1", [(1, "Port 1")])
+        controller.set_switch_port("aa:00:00:00:00:01", "aa:00:00:00:00:09", 1)
+
+        compact = pickle.loads(pickle.dumps(controller.compact()))
+        model = pytw5.model.create_model()
+        self.assertEqual((), model.merge(firewall))
+        errors = model.merge(compact)
+
+        # Conflicts are reported, and resolved as building the sources in turn
+        # would: an IP address keeps its MAC address (as ingest does), and a
+        # network takes the later VLAN (as set_vlan does)
+        self.assertEqual(
+            ["IP address 10.0.1.2 is already bound to aa:00:00:00:00:02", "Network 10.0.0.0/16 moved from VLAN 10 to 20"],
+            sorted(x.reason for x in errors),
+        )
+        self.assertEqual("aa:00:00:00:00:02", model.get_ip_address("10.0.1.2").mac.mac)
+        self.assertEqual(20, model.get_network("10.0.0.0/16").vlan)
+
+        # IP addresses are re-homed into the most specific network
+        ip = model.get_ip_address("10.0.1.1")
+        self.assertEqual("10.0.1.0/24", ip.network.network)
+        self.assertEqual((), model.get_network("10.0.0.0/16").ip_addresses)
+
+        # Each source's annotations are kept, and sources are unioned
+        mac = model.get_mac("aa:00:00:00:00:01")
+        self.assertEqual(("Connected to switch sw1 port #1 - Port 1", "DHCP Lease", "DHCP Lease"), mac.annotations)
+        self.assertEqual(("ctl1", "fw1"), mac.sources)
+        self.assertEqual(("web01",), tuple(x.host for x in ip.dns_lookups))
+        self.assertIn(pytw5.model.Node("mac", "aa:00:00:00:00:01"), model.topology.traverse(pytw5.model.Node("switch", "aa:00:00:00:00:09")))
+
+        # A merged model merges back into the same model
+        copy = pytw5.model.create_model()
+        self.assertEqual((), copy.merge(model.compact()))
+        self.assertEqual(model.compact(), copy.compact())
+
+    def test_merge_matches_sequential(self) -> None:
+        MacBinding = pytw5.model.MacBinding
+
+        def firewall(model: pytw5.model.Model) -> None:
+            model.ingest(
+                networks=["10.0.0.0/16"],
+                mac_bindings=[MacBinding("aa:00:00:00:00:01", "10.0.1.1"), MacBinding("aa:00:00:00:00:02", "10.0.2.2")],
+            )
+            model.get_network("10.0.0.0/16").set_vlan(10)
+            model.get_mac("aa:00:00:00:00:01").add_annotation("DHCP Static")
+            model.get_ip_address("10.0.1.1").add_annotation("DHCP Static")
+
+        def controller(model: pytw5.model.Model) -> None:
+            # An address added before its network, within the firewall's network
+            model.get_ip_address("10.0.1.5").set_mac(model.get_mac("aa:00:00:00:00:05"))
+            model.get_network("10.0.1.0/24").add_annotation("Clients")
+            model.ingest(mac_bindings=[MacBinding("aa:00:00:00:00:01", "10.0.1.1")])
+            model.get_mac("aa:00:00:00:00:01").add_annotation("DHCP Static")
+            model.get_dns_lookup("web01").add_ip_address(model.get_ip_address("10.0.1.1"))
+            model.add_switch("aa:00:00:00:00:09", "sw1", [(1, "Port 1")])
+            model.set_switch_port("aa:00:00:00:00:01", "aa:00:00:00:00:09", 1)
+
+        def hypervisor(model: pytw5.model.Model) -> None:
+            model.get_mac("aa:00:00:00:00:02").add_annotation("Attached to virtual machine db01")
+            model.get_network("10.0.2.0/24")
+
+        def canonical(model: pytw5.model.Model) -> pytw5.model.CompactModel:
+            return pytw5.model.CompactModel(*(tuple(sorted(x)) for x in model.compact()))
+
+        def sources(model: pytw5.model.Model) -> dict:
+            entities = model.networks + model.ip_addresses + model.mac_addresses + model.dns_lookups
+            return {repr(x): x.sources for x in entities}
+
+        builds = (("fw1", firewall), ("ctl1", controller), ("hv1", hypervisor))
+        sequential = pytw5.model.create_model()
+        merged = pytw5.model.create_model()
+        for name, build in builds:
+            sequential.set_source(name)
+            build(sequential)
+
+            part = pytw5.model.create_model()
+            part.set_source(name)
+            build(part)
+            self.assertEqual((), merged.merge(part.compact()))
+        sequential.set_source(None)
+
+        self.assertEqual(canonical(sequential), canonical(merged))
+        self.assertEqual(sources(sequential), sources(merged))
+
+        # Networks show the sources of their addresses, and addresses the
+        # sources of their network, wherever they were added from
+        self.assertEqual(("ctl1", "fw1"), merged.get_network("10.0.1.0/24").sources)
+        self.assertEqual(("fw1",), merged.get_network("10.0.0.0/16").sources)
+        self.assertEqual(("fw1", "hv1"), merged.get_network("10.0.2.0/24").sources)
+        self.assertEqual(("fw1", "hv1"), merged.get_ip_address("10.0.2.2").sources)
+        self.assertEqual(("DHCP Static", "DHCP Static"), merged.get_mac("aa:00:00:00:00:01").annotations)
+
+        # Nor do the sources depend on the order the sources are built in
+        reordered = pytw5.model.create_model()
+        for name, build in reversed(builds):
+            reordered.set_source(name)
+            build(reordered)
+        self.assertEqual(sources(sequential), sources(reordered))
+
+    def test_utilisation(self) -> None:
+        model = pytw5.model.create_model()
+        model.ingest(
+            networks=["10.0.0.0/24", "10.0.0.0/8"],
+            ip_addresses=["10.0.0.254", "10.0.0.10", "10.0.0.1", "10.0.0.2", "10.9.0.1"],
+            mac_bindings=[],
+        )
+        network = model.get_network("10.0.0.0/24")
+        utilisation = network.utilisation
+        # Network and broadcast addresses aren't usable
+        self.assertEqual((254, 4, 250), (utilisation.usable, utilisation.used, utilisation.free))
+        self.assertAlmostEqual(100 * 4 / 254, utilisation.percent)
+        self.assertEqual(
+            [("10.0.0.11", "10.0.0.253", 243), ("10.0.0.3", "10.0.0.9", 7)],
+            [tuple(x) for x in utilisation.largest_free_ranges],
+        )
+
+        # Ranges are computed from the members, not by scanning the network
+        outer = model.get_network("10.0.0.0/8").utilisation
+        self.assertEqual((1, 2 ** 24 - 3), (outer.used, outer.free))
+        self.assertEqual(("10.9.0.2", "10.255.255.254"), outer.largest_free_ranges[0][:2])
+
+        # Cached until the membership changes
+        self.assertIs(utilisation, network.utilisation)
+        model.ingest(networks=[], ip_addresses=["10.0.0.3"], mac_bindings=[])
+        self.assertEqual(5, network.utilisation.used)
+        self.assertEqual(("10.0.0.4", "10.0.0.9", 6), tuple(network.utilisation.largest_free_ranges[1]))
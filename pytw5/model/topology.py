@@ -0,0 +1,160 @@
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+import collections
+import json
+
+
+class Node(NamedTuple):
+    """
+    A typed node in the topology graph, e.g. Node("port", "aa:00:00:00:00:f1#12"), with
+    switches and their ports keyed by the switch MAC address.
+    """
+
+    kind: str  # switch, port, mac, network, ip or dns
+    key: str
+
+    def __str__(self) -> str:
+        return f"{self.kind}:{self.key}"
+
+    @classmethod
+    def parse(cls, value: str) -> 'Node':
+        # Only the first separator counts, as MAC addresses contain it too
+        kind, sep, key = value.partition(":")
+        if not sep or kind not in TopologyIndex.KINDS:
+            raise ValueError(f"Expected <kind>:<key> with kind one of {list(TopologyIndex.KINDS)}, got '{value}'")
+        return cls(kind, key)
+
+    @classmethod
+    def port(cls, switch_mac: str, port: int) -> 'Node':
+        return cls("port", f"{switch_mac}#{port}")
+
+
+class TopologyIndex:
+    """
+    Typed adjacency index over switches, switch ports, MAC addresses, IP
+    addresses, networks and DNS names. Neighbours are held per node and kind,
+    so neighbour lookups are O(1) regardless of the graph size.
+
+    Traversal "downstream" follows edges away from the switches: switch ->
+    port -> mac -> ip -> dns, network -> ip, and from a MAC to the switch it
+    belongs to (so downstream switches are included).
+    """
+
+    KINDS = ("switch", "port", "mac", "network", "ip", "dns")
+    RANK = {"switch": 0, "port": 1, "mac": 2, "network": 2.5, "ip": 3, "dns": 4}
+    SHAPES = {"switch": "box3d", "port": "cds", "mac": "box", "network": "folder", "ip": "ellipse", "dns": "note"}
+
+    def __init__(self) -> None:
+        self._adjacency: Dict[Node, Dict[str, Set[Node]]] = dict()
+        self._labels: Dict[Node, str] = dict()
+
+    def __len__(self) -> int:
+        return len(self._adjacency)
+
+    def __contains__(self, node: Node) -> bool:
+        return node in self._adjacency
+
+    @property
+    def nodes(self) -> Tuple[Node, ...]:
+        return tuple(self._adjacency)
+
+    def add(self, node: Node, label: Optional[str] = None) -> None:
+        if node not in self._adjacency:
+            self._adjacency[node] = dict()
+        if label:
+            self._labels[node] = label
+
+    def label(self, node: Node) -> str:
+        return self._labels.get(node, "")
+
+    def link(self, a: Node, b: Node) -> None:
+        self.add(a)
+        self.add(b)
+        self._adjacency[a].setdefault(b.kind, set()).add(b)
+        self._adjacency[b].setdefault(a.kind, set()).add(a)
+
+    def unlink(self, a: Node, b: Node) -> None:
+        self._adjacency.get(a, dict()).get(b.kind, set()).discard(b)
+        self._adjacency.get(b, dict()).get(a.kind, set()).discard(a)
+
+    def neighbours(self, node: Node, kind: Optional[str] = None) -> Tuple[Node, ...]:
+        by_kind = self._adjacency.get(node, dict())
+        if kind is not None:
+            return tuple(by_kind.get(kind, ()))
+        return tuple(x for nodes in by_kind.values() for x in nodes)
+
+    def traverse(
+            self,
+            start: Node,
+            max_depth: Optional[int] = None,
+            kinds: Optional[Iterable[str]] = None,
+            downstream: bool = False,
+    ) -> Tuple[Node, ...]:
+        """
+        Breadth first from start (which is included), optionally limited in
+        depth, to the given kinds of node, or to downstream edges.
+        """
+        if start not in self._adjacency:
+            return tuple()
+        kinds = None if kinds is None else set(kinds)
+
+        seen = {start}
+        ret = [start]
+        q = collections.deque([(start, 0)])
+        while q:
+            node, depth = q.popleft()
+            if max_depth is not None and depth >= max_depth:
+                continue
+            for kind, neighbours in self._adjacency[node].items():
+                if kinds is not None and kind not in kinds:
+                    continue
+                if downstream and not self._is_downstream(node.kind, kind):
+                    continue
+                for neighbour in neighbours:
+                    if neighbour not in seen:
+                        seen.add(neighbour)
+                        ret.append(neighbour)
+                        q.append((neighbour, depth + 1))
+        return tuple(ret)
+
+    def _is_downstream(self, from_kind: str, to_kind: str) -> bool:
+        return self.RANK[to_kind] > self.RANK[from_kind] or (from_kind == "mac" and to_kind == "switch")
+
+    def edges(self, nodes: Optional[Iterable[Node]] = None) -> Tuple[Tuple[Node, Node], ...]:
+        """
+        Each edge once, between the given nodes (default all).
+        """
+        nodes = set(self._adjacency) if nodes is None else set(nodes)
+        ret = list()
+        for node in nodes:
+            for neighbours in self._adjacency.get(node, dict()).values():
+                for neighbour in neighbours:
+                    if neighbour in nodes and node < neighbour:
+                        ret.append((node, neighbour))
+        return tuple(sorted(ret))
+
+    def to_json(self, nodes: Optional[Iterable[Node]] = None) -> str:
+        """
+        Compact JSON, with edges as pairs of indices into the node list.
+        """
+        ordered: List[Node] = sorted(self._adjacency if nodes is None else set(nodes))
+        index = {x: i for i, x in enumerate(ordered)}
+        return json.dumps({
+            "nodes": [str(x) for x in ordered],
+            "labels": {str(x): self._labels[x] for x in ordered if x in self._labels},
+            "edges": [[index[a], index[b]] for a, b in self.edges(ordered)],
+        }, separators=(",", ":"))
+
+    def to_dot(self, nodes: Optional[Iterable[Node]] = None) -> str:
+        ordered: List[Node] = sorted(self._adjacency if nodes is None else set(nodes))
+
+        def _quote(value: str) -> str:
+            return '"' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+
+        lines = ["graph topology {"]
+        for node in ordered:
+            label = node.key if node not in self._labels else f"{node.key}\n{self._labels[node]}"
+            lines.append(f"  {_quote(str(node))} [label={_quote(label)} shape={self.SHAPES[node.kind]}];")
+        for a, b in self.edges(ordered):
+            lines.append(f"  {_quote(str(a))} -- {_quote(str(b))};")
+        lines.append("}")
+        return "\n".join(lines)
@@ -0,0 +1,166 @@
+import datetime
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+# Set from the command line options
+interval = 5.0
+trace_every = 0
+
+
+def configure(progress_interval: float, trace: int) -> None:
+    global interval, trace_every
+    interval = progress_interval
+    trace_every = trace
+
+
+class Progress:
+    """
+    Counts per-tiddler events and logs a summary at most once per interval,
+    rather than a line per event. In trace mode every Nth event is also logged.
+    """
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._counts: Dict[str, int] = dict()
+        self._total = 0
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._last_report = self._start
+
+    def record(self, event: str, title: str) -> None:
+        with self._lock:
+            self._counts[event] = self._counts.get(event, 0) + 1
+            self._total += 1
+            total = self._total
+            now = time.monotonic()
+            report = interval >= 0 and now - self._last_report >= interval
+            if report:
+                self._last_report = now
+
+        if trace_every and total % trace_every == 0:
+            log.info("%s: %s '%s' (event %d)", self._name, event, title, total)
+        if report:
+            log.info("%s: %s", self._name, self.summary)
+
+    @property
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+    @property
+    def summary(self) -> str:
+        counts = self.counts
+        elapsed = time.monotonic() - self._start
+        if not counts:
+            return f"no changes ({elapsed:.1f}s)"
+        events = ", ".join(f"{v} {k}" for k, v in sorted(counts.items()))
+        return f"{events} ({elapsed:.1f}s)"
+
+    def finish(self) -> None:
+        log.info("%s: finished, %s", self._name, self.summary)
+
+
+def _timestamp(value: float) -> str:
+    return datetime.datetime.utcfromtimestamp(value).replace(microsecond=0).isoformat() + "Z"
+
+
+class ProgressFile:
+    """
+    The progress of a run against one target, for dashboards. Rewritten
+    (atomically) every BATCH completed operations or INTERVAL seconds, holding
+    the planned and completed operations per "<kind>:<twit_class>", the time to
+    the first successful write and the work remaining. Operations which found
+    nothing to write (e.g. a conflicting tiddler re-read already up to date)
+    are counted as unchanged rather than done.
+    """
+
+    BATCH = 100
+    INTERVAL = 2.0
+
+    def __init__(self, path: str, name: str) -> None:
+        self._path = path
+        self._name = name
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._first_write: Optional[float] = None
+        self._planned: Dict[str, int] = dict()
+        self._done: Dict[str, int] = dict()
+        self._failed = 0
+        self._unchanged = 0
+        self._pending = 0
+        self._last_write = 0.0
+
+    @classmethod
+    def for_target(cls, target_name: str) -> 'ProgressFile':
+        from .config import singleton
+        name = re.sub(r"[^\w.\-]", "_", target_name)
+        return cls(os.path.join(singleton.path, f"pytw5.progress.{name}.json"), target_name)
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def planned(self, operations: Iterable[Tuple[str, str]]) -> None:
+        """
+        Adds (kind, twit_class) operations to the planned work.
+        """
+        with self._lock:
+            for kind, twit_class in operations:
+                key = f"{kind}:{twit_class}"
+                self._planned[key] = self._planned.get(key, 0) + 1
+        self._write("running")
+
+    def record(self, kind: str, twit_class: str, ok: bool = True, changed: bool = True) -> None:
+        now = time.time()
+        with self._lock:
+            if not ok:
+                self._failed += 1
+            elif not changed:
+                self._unchanged += 1
+            else:
+                key = f"{kind}:{twit_class}"
+                self._done[key] = self._done.get(key, 0) + 1
+                if self._first_write is None:
+                    self._first_write = now
+            self._pending += 1
+            due = self._pending >= self.BATCH or now - self._last_write >= self.INTERVAL
+        if due:
+            self._write("running")
+
+    def finish(self, error: Optional[str] = None) -> None:
+        self._write("failed" if error else "finished", error)
+
+    def _write(self, state: str, error: Optional[str] = None) -> None:
+        now = time.time()
+        with self._lock:
+            planned = sum(self._planned.values())
+            completed = sum(self._done.values()) + self._unchanged + self._failed
+            record = {
+                "target": self._name,
+                "state": state,
+                "error": error,
+                "started": _timestamp(self._started),
+                "updated": _timestamp(now),
+                "first_write": None if self._first_write is None else _timestamp(self._first_write),
+                "time_to_first_write": None if self._first_write is None else round(self._first_write - self._started, 3),
+                "planned": dict(self._planned),
+                "done": dict(self._done),
+                "unchanged": self._unchanged,
+                "failed": self._failed,
+                "remaining": planned - completed,
+            }
+            self._pending = 0
+            self._last_write = now
+
+            # Under the lock, so batches are written in order
+            temp_path = self._path + ".tmp"
+            with open(temp_path, "w") as fp:
+                json.dump(record, fp, indent=2, sort_keys=True)
+            os.replace(temp_path, self._path)
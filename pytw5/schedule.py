@@ -0,0 +1,138 @@
+"""
+Description
+===========
+
+Adapts how often each source is fetched to how often its data changes, so
+slow moving sources (e.g. a VM inventory) aren't polled as often as fast
+moving ones (e.g. switch port assignments).
+
+A source is scheduled when its configuration sets "max_interval" (seconds).
+Each fetch is built into a model on its own and digested in compact form, so
+the digest ignores the order the source returned its records in. Unchanged
+data doubles the interval, up to max_interval. Changed data resets it to
+"min_interval" (default 60 seconds). Until a source is next due, its last
+result is reused when building the model.
+
+Files
+=====
+
+    pytw5.schedule.json             per source: digest, interval, fetch and change times
+    pytw5.schedule.<source>.pickle  the last result of the source, in compact form
+
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+from typing import Dict, Optional, Tuple
+from .config import singleton, SourceConfig
+from .model import CompactModel
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MIN_INTERVAL = 60.0
+BACKOFF = 2.0
+
+
+def is_scheduled(source: SourceConfig) -> bool:
+    return bool(source.get_optional_key("max_interval"))
+
+
+def digest(compact: CompactModel) -> str:
+    h = hashlib.sha256()
+    for records in compact:
+        h.update(json.dumps(sorted(records)).encode())
+    return h.hexdigest()
+
+
+class Scheduler:
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._state: Dict[str, Dict[str, object]] = dict()
+        try:
+            with open(self.state_path, "r") as fp:
+                self._state = json.load(fp)
+        except FileNotFoundError:
+            pass
+        except json.decoder.JSONDecodeError:
+            log.warning("Ignoring corrupt schedule '%s', every source will be fetched", self.state_path)
+
+    @classmethod
+    def open(cls) -> 'Scheduler':
+        return cls(os.path.join(singleton.path, "pytw5.schedule"))
+
+    @property
+    def state_path(self) -> str:
+        return f"{self._path}.json"
+
+    def payload_path(self, source: SourceConfig) -> str:
+        name = re.sub(r"[^\w.\-]", "_", source.name)
+        return f"{self._path}.{name}.pickle"
+
+    @staticmethod
+    def bounds(source: SourceConfig) -> Tuple[float, float]:
+        min_interval = float(source.get_optional_key("min_interval", DEFAULT_MIN_INTERVAL))
+        max_interval = float(source.get_optional_key("max_interval", min_interval))
+        return min_interval, max(min_interval, max_interval)
+
+    def next_due(self, source: SourceConfig) -> Optional[float]:
+        """
+        When the source is next due, or None if it must be fetched now.
+        """
+        state = self._state.get(source.name)
+        if not is_scheduled(source) or state is None:
+            return None
+        # A changed configuration may give different data
+        if state["config"] != source.digest() or not os.path.exists(self.payload_path(source)):
+            return None
+        return state["fetched"] + state["interval"]
+
+    def due(self, source: SourceConfig, now: float) -> bool:
+        next_due = self.next_due(source)
+        return next_due is None or now >= next_due
+
+    def cached(self, source: SourceConfig) -> CompactModel:
+        with open(self.payload_path(source), "rb") as fp:
+            return pickle.load(fp)
+
+    def observe(self, source: SourceConfig, compact: CompactModel, now: float) -> bool:
+        """
+        Records a fetch of the source and adapts its interval, returning True
+        if the data changed since the previous fetch.
+        """
+        min_interval, max_interval = self.bounds(source)
+        value = digest(compact)
+        state = self._state.get(source.name)
+        changed = state is None or state["digest"] != value or state["config"] != source.digest()
+        if changed or not os.path.exists(self.payload_path(source)):
+            temp_path = self.payload_path(source) + ".tmp"
+            with open(temp_path, "wb") as fp:
+                pickle.dump(compact, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.payload_path(source))
+
+        if changed:
+            interval = min_interval
+        else:
+            interval = min(max(state["interval"], min_interval) * BACKOFF, max_interval)
+        self._state[source.name] = {
+            "digest": value,
+            "config": source.digest(),
+            "interval": interval,
+            "fetched": now,
+            "changed": now if changed or state is None else state["changed"],
+        }
+        log.info(
+            "Source '%s' %s, next fetched in %.0fs",
+            source.name, "changed" if changed else "unchanged", interval,
+        )
+        return changed
+
+    def save(self) -> None:
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w") as fp:
+            json.dump(self._state, fp, indent=2, sort_keys=True)
+        os.replace(temp_path, self.state_path)
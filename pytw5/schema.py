@@ -0,0 +1,163 @@
+"""
+Description
+===========
+
+The fields of the tiddlers generated for each twit class, and how they are
+encoded to the strings TW5 stores.
+
+Encoding is canonical: fields are produced in the declared order, None becomes
+"", and list fields are sorted before being encoded as a TW5 title list
+(ordered fields keep the order the entity gives, which is itself canonical). The
+same entity therefore always encodes to the same fields, regardless of the
+order a source returned its data in, so tiddlers can be compared directly on
+their encoded form.
+
+"""
+
+import re
+from typing import Any, Dict, Iterable, List, NamedTuple, Tuple
+
+RE_LINK = re.compile(r'\[\[(?P<link>.*?)\]\]')
+
+# Fields maintained by the server or by the writer rather than the schema
+META_FIELDS = ("revision", "created", "modified", "type", "text", "tags", "bag")
+
+# Records which source instances produced a tiddler
+OWNER_FIELD = "pytw5_sources"
+
+
+def encode_list(value: Iterable[str]) -> str:
+    def _del_str(v: str) -> str:
+        if " " in v:
+            return f"[[{v}]]"
+        return v
+    return " ".join([_del_str(x) for x in value])
+
+
+def decode_list(value: str) -> List[str]:
+    result = []
+    matches = list(re.finditer(RE_LINK, value))
+    for match in reversed(matches):
+        result.append(match.group('link'))
+        s = match.start()
+        e = match.end()
+        value = value[:s] + value[e:]
+
+    result += value.split()
+
+    return result
+
+
+class Field(NamedTuple):
+
+    name: str
+    kind: str = "str"  # str, int, list or ordered (a list in a meaningful order)
+
+
+class Schema:
+
+    def __init__(self, twit_class: str, fields: Tuple[Field, ...]) -> None:
+        self._twit_class = twit_class
+        self._fields = (Field("title"),) + fields + (Field(OWNER_FIELD, "list"), Field("twit_class"))
+
+    @property
+    def twit_class(self) -> str:
+        return self._twit_class
+
+    @property
+    def fields(self) -> Tuple[Field, ...]:
+        return self._fields
+
+    def encode(self, values: Dict[str, Any]) -> Dict[str, str]:
+        """
+        Encodes the field values of an entity, in the schema's field order.
+        """
+        ret = dict()
+        for field in self._fields:
+            value = self._twit_class if field.name == "twit_class" else values[field.name]
+            if value is None:
+                ret[field.name] = ""
+            elif field.kind == "list":
+                ret[field.name] = encode_list(sorted(value))
+            elif field.kind == "ordered":
+                ret[field.name] = encode_list(value)
+            else:
+                ret[field.name] = str(value)
+        return ret
+
+    def decode(self, tiddler: Dict[str, str]) -> Dict[str, Any]:
+        return {x.name: self._decode_value(x, tiddler.get(x.name, "")) for x in self._fields}
+
+    @staticmethod
+    def _decode_value(field: Field, value: str) -> Any:
+        if field.kind == "list":
+            return sorted(decode_list(value))
+        elif field.kind == "ordered":
+            return decode_list(value)
+        elif field.kind == "int":
+            return int(value) if value else None
+        return value
+
+    def migrates(self, encoded: Dict[str, str], tiddler: Dict[str, str]) -> bool:
+        """
+        True if the tiddler only differs from the encoded fields as an older
+        schema would: fields it lacks (added since it was written), fields no
+        longer in the schema, or values which decode alike (e.g. a list in
+        another order). Rewriting it changes none of the values it holds.
+        """
+        for field in self._fields:
+            if field.name not in tiddler:
+                continue
+            try:
+                if self._decode_value(field, tiddler[field.name]) != self._decode_value(field, encoded[field.name]):
+                    return False
+            except ValueError:
+                # Not a value the schema ever wrote, e.g. edited by hand
+                return False
+        return True
+
+
+SCHEMAS = {
+    x.twit_class: x for x in (
+        Schema("nic", (
+            Field("mac"),
+            Field("ip_addresses", "list"),
+            Field("annotations", "list"),
+        )),
+        Schema("ip_address", (
+            Field("annotations", "list"),
+            Field("ip_address"),
+            Field("mac"),
+            Field("network"),
+            Field("hosts", "list"),
+        )),
+        Schema("network", (
+            Field("network"),
+            Field("vlan", "int"),
+            Field("prefix_length", "int"),
+            Field("annotations", "list"),
+            Field("ip_addresses", "list"),
+            Field("used", "int"),
+            Field("free", "int"),
+            Field("utilisation"),
+            Field("free_ranges", "ordered"),
+        )),
+        Schema("dns_lookup", (
+            Field("host"),
+            Field("ip_addresses", "list"),
+            Field("annotations", "list"),
+        )),
+    )
+}
+
+
+def differs(encoded: Dict[str, str], tiddler: Dict[str, str]) -> bool:
+    """
+    True if a tiddler from the server doesn't hold exactly the encoded fields
+    (besides the meta fields). The tiddler is neither copied nor changed.
+    """
+    for name, value in encoded.items():
+        if tiddler.get(name) != value:
+            return True
+    # Fields no longer in the schema
+    return sum(1 for x in tiddler if x not in META_FIELDS) != len(encoded)
@@ -0,0 +1,212 @@
+"""
+Description
+===========
+
+A local, read-only HTTP API over the latest model, so other tools can look up
+IP addresses, MAC addresses, hosts and networks without each polling the
+sources themselves.
+
+The model is rebuilt from the sources on an interval. Each rebuild produces a
+snapshot holding the JSON response and ETag for every entity, so lookups are a
+dict access, and clients revalidating with If-None-Match get a 304.
+
+Endpoints
+=========
+
+    GET /                       snapshot summary
+    GET /ip/<ip address>
+    GET /mac/<mac address>
+    GET /host/<dns name>
+    GET /network/<network>      e.g. /network/10.0.0.0/24
+    GET /search?q=<query>       annotation search, e.g. q=switch+core-sw1
+
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import threading
+import urllib.parse
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from . import model
+from . import schema
+from . import sources
+from .integrator import Integrator, describe_entity
+
+log = logging.getLogger(__name__)
+
+# URL path prefix for each twit class
+ROUTES = {
+    "ip": "ip_address",
+    "mac": "nic",
+    "host": "dns_lookup",
+    "network": "network",
+}
+
+
+class Response:
+
+    def __init__(self, body: Any) -> None:
+        self.body = json.dumps(body, separators=(",", ":"), sort_keys=True).encode()
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest() + '"'
+
+
+class Snapshot:
+    """
+    The precomputed responses for one build of the model. Immutable once built.
+    """
+
+    SEARCH_CACHE_SIZE = 1024
+
+    def __init__(self, m: model.Model) -> None:
+        self._model = m
+        self._built = datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+        self._responses: Dict[Tuple[str, str], Response] = dict()
+
+        integrator = Integrator(m)
+        counts = dict()
+        for twit_class, process in integrator.twit_classes:
+            codec = schema.SCHEMAS[twit_class]
+            rendered = process()
+            for item in rendered:
+                self._responses[(twit_class, item["title"])] = Response(codec.decode(item))
+            counts[twit_class] = len(rendered)
+        self._index = Response({"built": self._built, "counts": counts})
+
+        self._search_cache: Dict[str, Response] = dict()
+        self._search_lock = threading.Lock()
+
+    @property
+    def built(self) -> str:
+        return self._built
+
+    @property
+    def index(self) -> Response:
+        return self._index
+
+    def lookup(self, twit_class: str, title: str) -> Optional[Response]:
+        return self._responses.get((twit_class, title))
+
+    def search(self, query: str) -> Response:
+        with self._search_lock:
+            response = self._search_cache.get(query)
+            if response is not None:
+                return response
+
+        results = [
+            {"twit_class": twit_class, "title": title}
+            for twit_class, title in (describe_entity(x) for x in self._model.search(query))
+        ]
+        response = Response({"query": query, "results": results})
+        with self._search_lock:
+            if len(self._search_cache) >= self.SEARCH_CACHE_SIZE:
+                self._search_cache.clear()
+            self._search_cache[query] = response
+        return response
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    server: 'Server'
+
+    def do_GET(self) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        snapshot = self.server.snapshot
+        if snapshot is None:
+            self._send_error(HTTPStatus.SERVICE_UNAVAILABLE, "Model not yet built")
+            return
+
+        parts = urllib.parse.unquote(url.path).strip("/").split("/", 1)
+        if parts == [""]:
+            self._send(snapshot.index)
+        elif parts[0] == "search":
+            query = urllib.parse.parse_qs(url.query).get("q", [""])[0]
+            self._send(snapshot.search(query))
+        elif parts[0] in ROUTES and len(parts) == 2:
+            title = parts[1].lower() if parts[0] == "mac" else parts[1]
+            response = snapshot.lookup(ROUTES[parts[0]], title)
+            if response is None:
+                self._send_error(HTTPStatus.NOT_FOUND, f"Unknown {parts[0]} '{parts[1]}'")
+            else:
+                self._send(response)
+        else:
+            self._send_error(HTTPStatus.NOT_FOUND, "Unknown endpoint")
+
+    def _send(self, response: Response) -> None:
+        if self.headers.get("If-None-Match") == response.etag:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", response.etag)
+            self.end_headers()
+            return
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response.body)))
+        self.send_header("ETag", response.etag)
+        self.send_header("Cache-Control", f"max-age={int(self.server.interval)}")
+        self.end_headers()
+        self.wfile.write(response.body)
+
+    def _send_error(self, status: HTTPStatus, message: str) -> None:
+        body = json.dumps({"error": message}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        log.debug("%s - %s", self.address_string(), format % args)
+
+
+class Server(ThreadingHTTPServer):
+    """
+    Serves the latest snapshot, rebuilding the model from the sources every
+    interval seconds. A failed rebuild keeps serving the previous snapshot.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host: str, port: int, interval: float) -> None:
+        super().__init__((host, port), _Handler)
+        self.interval = interval
+        self.snapshot: Optional[Snapshot] = None
+        self._stop = threading.Event()
+        self._refresher: Optional[threading.Thread] = None
+
+    def refresh(self) -> None:
+        snapshot = Snapshot(sources.load_model())
+        # Replacing the reference is atomic, in flight requests keep the old snapshot
+        self.snapshot = snapshot
+        log.info("Serving model built at %s", snapshot.built)
+
+    def _refresh_loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                log.error("Failed to refresh the model, serving the previous one: %r", e)
+
+    def start_refreshing(self) -> None:
+        self._refresher = threading.Thread(target=self._refresh_loop, name="refresh", daemon=True)
+        self._refresher.start()
+
+    def server_close(self) -> None:
+        self._stop.set()
+        super().server_close()
+
+
+def serve(host: str, port: int, interval: float) -> None:
+    server = Server(host, port, interval)
+    server.refresh()
+    server.start_refreshing()
+    log.info("Listening on http://%s:%d/", *server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
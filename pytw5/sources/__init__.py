@@ -1 +1,11 @@
-from ._loader import load_model
+from ._loader import (
+    build_compacts,
+    build_model,
+    build_model_parallel,
+    build_model_scheduled,
+    configure,
+    fetch_sources,
+    load_model,
+    merge_compacts,
+    select_sources,
+)
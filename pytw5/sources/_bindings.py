@@ -0,0 +1,20 @@
+import logging
+from typing import Iterable, Tuple
+from ..model import Model, MacBinding
+
+log = logging.getLogger(__name__)
+
+
+def ingest_bindings(model: Model, bindings: Iterable[MacBinding], description: str) -> Tuple[MacBinding, ...]:
+    """
+    Binds each MAC address to its IP address, returning the bindings which
+    were applied. Rejected bindings (a malformed address, or an IP address
+    already bound to another MAC address) are logged and skipped.
+    """
+    bindings = tuple(bindings)
+    rejected = set()
+    for error in model.ingest(mac_bindings=bindings):
+        # The record is the binding, or the IP address if it was malformed
+        log.warning("Skipping %s %s: %s", description, error.record, error.reason)
+        rejected.add(error.record)
+    return tuple(x for x in bindings if x not in rejected and x.ipv4 not in rejected)
@@ -1,14 +1,203 @@
-from .. model import Model, create_model
+from .. import schedule
+from .. model import CompactModel, Model, create_model
+from ..config import singleton, SourceConfig
+from . import dhcp_leases
 from . import pfsense
+from . import pfsense_config
 from . import proxmox
 from . import unifi
+from click import ClickException
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import logging
+import multiprocessing
+import time
 
+log = logging.getLogger(__name__)
 
-def load_model() -> Model:
+# Set from the command line options, 0 builds the model in process
+processes = 0
+
+# Each source module provides fetch(source) -> data and apply(model, data)
+SOURCE_TYPES = {
+    "dhcp_leases": dhcp_leases,
+    "pfsense": pfsense,
+    "pfsense_config": pfsense_config,
+    "proxmox": proxmox,
+    "unifi": unifi,
+}
+
+
+def configure(process_count: int) -> None:
+    global processes
+    processes = process_count
+
+
+def _fetch(source: SourceConfig) -> Any:
+    start = time.monotonic()
+    data = SOURCE_TYPES[source.type].fetch(source)
+    log.debug("Fetched %r in %.2fs", source, time.monotonic() - start)
+    return data
+
+
+def fetch_sources(sources: Tuple[SourceConfig, ...]) -> List[Tuple[SourceConfig, Any]]:
+    """
+    Fetches all the sources concurrently, returning their data in configuration order.
+    """
+    if not sources:
+        return list()
+
+    with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+        futures = [(x, executor.submit(_fetch, x)) for x in sources]
+
+    ret = list()
+    failures = list()
+    for source, future in futures:
+        try:
+            ret.append((source, future.result()))
+        except Exception as e:
+            log.error("Failed to fetch source '%s': %r", source.name, e)
+            failures.append(source.name)
+
+    # Building a model from a subset of the sources would delete everything the others produced
+    if failures:
+        raise ClickException(f"Failed to fetch sources {failures}!")
+    return ret
+
+
+def select_sources(selected: Optional[Iterable[str]] = None) -> Tuple[SourceConfig, ...]:
+    """
+    The enabled sources, optionally restricted to those matching the given
+    source names or types.
+    """
+    enabled = tuple(x for x in singleton.sources if x.enabled)
+    if selected is None:
+        return enabled
+
+    selected = set(selected)
+    unknown = selected.difference(x.name for x in enabled).difference(x.type for x in enabled)
+    if unknown:
+        raise ClickException(f"Unknown or disabled sources {sorted(unknown)}!")
+    return tuple(x for x in enabled if x.name in selected or x.type in selected)
+
+
+def build_model(fetched: Iterable[Tuple[SourceConfig, Any]]) -> Model:
     m = create_model()
 
-    pfsense.load_model(m)
-    proxmox.load_model(m)
-    unifi.load_model(m)
+    # The model is not thread safe, so it is populated once everything is fetched
+    for source, data in fetched:
+        m.set_source(source.name)
+        SOURCE_TYPES[source.type].apply(m, data)
+    m.set_source(None)
 
     return m
+
+
+def _compact(source: SourceConfig, data: Any) -> CompactModel:
+    m = create_model()
+    m.set_source(source.name)
+    SOURCE_TYPES[source.type].apply(m, data)
+    return m.compact()
+
+
+def _build_compact(source: SourceConfig) -> CompactModel:
+    return _compact(source, _fetch(source))
+
+
+def _initialise_worker(path: str, config: Dict[str, Any], level: int) -> None:
+    # Spawned workers start from a fresh interpreter, so they are handed the
+    # configuration and logging level rather than inheriting them
+    logging.basicConfig(level=level)
+    singleton.initialise(path, config=config)
+
+
+def _process_pool(max_workers: int) -> ProcessPoolExecutor:
+    # Spawned rather than forked, as forking a process with threads running is unsafe
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_initialise_worker,
+        initargs=(singleton.path, singleton.config, logging.getLogger().getEffectiveLevel()),
+    )
+
+
+def build_compacts(sources: Tuple[SourceConfig, ...], max_workers: int = 0) -> List[Tuple[SourceConfig, CompactModel]]:
+    """
+    Fetches and builds a model per source, in a pool of max_workers processes
+    (0 for in process), returning them in compact form in configuration order.
+    """
+    if not sources:
+        return list()
+    if not max_workers:
+        return [(source, _compact(source, data)) for source, data in fetch_sources(sources)]
+
+    with _process_pool(min(max_workers, len(sources))) as executor:
+        futures = [(x, executor.submit(_build_compact, x)) for x in sources]
+
+    ret = list()
+    failures = list()
+    for source, future in futures:
+        try:
+            ret.append((source, future.result()))
+        except Exception as e:
+            log.error("Failed to build source '%s': %r", source.name, e)
+            failures.append(source.name)
+
+    # As for fetch_sources, a model without some of the sources is not usable
+    if failures:
+        raise ClickException(f"Failed to build sources {failures}!")
+    return ret
+
+
+def merge_compacts(compacts: Iterable[Tuple[SourceConfig, CompactModel]]) -> Model:
+    """
+    Merges the per source models in the given order, so the result doesn't
+    depend on which was built first.
+    """
+    m = create_model()
+    for source, compact in compacts:
+        start = time.monotonic()
+        for error in m.merge(compact):
+            log.warning("Source '%s' conflicts: %s", source.name, error.reason)
+        log.debug("Merged %r in %.2fs", source, time.monotonic() - start)
+    return m
+
+
+def build_model_parallel(sources: Tuple[SourceConfig, ...], max_workers: int) -> Model:
+    return merge_compacts(build_compacts(sources, max_workers))
+
+
+def build_model_scheduled(sources: Tuple[SourceConfig, ...]) -> Model:
+    """
+    Fetches only the sources which are due (see pytw5.schedule), reusing the
+    last result of the others.
+    """
+    scheduler = schedule.Scheduler.open()
+    now = time.time()
+    fetched = dict(
+        (source.name, compact)
+        for source, compact in build_compacts(tuple(x for x in sources if scheduler.due(x, now)), processes)
+    )
+
+    compacts = list()
+    for source in sources:
+        compact = fetched.get(source.name)
+        if compact is None:
+            log.info("Reusing the last result of source '%s', due in %.0fs", source.name, scheduler.next_due(source) - now)
+            compact = scheduler.cached(source)
+        elif schedule.is_scheduled(source):
+            scheduler.observe(source, compact, now)
+        compacts.append((source, compact))
+    scheduler.save()
+
+    return merge_compacts(compacts)
+
+
+def load_model(sources: Optional[Tuple[SourceConfig, ...]] = None) -> Model:
+    if sources is None:
+        sources = select_sources()
+    if any(schedule.is_scheduled(x) for x in sources):
+        return build_model_scheduled(sources)
+    if processes:
+        return build_model_parallel(sources, processes)
+    return build_model(fetch_sources(sources))
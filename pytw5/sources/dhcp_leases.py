@@ -0,0 +1,192 @@
+"""
+Description
+===========
+
+Populates the local model with the dynamic MAC to IP address bindings from a
+DHCP server lease file, either an ISC dhcpd.leases file or a Kea lease4 CSV
+(memfile) file.
+
+Both formats are append only, so a lease file holds years of history with the
+latest record for an address last. The file is memory mapped and scanned
+record by record, keeping only the latest record per IP address, so memory
+use is bounded by the size of the address space rather than the file.
+
+Configuration
+=============
+
+    {
+        "name": "dhcp",
+        "type": "dhcp_leases",
+        "path": "/var/db/dhcpd.leases",
+        "format": "isc"
+    }
+
+The format is "isc" or "kea", and defaults to "kea" for files ending in .csv.
+
+"""
+
+import calendar
+import logging
+import mmap
+import os
+import re
+import time
+from typing import Dict, Iterator, NamedTuple, Optional, Tuple
+from ..config import SourceConfig
+from ..model import Model, MacBinding
+from ._bindings import ingest_bindings
+
+log = logging.getLogger(__name__)
+
+# dhcpd closes a lease with a brace at the start of a line. Braces within the
+# lease (e.g. in a quoted "set" value) are indented.
+RE_ISC_LEASE = re.compile(rb"^lease\s+([0-9.]+)\s*\{(.*?)^\}", re.MULTILINE | re.DOTALL)
+# The statements we use within a lease, keyed by their name. Superseded
+# statements such as "next binding state" are excluded by the anchoring.
+# Quoted values may contain semicolons.
+RE_ISC_STATEMENT = re.compile(
+    rb'^\s*(binding state|hardware ethernet|client-hostname|starts|ends) ((?:"(?:[^"\\\n]|\\.)*"|[^;"\n])*);',
+    re.MULTILINE,
+)
+RE_ISC_TIME = re.compile(rb"(?:epoch (\d+)|\d (\d+/\d+/\d+ \d+:\d+:\d+))")
+
+# Kea lease states
+KEA_STATE_DEFAULT = "0"
+
+
+class Lease(NamedTuple):
+
+    ipv4: str
+    mac: str
+    # Unix timestamps, ends is None for infinite leases
+    starts: float
+    ends: Optional[float]
+    hostname: str
+
+
+def _isc_time(value: Optional[bytes]) -> Optional[float]:
+    # Either "<weekday> <UTC date time>", "epoch <seconds>" or "never"
+    match = RE_ISC_TIME.match(value or b"")
+    if match is None:
+        return None
+    epoch, utc = match.groups()
+    if epoch:
+        return float(epoch)
+    return float(calendar.timegm(time.strptime(utc.decode(), "%Y/%m/%d %H:%M:%S")))
+
+
+def _parse_isc(data: mmap.mmap) -> Iterator[Tuple[str, Optional[Lease]]]:
+    """
+    Every lease record in file order, as (ip address, lease or None if not active).
+    """
+    for match in RE_ISC_LEASE.finditer(data):
+        ipv4 = match.group(1).decode()
+        statements = dict(RE_ISC_STATEMENT.findall(match.group(2)))
+
+        hardware = statements.get(b"hardware ethernet")
+        if statements.get(b"binding state") != b"active" or not hardware:
+            yield ipv4, None
+            continue
+
+        hostname = statements.get(b"client-hostname", b"").strip(b'"')
+        yield ipv4, Lease(
+            ipv4=ipv4,
+            mac=hardware.decode().lower(),
+            starts=_isc_time(statements.get(b"starts")) or 0.0,
+            ends=_isc_time(statements.get(b"ends")),
+            hostname=hostname.decode(errors="replace"),
+        )
+
+
+def _parse_kea(data: mmap.mmap) -> Iterator[Tuple[str, Optional[Lease]]]:
+    lines = iter(data.readline, b"")
+    header = next(lines, b"").decode().strip().split(",")
+    columns = {name: i for i, name in enumerate(header)}
+    try:
+        address, hwaddr, valid_lifetime, expire = (
+            columns[x] for x in ("address", "hwaddr", "valid_lifetime", "expire")
+        )
+    except KeyError as e:
+        raise ValueError(f"Missing Kea lease file column {e}") from None
+    state = columns.get("state")
+    hostname = columns.get("hostname")
+
+    for line in lines:
+        record = line.decode(errors="replace").rstrip("\r\n").split(",")
+        if len(record) != len(header):
+            continue
+        ipv4 = record[address]
+        # A zero lifetime marks a deleted lease
+        if not record[hwaddr] or record[valid_lifetime] == "0" or \
+                (state is not None and record[state] != KEA_STATE_DEFAULT):
+            yield ipv4, None
+            continue
+
+        try:
+            ends = float(record[expire])
+            lifetime = float(record[valid_lifetime])
+        except ValueError:
+            log.warning("Skipping Kea lease for %s with a malformed expire or valid_lifetime: %r", ipv4, line)
+            continue
+        yield ipv4, Lease(
+            ipv4=ipv4,
+            mac=record[hwaddr].lower(),
+            starts=ends - lifetime,
+            ends=ends,
+            # Kea escapes commas in text fields
+            hostname=record[hostname].replace("&#x2c", ",") if hostname is not None else "",
+        )
+
+
+PARSERS = {
+    "isc": _parse_isc,
+    "kea": _parse_kea,
+}
+
+
+def read_leases(path: str, file_format: str, now: Optional[float] = None) -> Tuple[Lease, ...]:
+    """
+    The latest active, unexpired lease for each MAC address.
+    """
+    if now is None:
+        now = time.time()
+
+    latest: Dict[str, Optional[Lease]] = dict()
+    with open(path, "rb") as fp:
+        if os.fstat(fp.fileno()).st_size == 0:
+            return tuple()
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for ipv4, lease in PARSERS[file_format](data):
+                # Later records for an address supersede earlier ones
+                latest[ipv4] = lease
+
+    by_mac: Dict[str, Lease] = dict()
+    for lease in latest.values():
+        if lease is None or (lease.ends is not None and lease.ends < now):
+            continue
+        current = by_mac.get(lease.mac)
+        if current is None or lease.starts > current.starts:
+            by_mac[lease.mac] = lease
+    return tuple(by_mac.values())
+
+
+def fetch(source: SourceConfig) -> Tuple[Lease, ...]:
+    path = os.path.expanduser(source.get_key("path"))
+    file_format = source.get_optional_key("format", "kea" if path.endswith(".csv") else "isc")
+    if file_format not in PARSERS:
+        raise ValueError(f"Unknown lease file format '{file_format}'")
+
+    print(f"Reading: {path} ({source.name})")
+    return read_leases(path, file_format)
+
+
+def apply(model: Model, data: Tuple[Lease, ...]) -> None:
+    # Static maps and interface addresses take precedence over dynamic leases
+    applied = set(ingest_bindings(model, (MacBinding(mac=x.mac, ipv4=x.ipv4) for x in data), "DHCP lease"))
+
+    for lease in data:
+        if MacBinding(mac=lease.mac, ipv4=lease.ipv4) not in applied:
+            continue
+        model.get_ip_address(lease.ipv4).add_annotation("DHCP Lease")
+        if lease.hostname:
+            model.get_mac(lease.mac).add_annotation(lease.hostname)
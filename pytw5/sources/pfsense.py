@@ -22,156 +22,75 @@ import click
 import json
 from typing import NamedTuple, Dict, Set, Any, List, Tuple
 import ipaddress
-from ..model import Model, MacAddress
-from ..config import singleton
+from ..model import Model, MacAddress, MacBinding
+from ..config import SourceConfig
+from ._bindings import ingest_bindings
 
 
 log = logging.getLogger(__name__)
 CERT_PATH = os.path.join(os.path.dirname(__file__), "..", "root.crt")
 
 
+class PFSenseData(NamedTuple):
+    """
+    The raw API data used to populate the model.
+    """
+
+    available_interfaces: Dict[str, Any]
+    interfaces: Dict[str, Any]
+    virtual_ips: List[Dict[str, Any]]
+    dhcp: List[Dict[str, Any]]
+    unbound_hosts: List[Dict[str, Any]]
+
+
 class PFSense:
 
-    def __init__(self, url: str, session: requests.Session, authorisation_header: Dict[str, str]) -> None:
+    def __init__(self, url: str, session: requests.Session, authorisation_header: Dict[str, str], timeout: float) -> None:
         self._session = session
         self._url = url
         self._authorisation_header = authorisation_header
+        self._timeout = timeout
 
     @classmethod
-    def connect(cls) -> 'PFSense':
-        print(f"Connecting to: {singleton.pfsense_host}")
+    def connect(cls, source: SourceConfig) -> 'PFSense':
+        host = source.get_key("host")
+        print(f"Connecting to: {host} ({source.name})")
 
         session = requests.Session()
         session.verify = CERT_PATH
 
         headers = {
-            "Authorization": f"{singleton.pfsense_client_id} {singleton.pfsense_token}"
+            "Authorization": f"{source.get_key('client_id')} {source.get_key('token')}"
         }
 
         auth = session.get(
-            "{}/api/v1/status/system".format(singleton.pfsense_host),
+            "{}/api/v1/status/system".format(host),
             headers=headers,
+            timeout=source.timeout,
         )
         assert auth.ok, "Auth status = {}".format(auth.status_code)
         return PFSense(
             session=session, 
-            url=singleton.pfsense_host,
+            url=host,
             authorisation_header=headers,
+            timeout=source.timeout,
         )
     
-    def _load_interface_macs(self, model: Model) -> Dict[str, MacAddress]:
-        # We'll find out about the network interfaces first and maintain a map
-        ret: Dict[str, MacAddress] = {}
-
-        for i_name, props in self.available_interfaces.items():
-
-            # Not all interfaces have mac addresses (VPN tunnels, for example)
-            mac = props.get("mac")
-
-            if mac:
-                mac_obj = model.get_mac(mac)
-                mac_obj.add_annotation(props.get("dmesg"))
-                mac_obj.add_annotation(props.get("friendly"))
-                mac_obj.add_annotation(props.get("description"))
-
-                ip_address = props.get("ipaddr")
-                if ip_address:
-                    ip_address_obj = model.get_ip_address(ip_address)
-                    ip_address_obj.set_mac(mac_obj)
-                    ip_address_obj.add_annotation("PFsense Interface Address")
-
-                ret[i_name] = mac_obj
-
-        return ret
-
-    def _load_local_macs_ip_addresses_and_networks_into_model(self, model: Model) -> None:
-        i_name_to_mac = self._load_interface_macs(model)
-
-        # The interfaces API contains the network information
-        for interface_name, properties in self.interfaces.items():
-
-            description = properties.get("descr")
-            ip_address = properties.get("ipaddr")
-            subnet = properties.get("subnet")
-            interface = properties.get("if")
-            vlan = ""
-            interface_components = interface.split(".")
-            if len(interface_components) == 2:
-                vlan = interface_components[1]
-
-            if ip_address and subnet:
-                parsed_network = ipaddress.ip_network(f"{ip_address}/{subnet}", strict=False)
-                network_obj = model.get_network(f"{parsed_network.network_address}/{subnet}")
-                if vlan:
-                    network_obj.set_vlan(int(vlan))
-
-                network_obj.add_annotation(description)
-
-                ip_address_obj = model.get_ip_address(ip_address)
-
-                # We need to convert any VLAN interface suffixes
-                parent_interface = interface
-                if "." in parent_interface:
-                    parent_interface = parent_interface.split(".")[0]
-
-                ip_address_obj.set_mac(i_name_to_mac[parent_interface])
-
-        # Process the virtual IP addresses
-        for vip in self.virtual_ips:
-            ip_address_obj = model.get_ip_address(vip["subnet"])
-            ip_address_obj.add_annotation("PFsense Virtual IP")
-            ip_address_obj.add_annotation(vip.get("descr"))
-
-
-    def load_model(self, model: Model) -> None:
-        self._load_local_macs_ip_addresses_and_networks_into_model(model)
-
-        # The DHCP API contains the static map from MAC to IP Address
-        for dhcp_interface in self.dhcp:
-            for static_map in dhcp_interface.get("staticmap", list()):
-                mac = static_map["mac"]
-                ip_address = static_map["ipaddr"]
-                if mac and ip_address:
-                    # Make sure the mac exists
-                    mac_obj = model.get_mac(mac)
-                    mac_obj.add_annotation(static_map.get("descr"))
-                
-                    # We'll create an IP address entry
-                    ip_address_obj = model.get_ip_address(ip_address)
-                    ip_address_obj.set_mac(mac_obj)
-                    ip_address_obj.add_annotation(static_map.get("descr"))
-
-
-        # Build DNS lookups
-        for unbound_host in self.unbound_hosts:
-            host = unbound_host.get("host")
-            ip = unbound_host.get("ip")
-            domain = unbound_host.get("domain")
-            if host and ip and domain:
-                # Make sure we have an ip
-                ip_address_obj = model.get_ip_address(ip)
-
-                dns_lookup_obj = model.get_dns_lookup(f"{host}.{domain}")
-                dns_lookup_obj.add_ip_address(ip_address_obj)
-                dns_lookup_obj.add_annotation(unbound_host.get("descr"))
-
-                # Process any aliases
-                aliases = unbound_host.get("aliases")
-                if aliases:
-                    for alias in aliases.get("item", list()):
-                        host = alias.get("host")
-                        domain = alias.get("domain")
-                        if host and domain:
-
-                            dns_lookup_obj = model.get_dns_lookup(f"{host}.{domain}")
-                            dns_lookup_obj.add_ip_address(ip_address_obj)
-                            dns_lookup_obj.add_annotation(alias.get("description"))
+    def fetch(self) -> PFSenseData:
+        return PFSenseData(
+            available_interfaces=self.available_interfaces,
+            interfaces=self.interfaces,
+            virtual_ips=self.virtual_ips,
+            dhcp=self.dhcp,
+            unbound_hosts=self.unbound_hosts,
+        )
 
     @property
     def unbound_hosts(self) -> List[Dict[str, Any]]:
         response = self._session.get(
             "{}/api/v1/services/unbound".format(self._url),
             headers=self._authorisation_header,
+            timeout=self._timeout,
         )
         assert response.ok
         assert response.status_code == 200
@@ -185,6 +104,7 @@ class PFSense:
         response = self._session.get(
             "{}/api/v1/interface".format(self._url),
             headers=self._authorisation_header,
+            timeout=self._timeout,
         )
         assert response.ok
         assert response.status_code == 200
@@ -197,6 +117,7 @@ class PFSense:
         response = self._session.get(
             "{}/api/v1/interface/available".format(self._url),
             headers=self._authorisation_header,
+            timeout=self._timeout,
         )
         assert response.ok
         assert response.status_code == 200
@@ -209,6 +130,7 @@ class PFSense:
         response = self._session.get(
             "{}/api/v1/firewall/virtual_ip".format(self._url),
             headers=self._authorisation_header,
+            timeout=self._timeout,
         )
         assert response.ok
         assert response.status_code == 200
@@ -223,6 +145,7 @@ class PFSense:
         response = self._session.get(
             "{}/api/v1/services/dhcpd".format(self._url),
             headers=self._authorisation_header,
+            timeout=self._timeout,
         )
         assert response.ok
         assert response.status_code == 200
@@ -231,5 +154,124 @@ class PFSense:
         return json.loads(response.text)["data"]
 
 
-def load_model(model: Model) -> None:
-    PFSense.connect().load_model(model)
+def fetch(source: SourceConfig) -> PFSenseData:
+    return PFSense.connect(source).fetch()
+
+
+def _load_interface_macs(model: Model, data: PFSenseData) -> Dict[str, MacAddress]:
+    # We'll find out about the network interfaces first and maintain a map
+    ret: Dict[str, MacAddress] = {}
+
+    for i_name, props in data.available_interfaces.items():
+
+        # Not all interfaces have mac addresses (VPN tunnels, for example)
+        mac = props.get("mac")
+
+        if mac:
+            mac_obj = model.get_mac(mac)
+            mac_obj.add_annotation(props.get("dmesg"))
+            mac_obj.add_annotation(props.get("friendly"))
+            mac_obj.add_annotation(props.get("description"))
+
+            ip_address = props.get("ipaddr")
+            if ip_address:
+                ingest_bindings(model, (MacBinding(mac=mac_obj.mac, ipv4=ip_address),), "PFsense interface")
+                model.get_ip_address(ip_address).add_annotation("PFsense Interface Address")
+
+            ret[i_name] = mac_obj
+
+    return ret
+
+
+def _load_local_macs_ip_addresses_and_networks_into_model(model: Model, data: PFSenseData) -> None:
+    i_name_to_mac = _load_interface_macs(model, data)
+
+    # The interfaces API contains the network information
+    for interface_name, properties in data.interfaces.items():
+
+        description = properties.get("descr")
+        ip_address = properties.get("ipaddr")
+        subnet = properties.get("subnet")
+        interface = properties.get("if")
+        vlan = ""
+        interface_components = interface.split(".")
+        if len(interface_components) == 2:
+            vlan = interface_components[1]
+
+        if ip_address and subnet:
+            parsed_network = ipaddress.ip_network(f"{ip_address}/{subnet}", strict=False)
+            network_obj = model.get_network(f"{parsed_network.network_address}/{subnet}")
+            if vlan:
+                network_obj.set_vlan(int(vlan))
+
+            network_obj.add_annotation(description)
+
+            # We need to convert any VLAN interface suffixes
+            parent_interface = interface
+            if "." in parent_interface:
+                parent_interface = parent_interface.split(".")[0]
+
+            # Not every interface has a known MAC (e.g. from a config.xml backup)
+            mac_obj = i_name_to_mac.get(parent_interface)
+            if mac_obj is not None:
+                ingest_bindings(model, (MacBinding(mac=mac_obj.mac, ipv4=ip_address),), "PFsense interface")
+            else:
+                model.get_ip_address(ip_address)
+                log.debug("No MAC address for interface '%s'", parent_interface)
+
+    # Process the virtual IP addresses
+    for vip in data.virtual_ips:
+        ip_address_obj = model.get_ip_address(vip["subnet"])
+        ip_address_obj.add_annotation("PFsense Virtual IP")
+        ip_address_obj.add_annotation(vip.get("descr"))
+
+
+def apply(model: Model, data: PFSenseData) -> None:
+    _load_local_macs_ip_addresses_and_networks_into_model(model, data)
+
+    # The DHCP API contains the static map from MAC to IP Address
+    static_maps = [
+        static_map
+        for dhcp_interface in data.dhcp
+        for static_map in dhcp_interface.get("staticmap", list())
+        if static_map["mac"] and static_map["ipaddr"]
+    ]
+    applied = set(ingest_bindings(
+        model,
+        (MacBinding(mac=x["mac"], ipv4=x["ipaddr"]) for x in static_maps),
+        "DHCP static map",
+    ))
+
+    for static_map in static_maps:
+        binding = MacBinding(mac=static_map["mac"], ipv4=static_map["ipaddr"])
+        if binding not in applied:
+            continue
+        model.get_mac(binding.mac).add_annotation(static_map.get("descr"))
+        model.get_ip_address(binding.ipv4).add_annotation(static_map.get("descr"))
+
+
+    # Build DNS lookups
+    for unbound_host in data.unbound_hosts:
+        host = unbound_host.get("host")
+        ip = unbound_host.get("ip")
+        domain = unbound_host.get("domain")
+        if host and ip and domain:
+            # Make sure we have an ip
+            ip_address_obj = model.get_ip_address(ip)
+
+            dns_lookup_obj = model.get_dns_lookup(f"{host}.{domain}")
+            dns_lookup_obj.add_ip_address(ip_address_obj)
+            dns_lookup_obj.add_annotation(unbound_host.get("descr"))
+
+            # Process any aliases
+            aliases = unbound_host.get("aliases")
+            if aliases:
+                for alias in aliases.get("item", list()):
+                    host = alias.get("host")
+                    domain = alias.get("domain")
+                    if host and domain:
+
+                        dns_lookup_obj = model.get_dns_lookup(f"{host}.{domain}")
+                        dns_lookup_obj.add_ip_address(ip_address_obj)
+                        dns_lookup_obj.add_annotation(alias.get("description"))
+
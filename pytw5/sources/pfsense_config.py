@@ -0,0 +1,159 @@
+"""
+Description
+===========
+
+Populates the local model from a PFSense config.xml backup, as an offline
+alternative to the PFSense API. The file is read with a streaming parser and
+converted to the same raw data the API returns, so the model is filled exactly
+as the pfsense source fills it.
+
+Configuration
+=============
+
+    {
+        "name": "firewall",
+        "type": "pfsense_config",
+        "path": "/backups/config-firewall.xml",
+        "interface_macs": {"igb0": "00:11:22:33:44:55"}
+    }
+
+The backup doesn't contain the hardware MAC addresses of the interfaces, only
+any spoofed MAC addresses. Others can be given per physical interface with
+interface_macs, otherwise their addresses aren't linked to a MAC.
+
+"""
+
+import ipaddress
+import logging
+import os
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, List, Tuple
+from ..config import SourceConfig
+from ..model import Model
+from . import pfsense
+
+
+log = logging.getLogger(__name__)
+
+
+def _fields(elem: ET.Element) -> Dict[str, str]:
+    """
+    The leaf children of an element. Flags such as <enable/> map to "".
+    """
+    return {x.tag: (x.text or "").strip() for x in elem if len(x) == 0}
+
+
+def _is_ip_address(value: str) -> bool:
+    try:
+        ipaddress.ip_address(value)
+    except ValueError:
+        return False
+    return True
+
+
+def _available_interfaces(
+        interfaces: Dict[str, Dict[str, str]],
+        vlans: List[Dict[str, str]],
+        interface_macs: Dict[str, str],
+) -> Dict[str, Any]:
+    """
+    The equivalent of the API's available interfaces, keyed by the physical
+    interface name.
+    """
+    ret: Dict[str, Any] = dict()
+
+    parents = set(x["if"] for x in vlans if x.get("if"))
+    parents.update(x["if"].split(".")[0] for x in interfaces.values() if x.get("if"))
+    for name in parents:
+        # The model holds MAC addresses in lower case, exports often don't
+        ret[name] = {"mac": interface_macs.get(name, "").lower()}
+
+    # Interfaces assigned directly to the physical interface describe it
+    for friendly, props in interfaces.items():
+        name = props.get("if", "")
+        if name not in ret:
+            continue
+        ret[name].update(
+            friendly=friendly,
+            description=props.get("descr"),
+            ipaddr=props["ipaddr"] if _is_ip_address(props.get("ipaddr", "")) else "",
+        )
+        if props.get("spoofmac"):
+            ret[name]["mac"] = props["spoofmac"].lower()
+    return ret
+
+
+def _static_maps(elem: ET.Element, interface: str) -> List[Dict[str, str]]:
+    """
+    The DHCP static maps of an interface. An empty ipaddr (a MAC address
+    given a dynamic address) is kept, as the API returns it, but a static
+    map missing either element is skipped.
+    """
+    ret = list()
+    for static_map in (_fields(x) for x in elem.iterfind("staticmap")):
+        if "mac" not in static_map or "ipaddr" not in static_map:
+            log.warning("Skipping DHCP static map on '%s' without a MAC or IP address: %r", interface, static_map)
+            continue
+        ret.append(dict(static_map, mac=static_map["mac"].lower()))
+    return ret
+
+
+def parse(path: str, interface_macs: Dict[str, str]) -> pfsense.PFSenseData:
+    interfaces: Dict[str, Dict[str, str]] = dict()
+    vlans: List[Dict[str, str]] = list()
+    virtual_ips: List[Dict[str, str]] = list()
+    dhcp: List[Dict[str, Any]] = list()
+    unbound_hosts: List[Dict[str, Any]] = list()
+
+    # Only a handful of sections are needed, so everything is discarded as soon
+    # as it has been read (backups can contain large RRD and package data).
+    stack: List[str] = []
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            stack.append(elem.tag)
+            continue
+
+        section: Tuple[str, ...] = tuple(stack[1:])
+        stack.pop()
+        if len(section) != 2:
+            if len(section) < 2:
+                elem.clear()
+            continue
+
+        if section[0] == "interfaces":
+            interfaces[section[1]] = _fields(elem)
+        elif section == ("vlans", "vlan"):
+            vlans.append(_fields(elem))
+        elif section == ("virtualip", "vip"):
+            virtual_ips.append(_fields(elem))
+        elif section[0] == "dhcpd":
+            dhcp.append(dict(
+                _fields(elem),
+                interface=section[1],
+                staticmap=_static_maps(elem, section[1]),
+            ))
+        elif section == ("unbound", "hosts"):
+            unbound_hosts.append(dict(
+                _fields(elem),
+                aliases={"item": [_fields(x) for x in elem.iterfind("aliases/item")]},
+            ))
+        elem.clear()
+
+    return pfsense.PFSenseData(
+        available_interfaces=_available_interfaces(interfaces, vlans, interface_macs),
+        interfaces=interfaces,
+        virtual_ips=virtual_ips,
+        dhcp=dhcp,
+        unbound_hosts=unbound_hosts,
+    )
+
+
+def fetch(source: SourceConfig) -> pfsense.PFSenseData:
+    path = os.path.expanduser(source.get_key("path"))
+    interface_macs = source.get_optional_key("interface_macs", dict())
+    print(f"Reading: {path} ({source.name})")
+    return parse(path, interface_macs)
+
+
+def apply(model: Model, data: pfsense.PFSenseData) -> None:
+    pfsense.apply(model, data)
@@ -1,17 +1,25 @@
 from proxmoxer import ProxmoxAPI
-from ..config import singleton
-from typing import Dict
-from .. import Model
+from ..config import SourceConfig
+from typing import NamedTuple, Tuple
+from ..model import Model
 
 
-def load_model(model: Model) -> None:
+class VirtualMachine(NamedTuple):
+
+    name: str
+    mac: str
+
+
+def fetch(source: SourceConfig) -> Tuple[VirtualMachine, ...]:
     p = ProxmoxAPI(
-        singleton.proxmox_host,
-        user=singleton.proxmox_user, 
-        password=singleton.proxmox_password, 
-        verify_ssl=False
+        source.get_key("host"),
+        user=source.get_key("user"),
+        password=source.get_key("password"),
+        verify_ssl=False,
+        timeout=source.timeout,
     )
 
+    ret = []
     for node in p.nodes.get():
         for vm in p.nodes(node["node"]).qemu.get():
             config = p.nodes(node["node"]).qemu(vm["vmid"]).config.get()
@@ -25,4 +33,10 @@ def load_model(model: Model) -> None:
                     mac = sym[1]
 
             if mac:
-                model.get_mac(mac.lower()).add_annotation(f"Attached to virtual machine {vm_name}")
+                ret.append(VirtualMachine(name=vm_name, mac=mac.lower()))
+    return tuple(ret)
+
+
+def apply(model: Model, data: Tuple[VirtualMachine, ...]) -> None:
+    for vm in data:
+        model.get_mac(vm.mac).add_annotation(f"Attached to virtual machine {vm.name}")
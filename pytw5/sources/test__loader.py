@@ -0,0 +1,59 @@
+import os
+from pytw5.config import SourceConfig
+from pytw5.sources import _loader, dhcp_leases, unifi
+from pytw5.testing import ConfigTestCase
+
+LEASES = b"""\
+lease 10.0.0.5 {
+  starts epoch 1672920000;
+  ends never;
+  binding state active;
+  hardware ethernet aa:00:00:00:00:05;
+  client-hostname "printer";
+}
+"""
+
+SITES = (
+    unifi.Site(
+        name="default",
+        devices=(unifi.Device(mac="aa:00:00:00:00:01", name="ap", model="U7", ip_address="10.0.0.5", ports=()),),
+        clients=(),
+    ),
+)
+
+
+class TestLoader(ConfigTestCase):
+
+    CONFIG = {"sources": [{"name": "leases", "type": "dhcp_leases", "path": "dhcpd.leases"}]}
+
+    def setUp(self) -> None:
+        super().setUp()
+        with open(os.path.join(self.path, "dhcpd.leases"), "wb") as fp:
+            fp.write(LEASES)
+        self.leases = SourceConfig({"name": "leases", "type": "dhcp_leases", "path": fp.name})
+        self.unifi = SourceConfig({"name": "unifi", "type": "unifi"})
+
+    def test_process_pool(self) -> None:
+        # Spawned workers build the same model as an in process build
+        self.assertEqual(
+            _loader.build_compacts((self.leases,)),
+            _loader.build_compacts((self.leases,), max_workers=2),
+        )
+
+    def test_worker_config(self) -> None:
+        # Handed the configuration, as there is none on the working path to read
+        with _loader._process_pool(1) as executor:
+            self.assertEqual(("leases",), tuple(x.name for x in executor.submit(_loader.select_sources).result()))
+
+    def test_conflicts(self) -> None:
+        fetched = [(self.leases, dhcp_leases.read_leases(self.leases.get_key("path"), "isc")), (self.unifi, SITES)]
+
+        # Both keep the first binding, and log the conflict
+        with self.assertLogs("pytw5.sources", "WARNING"):
+            built = _loader.build_model(fetched)
+        with self.assertLogs("pytw5.sources", "WARNING"):
+            merged = _loader.merge_compacts((source, _loader._compact(source, data)) for source, data in fetched)
+
+        for m in (built, merged):
+            self.assertEqual("aa:00:00:00:00:05", m.get_ip_address("10.0.0.5").mac.mac)
+            self.assertEqual((), m.get_mac("aa:00:00:00:00:01").ip_addresses)
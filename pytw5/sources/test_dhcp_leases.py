@@ -0,0 +1,140 @@
+import os
+import tempfile
+import unittest
+import pytw5.model
+from pytw5.sources import dhcp_leases
+
+ISC_LEASES = b"""\
+# The format of this file is documented in the dhcpd.leases(5) manual page.
+lease 10.0.0.5 {
+  starts 4 2023/01/05 10:00:00;
+  ends 4 2023/01/05 22:00:00;
+  binding state active;
+  next binding state free;
+  hardware ethernet AA:00:00:00:00:05;
+  client-hostname "old";
+}
+lease 10.0.0.5 {
+  starts epoch 1672920000;
+  ends never;
+  binding state active;
+  next binding state free;
+  hardware ethernet aa:00:00:00:00:05;
+  set vendor-class-identifier = "x}";
+  client-hostname "printer";
+}
+lease 10.0.0.6 {
+  starts 4 2023/01/05 10:00:00;
+  ends 4 2023/01/05 22:00:00;
+  binding state active;
+  hardware ethernet aa:00:00:00:00:06;
+  uid "\\001\\252}{";
+  client-hostname "semi;colon";
+}
+lease 10.0.0.7 {
+  starts 4 2023/01/05 10:00:00;
+  ends 4 2023/01/05 22:00:00;
+  binding state active;
+  hardware ethernet aa:00:00:00:00:07;
+}
+lease 10.0.0.7 {
+  starts 4 2023/01/05 11:00:00;
+  ends 4 2023/01/05 11:00:00;
+  binding state free;
+  hardware ethernet aa:00:00:00:00:07;
+}
+lease 10.0.0.8 {
+  starts 3 2023/01/04 10:00:00;
+  ends 3 2023/01/04 11:00:00;
+  binding state active;
+  hardware ethernet aa:00:00:00:00:08;
+}
+"""
+
+KEA_LEASES = b"""\
+address,hwaddr,client_id,valid_lifetime,expire,subnet_id,fqdn_fwd,fqdn_rev,hostname,state,user_context
+10.0.1.5,aa:00:00:00:01:05,,3600,1672923600,1,0,0,printer&#x2c floor 2,0,
+10.0.1.6,AA:00:00:00:01:06,,3600,1672923600,1,0,0,,0,
+10.0.1.6,aa:00:00:00:01:06,,0,1672923600,1,0,0,,0,
+10.0.1.7,aa:00:00:00:01:07,,3600,1672923600,1,0,0,,2,
+10.0.1.8,aa:00:00:00:01:08,,3600,1672900000,1,0,0,,0,
+10.0.1.9,aa:00:00:00:01:05,,3600,1672920000,1,0,0,older,0,
+torn,line
+"""
+
+# 2023/01/05 12:00:00 UTC
+NOW = 1672920000.0
+
+
+class TestDhcpLeases(unittest.TestCase):
+
+    def _read(self, data: bytes, file_format: str):
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+        return {x.ipv4: x for x in dhcp_leases.read_leases(path, file_format, now=NOW)}
+
+    def test_isc(self) -> None:
+        leases = self._read(ISC_LEASES, "isc")
+        # Released (10.0.0.7) and expired (10.0.0.8) leases are dropped
+        self.assertEqual(["10.0.0.5", "10.0.0.6"], sorted(leases))
+
+        # The later record wins, and a brace in a quoted value doesn't end the lease
+        lease = leases["10.0.0.5"]
+        self.assertEqual("aa:00:00:00:00:05", lease.mac)
+        self.assertEqual("printer", lease.hostname)
+        self.assertEqual(1672920000.0, lease.starts)
+        self.assertIsNone(lease.ends)
+
+        lease = leases["10.0.0.6"]
+        self.assertEqual("semi;colon", lease.hostname)
+        self.assertEqual(1672912800.0, lease.starts)
+        self.assertEqual(1672956000.0, lease.ends)
+
+    def test_kea(self) -> None:
+        leases = self._read(KEA_LEASES, "kea")
+        # Deleted (zero lifetime), declined (state 2) and expired leases are
+        # dropped, and each MAC address keeps its latest lease
+        self.assertEqual(["10.0.1.5"], sorted(leases))
+        lease = leases["10.0.1.5"]
+        self.assertEqual("printer, floor 2", lease.hostname)
+        self.assertEqual(1672920000.0, lease.starts)
+
+    def test_kea_malformed(self) -> None:
+        rows = KEA_LEASES + (
+            b"10.0.1.9,aa:00:00:00:01:09,,3600,soon,1,0,0,,0,\n"
+            b"10.0.1.5,aa:00:00:00:01:05,,1h,1672923600,1,0,0,,0,\n"
+        )
+        with self.assertLogs("pytw5.sources.dhcp_leases", "WARNING") as logs:
+            leases = self._read(rows, "kea")
+        self.assertEqual(2, len(logs.records))
+        # The malformed rows are skipped, the others read as before
+        self.assertEqual(["10.0.1.5"], sorted(leases))
+        self.assertEqual("printer, floor 2", leases["10.0.1.5"].hostname)
+
+    def test_kea_missing_column(self) -> None:
+        with self.assertRaisesRegex(ValueError, "expire"):
+            self._read(b"address,hwaddr,valid_lifetime\n", "kea")
+
+    def test_empty(self) -> None:
+        self.assertEqual({}, self._read(b"", "isc"))
+
+    def test_apply(self) -> None:
+        model = pytw5.model.create_model()
+        model.get_ip_address("10.0.0.2").set_mac(model.get_mac("aa:00:00:00:00:01"))
+        leases = (
+            dhcp_leases.Lease("10.0.0.1", "aa:00:00:00:00:01", NOW, None, "web01"),
+            # Conflicts with a static map
+            dhcp_leases.Lease("10.0.0.2", "aa:00:00:00:00:02", NOW, None, "stale"),
+            dhcp_leases.Lease("10.0.0.300", "aa:00:00:00:00:03", NOW, None, "typo"),
+        )
+        with self.assertLogs("pytw5.sources._bindings", "WARNING") as logs:
+            dhcp_leases.apply(model, leases)
+        self.assertEqual(2, len(logs.records))
+
+        self.assertEqual(("DHCP Lease", "web01"), model.get_ip_address("10.0.0.1").annotations)
+        self.assertEqual("aa:00:00:00:00:01", model.get_ip_address("10.0.0.2").mac.mac)
+        self.assertNotIn("DHCP Lease", model.get_ip_address("10.0.0.2").annotations)
+        self.assertEqual(["aa:00:00:00:00:01"], [x.mac for x in model.mac_addresses])
+        self.assertEqual(["10.0.0.1", "10.0.0.2"], sorted(x.ipv4 for x in model.ip_addresses))
@@ -0,0 +1,30 @@
+import unittest
+import pytw5.model
+from pytw5.sources import pfsense
+
+
+class TestPFSense(unittest.TestCase):
+
+    def test_bad_static_maps(self) -> None:
+        data = pfsense.PFSenseData(
+            available_interfaces={},
+            interfaces={},
+            virtual_ips=[],
+            dhcp=[{"staticmap": [
+                {"mac": "aa:00:00:00:00:01", "ipaddr": "10.0.0.1", "descr": "web01"},
+                {"mac": "aa:00:00:00:00:02", "ipaddr": "10.0.0.300", "descr": "typo"},
+                {"mac": "aa:00:00:00:00:03", "ipaddr": "10.0.0.1", "descr": "duplicate"},
+                {"mac": "AA:00:00:00:00:04", "ipaddr": "10.0.0.4", "descr": "upper case"},
+            ]}],
+            unbound_hosts=[],
+        )
+        model = pytw5.model.create_model()
+        with self.assertLogs("pytw5.sources._bindings", "WARNING") as logs:
+            pfsense.apply(model, data)
+        self.assertEqual(3, len(logs.records))
+        self.assertIn("10.0.0.300", logs.output[0])
+
+        self.assertEqual(["10.0.0.1", "10.0.0.4"], sorted(x.ipv4 for x in model.ip_addresses))
+        self.assertEqual("aa:00:00:00:00:01", model.get_ip_address("10.0.0.1").mac.mac)
+        self.assertEqual(("web01", "web01"), model.get_ip_address("10.0.0.1").annotations)
+        self.assertEqual(["aa:00:00:00:00:01"], [x.mac for x in model.mac_addresses])
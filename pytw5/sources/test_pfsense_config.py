@@ -0,0 +1,148 @@
+import os
+import tempfile
+import unittest
+import pytw5.model
+from pytw5.sources import pfsense_config
+
+CONFIG = b"""\
+<?xml version="1.0"?>
+<pfsense>
+  <version>22.2</version>
+  <interfaces>
+    <wan>
+      <enable/>
+      <if>igb0</if>
+      <descr>WAN</descr>
+      <ipaddr>dhcp</ipaddr>
+    </wan>
+    <lan>
+      <enable/>
+      <if>igb1</if>
+      <descr>LAN</descr>
+      <ipaddr>10.0.0.1</ipaddr>
+      <subnet>24</subnet>
+      <spoofmac>02:00:00:00:00:0A</spoofmac>
+    </lan>
+    <opt1>
+      <if>igb1.20</if>
+      <descr>Servers</descr>
+      <ipaddr>10.0.20.1</ipaddr>
+      <subnet>24</subnet>
+    </opt1>
+  </interfaces>
+  <vlans>
+    <vlan>
+      <if>igb1</if>
+      <tag>20</tag>
+      <vlanif>igb1.20</vlanif>
+    </vlan>
+  </vlans>
+  <virtualip>
+    <vip>
+      <subnet>10.0.0.2</subnet>
+      <descr>CARP</descr>
+    </vip>
+  </virtualip>
+  <dhcpd>
+    <lan>
+      <range><from>10.0.0.100</from><to>10.0.0.199</to></range>
+      <staticmap>
+        <mac>aa:00:00:00:00:05</mac>
+        <ipaddr>10.0.0.5</ipaddr>
+        <descr>printer</descr>
+      </staticmap>
+      <staticmap>
+        <mac>aa:00:00:00:00:06</mac>
+        <ipaddr></ipaddr>
+        <descr>dynamic</descr>
+      </staticmap>
+      <staticmap>
+        <mac>AA:00:00:00:00:07</mac>
+        <ipaddr>10.0.0.7</ipaddr>
+        <descr>upper case</descr>
+      </staticmap>
+      <staticmap>
+        <ipaddr>10.0.0.8</ipaddr>
+        <descr>no mac</descr>
+      </staticmap>
+    </lan>
+  </dhcpd>
+  <unbound>
+    <hosts>
+      <host>printer</host>
+      <domain>example.com</domain>
+      <ip>10.0.0.5</ip>
+      <descr>Printer</descr>
+      <aliases>
+        <item><host>print</host><domain>example.com</domain><description>Alias</description></item>
+      </aliases>
+    </hosts>
+  </unbound>
+  <rrddata>
+    <rrddatafile><filename>wan-traffic.rrd</filename><data>AAAA</data></rrddatafile>
+  </rrddata>
+</pfsense>
+"""
+
+
+class TestPFSenseConfig(unittest.TestCase):
+
+    def setUp(self) -> None:
+        fd, self.path = tempfile.mkstemp(suffix=".xml")
+        self.addCleanup(os.remove, self.path)
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(CONFIG)
+
+    def test_parse(self) -> None:
+        with self.assertLogs("pytw5.sources.pfsense_config", "WARNING") as logs:
+            data = pfsense_config.parse(self.path, {"igb0": "00:11:22:33:AA:BB"})
+        self.assertIn("Skipping DHCP static map on 'lan' without a MAC or IP address", logs.output[0])
+
+        self.assertEqual(["lan", "opt1", "wan"], sorted(data.interfaces))
+        self.assertEqual("", data.interfaces["wan"]["enable"])
+        # The spoofed MAC address replaces the hardware one, both in lower
+        # case, and a DHCP interface address isn't an address
+        self.assertEqual(
+            {
+                "igb0": {"mac": "00:11:22:33:aa:bb", "friendly": "wan", "description": "WAN", "ipaddr": ""},
+                "igb1": {"mac": "02:00:00:00:00:0a", "friendly": "lan", "description": "LAN", "ipaddr": "10.0.0.1"},
+            },
+            data.available_interfaces,
+        )
+        self.assertEqual([{"subnet": "10.0.0.2", "descr": "CARP"}], data.virtual_ips)
+
+        dhcp, = data.dhcp
+        self.assertEqual("lan", dhcp["interface"])
+        self.assertEqual(
+            [("aa:00:00:00:00:05", "10.0.0.5"), ("aa:00:00:00:00:06", ""), ("aa:00:00:00:00:07", "10.0.0.7")],
+            [(x["mac"], x["ipaddr"]) for x in dhcp["staticmap"]],
+        )
+
+        host, = data.unbound_hosts
+        self.assertEqual("printer", host["host"])
+        self.assertEqual([{"host": "print", "domain": "example.com", "description": "Alias"}], host["aliases"]["item"])
+
+    def test_apply(self) -> None:
+        model = pytw5.model.create_model()
+        with self.assertLogs("pytw5.sources.pfsense_config", "WARNING"):
+            data = pfsense_config.parse(self.path, {})
+        pfsense_config.apply(model, data)
+
+        self.assertEqual(
+            ["10.0.0.1", "10.0.0.2", "10.0.0.5", "10.0.0.7", "10.0.20.1"],
+            sorted(x.ipv4 for x in model.ip_addresses),
+        )
+        self.assertEqual("02:00:00:00:00:0a", model.get_ip_address("10.0.0.1").mac.mac)
+        # The VLAN interface takes its parent's MAC address
+        self.assertEqual("02:00:00:00:00:0a", model.get_ip_address("10.0.20.1").mac.mac)
+        self.assertEqual("aa:00:00:00:00:07", model.get_ip_address("10.0.0.7").mac.mac)
+        self.assertEqual(20, model.get_network("10.0.20.0/24").vlan)
+        # Without interface_macs the WAN interface has no MAC address
+        self.assertEqual(
+            ["02:00:00:00:00:0a", "aa:00:00:00:00:05", "aa:00:00:00:00:07"],
+            sorted(x.mac for x in model.mac_addresses),
+        )
+        self.assertEqual(
+            ["print.example.com", "printer.example.com"],
+            sorted(x.host for x in model.get_ip_address("10.0.0.5").dns_lookups),
+        )
@@ -0,0 +1,76 @@
+import unittest
+import pytw5.model
+from pytw5.sources import unifi
+
+
+def _device(mac: str, name: str = None) -> unifi.Device:
+    return unifi.Device(mac=mac, name=name, model="USW", ip_address=None, ports=((1, "Port 1"), (2, "Port 2")))
+
+
+class TestUnifi(unittest.TestCase):
+
+    def test_apply_switches(self) -> None:
+        # An unadopted switch has no name, and each site has a "core-sw1"
+        sites = list()
+        for site_name, devices, clients in (
+                ("default", (_device("aa:00:00:00:00:f1"), _device("aa:00:00:00:00:f2", "core-sw1")),
+                 (("aa:00:00:00:00:03", "aa:00:00:00:00:f1"), ("aa:00:00:00:00:01", "aa:00:00:00:00:f2"))),
+                ("branch", (_device("aa:00:00:00:00:f3", "core-sw1"),),
+                 (("aa:00:00:00:00:02", "aa:00:00:00:00:f3"),)),
+        ):
+            index = unifi.switch_index(devices)
+            clients = tuple(unifi.wired_client(index, mac, switch_mac, 1) for mac, switch_mac in clients)
+            sites.append(unifi.Site(name=site_name, devices=devices, clients=clients))
+
+        model = pytw5.model.create_model()
+        unifi.apply(model, tuple(sites))
+
+        Node = pytw5.model.Node
+        self.assertEqual(
+            ["aa:00:00:00:00:f1", "aa:00:00:00:00:f2", "aa:00:00:00:00:f3"],
+            sorted(x.key for x in model.topology.nodes if x.kind == "switch"),
+        )
+        self.assertEqual("core-sw1", model.topology.label(Node("switch", "aa:00:00:00:00:f3")))
+        # The clients of the same-named switches stay on their own switch
+        self.assertEqual(
+            (Node.port("aa:00:00:00:00:f3", 1),),
+            model.topology.neighbours(Node("mac", "aa:00:00:00:00:02"), "port"),
+        )
+        self.assertEqual(
+            ("Connected to switch aa:00:00:00:00:f1 port #1 - Port 1",),
+            model.get_mac("aa:00:00:00:00:03").annotations,
+        )
+        self.assertEqual(
+            ("Unifi USW device 'aa:00:00:00:00:f1'",),
+            model.get_mac("aa:00:00:00:00:f1").annotations,
+        )
+
+    def test_device_from_record(self) -> None:
+        device = unifi.Device.from_record({
+            "mac": "aa:00:00:00:00:f1", "name": "core-sw1", "model": "USW",
+            "config_network": {"type": "dhcp", "ip": "10.0.0.2"},
+            "port_table": [{"port_idx": 1, "name": "Port 1", "rx_bytes": 1}, {"port_idx": 2, "name": "Uplink"}],
+            "radio_table_stats": [{"name": "wifi0"}],
+        })
+        self.assertEqual(
+            unifi.Device("aa:00:00:00:00:f1", "core-sw1", "USW", "10.0.0.2", ((1, "Port 1"), (2, "Uplink"))),
+            device,
+        )
+        # An unadopted access point has neither
+        self.assertEqual(
+            unifi.Device("aa:00:00:00:00:a1", None, "UAP", None, ()),
+            unifi.Device.from_record({"mac": "aa:00:00:00:00:a1", "model": "UAP"}),
+        )
+
+    def test_wired_client(self) -> None:
+        access_point = unifi.Device("aa:00:00:00:00:a1", "ap1", "UAP", None, ())
+        index = unifi.switch_index([_device("aa:00:00:00:00:f1", "core-sw1"), access_point])
+        # Devices without switch ports aren't switches
+        self.assertEqual(["aa:00:00:00:00:f1"], list(index))
+
+        self.assertEqual(
+            unifi.Client("aa:00:00:00:00:01", "aa:00:00:00:00:f1", "core-sw1", 2, "Port 2"),
+            unifi.wired_client(index, "aa:00:00:00:00:01", "aa:00:00:00:00:f1", 2),
+        )
+        self.assertIsNone(unifi.wired_client(index, "aa:00:00:00:00:01", "aa:00:00:00:00:f1", 9))
+        self.assertIsNone(unifi.wired_client(index, "aa:00:00:00:00:01", "aa:00:00:00:00:a1", 1))
@@ -0,0 +1,144 @@
+import base64
+import json
+import os
+import socket
+import tempfile
+import unittest
+import pytw5.model
+from pytw5.sources import unifi, unifi_events
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+SWITCH = "aa:00:00:00:00:f1"
+
+# As recorded from the controller feed, one message per line
+RECORDED = "\n".join(json.dumps(x) for x in (
+    {"meta": {"message": "sta:sync"}, "data": [
+        # Moved port
+        {"mac": "aa:00:00:00:00:01", "is_wired": True, "sw_mac": SWITCH, "sw_port": 2},
+        {"mac": "aa:00:00:00:00:09", "is_wired": False},
+    ]},
+    {"meta": {"message": "events"}, "data": [
+        {"key": "EVT_LU_Connected", "user": "AA:00:00:00:00:02", "sw": SWITCH, "port": "1"},
+        {"key": "EVT_LU_Connected", "user": "aa:00:00:00:00:03"},
+        {"key": "EVT_AP_Restarted"},
+    ]},
+    {"meta": {"message": "events"}, "data": [
+        {"key": "EVT_WU_Roam", "user": "aa:00:00:00:00:04"},
+        {"key": "EVT_LU_Disconnected", "user": "aa:00:00:00:00:05"},
+    ]},
+)) + "\nnot json\n"
+
+
+def _device() -> unifi.Device:
+    return unifi.Device(mac=SWITCH, name="core-sw1", model="USW", ip_address=None, ports=((1, "Port 1"), (2, "Port 2")))
+
+
+class TestUnifiEvents(unittest.TestCase):
+
+    def _write(self, text: str) -> str:
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, "w") as fp:
+            fp.write(text)
+        return path
+
+    def test_parse_message(self) -> None:
+        messages = RECORDED.splitlines()
+        self.assertEqual(
+            [unifi_events.ClientEvent(unifi_events.CONNECTED, "aa:00:00:00:00:01", SWITCH, 2)],
+            unifi_events.parse_message(messages[0]),
+        )
+        # Connections without a switch port are skipped, as are other events
+        self.assertEqual(
+            [unifi_events.ClientEvent(unifi_events.CONNECTED, "AA:00:00:00:00:02", SWITCH, 1)],
+            unifi_events.parse_message(messages[1]),
+        )
+        self.assertEqual(
+            [
+                unifi_events.ClientEvent(unifi_events.ROAMED, "aa:00:00:00:00:04"),
+                unifi_events.ClientEvent(unifi_events.DISCONNECTED, "aa:00:00:00:00:05"),
+            ],
+            unifi_events.parse_message(messages[2]),
+        )
+        self.assertEqual([], unifi_events.parse_message(messages[3]))
+
+    def test_apply_events(self) -> None:
+        model = pytw5.model.create_model()
+        index = unifi.switch_index([_device()])
+        unifi.apply(model, (unifi.Site(name="default", devices=(_device(),), clients=(
+            unifi.wired_client(index, "aa:00:00:00:00:01", SWITCH, 1),
+            unifi.wired_client(index, "aa:00:00:00:00:04", SWITCH, 2),
+        )),))
+
+        events = [x for line in RECORDED.splitlines() for x in unifi_events.parse_message(line)]
+        # Moved (01), connected (02) and roamed onto the wireless network (04)
+        self.assertEqual(3, unifi_events.apply_events(model, index, events))
+        # Unchanged the second time round
+        self.assertEqual(0, unifi_events.apply_events(model, index, events))
+
+        Node = pytw5.model.Node
+        self.assertEqual(
+            ("Connected to switch core-sw1 port #2 - Port 2",),
+            model.get_mac("aa:00:00:00:00:01").annotations,
+        )
+        self.assertEqual(
+            (Node("mac", "aa:00:00:00:00:01"),),
+            model.topology.neighbours(Node.port(SWITCH, 2), "mac"),
+        )
+        self.assertEqual(
+            (Node.port(SWITCH, 1),),
+            model.topology.neighbours(Node("mac", "aa:00:00:00:00:02"), "port"),
+        )
+        self.assertEqual((), model.get_mac("aa:00:00:00:00:04").annotations)
+        self.assertEqual((), model.topology.neighbours(Node("mac", "aa:00:00:00:00:04"), "port"))
+        # Disconnecting an unknown client doesn't create it
+        self.assertNotIn("aa:00:00:00:00:05", [x.mac for x in model.mac_addresses])
+
+    def test_replay_event_stream(self) -> None:
+        path = self._write(RECORDED + "\n\n")
+        self.assertEqual(RECORDED.splitlines(), list(unifi_events.ReplayEventStream(path)))
+
+    def test_replay_server(self) -> None:
+        server = unifi_events.ReplayServer(self._write(RECORDED))
+        server.start()
+        self.addCleanup(server.stop)
+
+        key = base64.b64encode(os.urandom(16)).decode()
+        with socket.create_connection(server.server_address[:2], timeout=5) as s:
+            s.sendall((
+                "GET / HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n"
+            ).encode())
+            fp = s.makefile("rb")
+            headers = list(iter(lambda: fp.readline().strip(), b""))
+            self.assertEqual(b"HTTP/1.1 101 Switching Protocols", headers[0])
+
+            messages = list()
+            while True:
+                opcode, length = fp.read(2)
+                length &= 0x7f
+                if length == 126:
+                    length = int.from_bytes(fp.read(2), "big")
+                payload = fp.read(length)
+                if opcode & 0x0f == 0x8:
+                    break
+                messages.append(payload.decode())
+        self.assertEqual(RECORDED.splitlines(), messages)
+
+    @unittest.skipUnless(websocket, "The live feed needs the websocket-client package")
+    def test_login_again(self) -> None:
+        server = unifi_events.ReplayServer(self._write(RECORDED), cookie="unifises=new")
+        server.start()
+        self.addCleanup(server.stop)
+
+        cookies = iter(("unifises=expired", "unifises=new"))
+        stream = unifi_events.WebSocketEventStream(server.url, login=lambda: next(cookies), timeout=5)
+        # The expired session is refused, so it logs in again
+        with self.assertLogs("pytw5.sources.unifi_events", "INFO"):
+            self.assertEqual(RECORDED.splitlines(), list(stream))
+        # And keeps the new session for the next connection
+        self.assertEqual(RECORDED.splitlines(), list(stream))
@@ -1,8 +1,16 @@
-import json
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from pyunifi.controller import Controller
-from typing import NamedTuple, Tuple
-from ..config import singleton
-from ..model import Model
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Tuple
+from ..config import SourceConfig
+from ..model import Model, MacBinding
+from ._bindings import ingest_bindings
+
+log = logging.getLogger(__name__)
+
+# Wired client annotations start with this, so they can be replaced when a client moves
+CLIENT_ANNOTATION_PREFIX = "Connected to switch "
 
 
 class Switch:
@@ -45,64 +53,139 @@ class Client(NamedTuple):
         print(f"  Switch Port Name = {self.switch_port_name}")
 
 
-def load_model(model: Model) -> None:
+class Device(NamedTuple):
+    """
+    The fields we use from a UniFi device record.
+    """
+
+    mac: str
+    name: str
+    model: str
+    ip_address: Optional[str]
+    ports: Tuple[Tuple[int, str], ...]
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> 'Device':
+        return cls(
+            mac=record.get("mac"),
+            name=record.get("name"),
+            model=record.get("model"),
+            ip_address=record.get("config_network", {}).get("ip"),
+            ports=tuple((x.get("port_idx"), x.get("name")) for x in record.get("port_table", list())),
+        )
+
+
+class Site(NamedTuple):
+
+    name: str
+    devices: Tuple[Device, ...]
+    clients: Tuple[Client, ...]
+
+
+def _connect(source: SourceConfig, site_id: str = "default") -> Controller:
     c = Controller(
-        singleton.unifi_controller_ip,
-        singleton.unifi_user,
-        singleton.unifi_password,
+        source.get_key("host"),
+        source.get_key("user"),
+        source.get_key("password"),
         version="UDMP-unifiOS",
+        site_id=site_id,
         ssl_verify=False,
     )
-    mac_to_switch: Dict[str, Switch] = dict()
+    # pyunifi has no timeout option, so apply the source timeout to the session requests
+    c.session.request = functools.partial(c.session.request, timeout=source.timeout)
+    return c
 
-    for ap in c.get_aps():
-        switch = Switch(
-            name=ap.get("name"),
-            mac=ap.get("mac")
-        )
-        mac_obj = model.get_mac(switch.mac)
-        mac_obj.add_annotation(f"Unifi {ap.get('model')} device '{switch.name}'")
-
-        ip_address = ap.get("config_network", {}).get("ip")
-        if ip_address:
-            ip_address_obj = model.get_ip_address(ip_address)
-            ip_address_obj.set_mac(mac_obj)
-
-        for port in ap.get("port_table", list()):
-            switch.add_port(
-                port_num=port.get("port_idx"),
-                port_name=port.get("name"),
-            )
-        if switch.ports:
-            mac_to_switch[switch.mac] = switch
-            # switch.print()
 
-        # print(json.dumps(ap, indent=4))
+def _fetch_site(source: SourceConfig, site_id: str) -> Site:
+    c = _connect(source, site_id)
+
+    # pyunifi returns each endpoint's records fully parsed, radio and statistics
+    # payloads included. Projecting them down to the fields we use means only
+    # the projections outlive the call and are kept for the site.
+    devices = tuple(Device.from_record(x) for x in c.get_aps())
+
+    # Switch port index for the site, built once
+    mac_to_switch = switch_index(devices)
 
-    # print(c.get_networks())
     clients = list()
     for client in c.get_clients():
         # Only deal with wired clients
-        if client.get("is_wired"):
-            # if client.get("network", "") == "3344_ceph":
-            #     print(f"Ceph mac: {client['mac']}")
-            # print(json.dumps(client, indent=4))
-            mac = client["mac"]
-            sw_mac = client.get("sw_mac")
-            sw_port = client.get("sw_port")
-
-            if mac and sw_mac and sw_port:
-                switch = mac_to_switch[sw_mac]
-                port_name = switch.ports[sw_port]
-                clients.append(Client(
-                    mac=mac,
-                    switch_mac=switch.mac,
-                    switch_name=switch.name,
-                    switch_port_num=sw_port,
-                    switch_port_name=port_name,
-                ))
-
-    for client in clients:
-        model.get_mac(client.mac.lower()).add_annotation(
-            f"Connected to switch {client.switch_name} port #{client.switch_port_num} - {client.switch_port_name}"
-        )
+        if not client.get("is_wired"):
+            continue
+        mac = client.get("mac")
+        sw_mac = client.get("sw_mac")
+        sw_port = client.get("sw_port")
+        if not (mac and sw_mac and sw_port):
+            continue
+
+        wired = wired_client(mac_to_switch, mac, sw_mac, sw_port)
+        if wired is None:
+            log.debug("Site '%s': skipping client %s on unknown switch port %s #%s", site_id, mac, sw_mac, sw_port)
+            continue
+        clients.append(wired)
+
+    return Site(name=site_id, devices=devices, clients=tuple(clients))
+
+
+def switch_index(devices: Iterable[Device]) -> Dict[str, Switch]:
+    """
+    The devices with switch ports, keyed by MAC address.
+    """
+    ret: Dict[str, Switch] = dict()
+    for device in devices:
+        switch = Switch(name=device.name, mac=device.mac)
+        for port_num, port_name in device.ports:
+            switch.add_port(port_num=port_num, port_name=port_name)
+        if switch.ports:
+            ret[switch.mac] = switch
+    return ret
+
+
+def wired_client(mac_to_switch: Dict[str, Switch], mac: str, sw_mac: str, sw_port: int) -> Optional[Client]:
+    switch = mac_to_switch.get(sw_mac)
+    if switch is None or sw_port not in switch.ports:
+        return None
+    return Client(
+        mac=mac,
+        switch_mac=switch.mac,
+        switch_name=switch.name,
+        switch_port_num=sw_port,
+        switch_port_name=switch.ports[sw_port],
+    )
+
+
+def client_annotation(client: Client) -> str:
+    switch = client.switch_name or client.switch_mac
+    return f"{CLIENT_ANNOTATION_PREFIX}{switch} port #{client.switch_port_num} - {client.switch_port_name}"
+
+
+def fetch(source: SourceConfig, max_workers: int = 8) -> Tuple[Site, ...]:
+    """
+    Collects every site on the controller in parallel.
+    """
+    site_ids = [x["name"] for x in _connect(source).get_sites()]
+    log.debug("Unifi %s sites: %s", source.name, site_ids)
+    if not site_ids:
+        return tuple()
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(site_ids))) as executor:
+        return tuple(executor.map(functools.partial(_fetch_site, source), site_ids))
+
+
+def apply(model: Model, data: Tuple[Site, ...]) -> None:
+    for site in data:
+        for device in site.devices:
+            mac_obj = model.get_mac(device.mac)
+            mac_obj.add_annotation(f"Unifi {device.model} device '{device.name or device.mac}'")
+
+            if device.ip_address:
+                ingest_bindings(model, (MacBinding(mac=mac_obj.mac, ipv4=device.ip_address),), "Unifi device")
+
+            if device.ports:
+                # Keyed by MAC address, as unadopted devices have no name and
+                # names needn't be unique across sites and controllers
+                model.add_switch(device.mac, name=device.name, ports=device.ports)
+
+        for client in site.clients:
+            model.get_mac(client.mac.lower()).add_annotation(client_annotation(client))
+            model.set_switch_port(client.mac.lower(), client.switch_mac, client.switch_port_num)
@@ -0,0 +1,319 @@
+"""
+Description
+===========
+
+Wired client connect, disconnect and roam events from the UniFi controller
+websocket event feed. These keep the client switch port annotations current
+between full runs (see pytw5 watch).
+
+Event Streams
+=============
+
+An event stream is an iterable of the raw websocket messages:
+
+- WebSocketEventStream reads a controller feed, and needs the optional
+  websocket-client package.
+- ReplayEventStream reads messages recorded to a file, one per line.
+- ReplayServer serves a recorded file as a local websocket stand-in for the
+  controller. Point a source at it with "events_url", e.g.
+  "ws://127.0.0.1:8765/".
+
+"""
+
+import base64
+import functools
+import hashlib
+import json
+import logging
+import socketserver
+import ssl
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+from click import ClickException
+from ..config import SourceConfig
+from ..model import Model
+from . import unifi
+
+log = logging.getLogger(__name__)
+
+CONNECTED = "connected"
+DISCONNECTED = "disconnected"
+ROAMED = "roamed"
+
+# Controller event keys (LU = LAN user, WU = WLAN user)
+EVENT_KINDS = {
+    "EVT_LU_Connected": CONNECTED,
+    "EVT_LU_Disconnected": DISCONNECTED,
+    "EVT_WU_Connected": ROAMED,
+    "EVT_WU_Roam": ROAMED,
+    "EVT_WU_RoamRadio": ROAMED,
+}
+
+
+class ClientEvent(NamedTuple):
+
+    kind: str
+    mac: str
+    # Only known for wired connections
+    switch_mac: Optional[str] = None
+    switch_port: Optional[int] = None
+
+
+def parse_message(message: str) -> List[ClientEvent]:
+    """
+    The client events in a websocket message. Client "sta:sync" updates carry
+    the current switch port of wired clients, and "events" messages carry the
+    connect, disconnect and roam events.
+    """
+    try:
+        record = json.loads(message)
+    except json.decoder.JSONDecodeError:
+        log.debug("Ignoring malformed event message %.80r", message)
+        return list()
+
+    kind = record.get("meta", dict()).get("message")
+    ret = list()
+    for data in record.get("data", list()):
+        if kind == "sta:sync":
+            mac = data.get("mac")
+            if mac and data.get("is_wired") and data.get("sw_mac") and data.get("sw_port"):
+                ret.append(ClientEvent(kind=CONNECTED, mac=mac, switch_mac=data["sw_mac"], switch_port=data["sw_port"]))
+        elif kind == "events":
+            event_kind = EVENT_KINDS.get(data.get("key"))
+            mac = data.get("user")
+            if event_kind is None or not mac:
+                continue
+            if event_kind == CONNECTED:
+                if not (data.get("sw") and data.get("port")):
+                    continue
+                ret.append(ClientEvent(kind=CONNECTED, mac=mac, switch_mac=data["sw"], switch_port=int(data["port"])))
+            else:
+                ret.append(ClientEvent(kind=event_kind, mac=mac))
+    return ret
+
+
+def apply_events(model: Model, mac_to_switch: Dict[str, unifi.Switch], events: Iterable[ClientEvent]) -> int:
+    """
+    Replaces the switch port annotation of each client, returning the number
+    of MAC addresses changed. Clients which disconnect or roam onto the
+    wireless network lose their annotation, as they would on a full run.
+    """
+    known = None
+    changed = 0
+    for event in events:
+        mac = event.mac.lower()
+        annotation = None
+        if event.kind == CONNECTED:
+            client = unifi.wired_client(mac_to_switch, mac, event.switch_mac, event.switch_port)
+            if client is None:
+                log.debug("Skipping client %s on unknown switch port %s #%s", mac, event.switch_mac, event.switch_port)
+                continue
+            annotation = unifi.client_annotation(client)
+        else:
+            # Don't create MAC addresses just to find they have nothing to remove
+            if known is None:
+                known = set(x.mac for x in model.mac_addresses)
+            if mac not in known:
+                continue
+
+        if annotation:
+            model.set_switch_port(mac, client.switch_mac, client.switch_port_num)
+        else:
+            model.clear_switch_port(mac)
+
+        mac_obj = model.get_mac(mac)
+        current = [x for x in mac_obj.annotations if x.startswith(unifi.CLIENT_ANNOTATION_PREFIX)]
+        if current == ([annotation] if annotation else []):
+            continue
+        for x in current:
+            mac_obj.remove_annotation(x)
+        if annotation:
+            mac_obj.add_annotation(annotation)
+        if known is not None:
+            known.add(mac)
+        changed += 1
+    return changed
+
+
+class WebSocketEventStream:
+    """
+    A controller feed, reconnected each time it is iterated. The login
+    callable returns a session cookie, and is called again if the controller
+    refuses a connection with the current one (e.g. once the session expires).
+    """
+
+    def __init__(self, url: str, login: Optional[Callable[[], str]] = None, timeout: float = 30) -> None:
+        self._url = url
+        self._login = login
+        self._cookie: Optional[str] = None
+        self._timeout = timeout
+
+    @property
+    def url(self) -> str:
+        return self._url
+
+    def _connect(self, websocket) -> Any:
+        if self._login is not None and self._cookie is None:
+            self._cookie = self._login()
+        return websocket.create_connection(
+            self._url,
+            cookie=self._cookie,
+            timeout=self._timeout,
+            sslopt={"cert_reqs": ssl.CERT_NONE},
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            import websocket
+        except ImportError:
+            raise ClickException("The UniFi event feed needs the websocket-client package!") from None
+
+        try:
+            ws = self._connect(websocket)
+        except websocket.WebSocketBadStatusException as e:
+            if self._login is None or e.status_code not in (401, 403):
+                raise
+            log.info("Event feed %s refused the session (%d), logging in again", self._url, e.status_code)
+            self._cookie = None
+            ws = self._connect(websocket)
+        try:
+            while True:
+                try:
+                    message = ws.recv()
+                except websocket.WebSocketTimeoutException:
+                    # Quiet feed, keep waiting
+                    continue
+                except websocket.WebSocketConnectionClosedException:
+                    return
+                if not message:
+                    return
+                yield message
+        finally:
+            ws.close()
+
+
+class ReplayEventStream:
+    """
+    Recorded websocket messages, one per line.
+    """
+
+    def __init__(self, path: str, delay: float = 0) -> None:
+        self._path = path
+        self._delay = delay
+
+    def __iter__(self) -> Iterator[str]:
+        with open(self._path, "r") as fp:
+            for line in fp:
+                line = line.strip()
+                if line:
+                    yield line
+                    if self._delay:
+                        time.sleep(self._delay)
+
+
+def event_streams(source: SourceConfig) -> Dict[str, Iterable[str]]:
+    """
+    A stream per site of the source, keyed by site name.
+    """
+    url = source.get_optional_key("events_url")
+    if url:
+        return {"default": WebSocketEventStream(url, timeout=source.timeout)}
+
+    ret: Dict[str, Iterable[str]] = dict()
+    for site in unifi._connect(source).get_sites():
+        ret[site["name"]] = WebSocketEventStream(
+            f"wss://{source.get_key('host')}/proxy/network/wss/s/{site['name']}/events",
+            login=functools.partial(_session_cookie, source, site["name"]),
+            timeout=source.timeout,
+        )
+    return ret
+
+
+def _session_cookie(source: SourceConfig, site_id: str) -> str:
+    # Authenticate as the API does and present the session cookie to the feed
+    c = unifi._connect(source, site_id)
+    return "; ".join(f"{k}={v}" for k, v in c.session.cookies.items())
+
+
+class _ReplayHandler(socketserver.StreamRequestHandler):
+
+    GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+    def handle(self) -> None:
+        headers = dict()
+        while True:
+            line = self.rfile.readline().decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.lower()] = value.strip()
+        key = headers.get("sec-websocket-key")
+        if key is None:
+            self.wfile.write(b"HTTP/1.1 400 Bad Request\r\n\r\n")
+            return
+        if self.server.cookie is not None and headers.get("cookie") != self.server.cookie:
+            self.wfile.write(b"HTTP/1.1 401 Unauthorized\r\nContent-Length: 0\r\n\r\n")
+            return
+
+        accept = base64.b64encode(hashlib.sha1((key + self.GUID).encode()).digest()).decode()
+        self.wfile.write((
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+        ).encode())
+
+        try:
+            for message in ReplayEventStream(self.server.path, self.server.delay):
+                self.wfile.write(self._frame(0x1, message.encode()))
+            self.wfile.write(self._frame(0x8, b""))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    @staticmethod
+    def _frame(opcode: int, payload: bytes) -> bytes:
+        # Server frames are unmasked
+        header = bytes([0x80 | opcode])
+        if len(payload) < 126:
+            header += bytes([len(payload)])
+        elif len(payload) < 1 << 16:
+            header += bytes([126]) + len(payload).to_bytes(2, "big")
+        else:
+            header += bytes([127]) + len(payload).to_bytes(8, "big")
+        return header + payload
+
+
+class ReplayServer(socketserver.ThreadingTCPServer):
+    """
+    A local websocket stand-in for the controller feed, which sends each
+    connection the recorded messages and then closes it. Connections without
+    the given session cookie, if any, are refused.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+            self, path: str, host: str = "127.0.0.1", port: int = 0, delay: float = 0, cookie: Optional[str] = None,
+    ) -> None:
+        super().__init__((host, port), _ReplayHandler)
+        self.path = path
+        self.delay = delay
+        self.cookie = cookie
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"ws://{host}:{port}/"
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.serve_forever, name="unifi-replay", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
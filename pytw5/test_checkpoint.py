@@ -0,0 +1,139 @@
+import os
+import tempfile
+import unittest
+from typing import Any, Dict, List, Tuple
+from unittest import mock
+import pytw5.model
+from pytw5 import checkpoint, twserver
+from pytw5.integrator import Integrator, TargetResult
+from pytw5.testing import ConfigTestCase, MemoryServer
+
+
+class FlakyServer(MemoryServer):
+    """
+    Fails the writes to the given titles, recording the others.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.failing = set()
+        self.written: List[str] = list()
+
+    def update_tiddler(self, tiddler: Dict[str, Any]) -> None:
+        if tiddler["title"] in self.failing:
+            raise ConnectionError(f"Failed to write {tiddler['title']}")
+        self.written.append(tiddler["title"])
+        super().update_tiddler(tiddler)
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.journal = checkpoint.Checkpoint(os.path.join(directory.name, "checkpoint.jsonl"))
+
+    def test_load(self) -> None:
+        self.journal.start()
+        self.journal.record_plan("nic", "d1", [("create", "a", None), ("delete", "b", {"title": "b", "text": "x"})])
+        self.journal.record_done("nic", "a")
+        self.journal.flush()
+        # Torn by an interrupted write
+        with open(self.journal.path, "a") as fp:
+            fp.write('{"done": [["nic", "b"')
+
+        with self.assertLogs("pytw5.checkpoint", "WARNING"):
+            loaded = self.journal.load()
+        self.assertEqual(["nic"], list(loaded))
+        self.assertEqual("d1", loaded["nic"].digest)
+        # Only the fields needed to write the tiddler are kept
+        self.assertEqual(("delete", "b", {"title": "b"}), loaded["nic"].operations[1])
+        self.assertEqual({"a"}, loaded["nic"].done)
+
+        # A later plan replaces the earlier one
+        self.journal.start(loaded)
+        self.journal.record_plan("nic", "d2", [("create", "c", None)])
+        self.assertEqual(checkpoint.ClassCheckpoint("d2", (("create", "c", None),), set()), self.journal.load()["nic"])
+
+    def test_start_truncates(self) -> None:
+        self.journal.start()
+        self.journal.record_plan("nic", "d1", [("create", "a", None)])
+        self.journal.start()
+        self.assertEqual({}, self.journal.load())
+        self.journal.finish()
+        self.assertFalse(os.path.exists(self.journal.path))
+
+    def test_start_carries_previous(self) -> None:
+        self.journal.start()
+        self.journal.record_plan("nic", "d1", [("create", "a", None), ("create", "b", None)])
+        self.journal.record_plan("network", "d2", [("create", "n", None)])
+        self.journal.record_done("nic", "a")
+        self.journal.flush()
+
+        previous = self.journal.load()
+        self.journal.start(previous)
+        self.assertEqual(previous, self.journal.load())
+
+        # Planning a class replaces its carried plan, and the journal is kept
+        # while a carried class is unreached
+        self.journal.record_plan("network", "d2", [])
+        self.journal.finish()
+        self.assertEqual({"a"}, self.journal.load()["nic"].done)
+        self.assertEqual((), self.journal.load()["network"].operations)
+
+
+class TestResume(ConfigTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.model = pytw5.model.create_model()
+        self.model.get_network("10.0.0.0/24")
+        for i in range(1, 4):
+            ip = self.model.get_ip_address(f"10.0.0.{i}")
+            ip.set_mac(self.model.get_mac(f"aa:00:00:00:00:0{i}"))
+            self.model.get_dns_lookup(f"host{i}.example.com").add_ip_address(ip)
+        self.server = FlakyServer()
+        self.journal = checkpoint.Checkpoint.for_target("wiki")
+
+    def _update(self, resume: bool, connected: bool = True) -> Tuple[TargetResult, ...]:
+        self.server.written.clear()
+        connect = mock.patch.object(
+            twserver.Server, "connect",
+            return_value=self.server if connected else None,
+            side_effect=None if connected else ConnectionError("Connection refused"),
+        )
+        with connect:
+            return Integrator(self.model).update(resume=resume)
+
+    def test_interrupted_resume(self) -> None:
+        # A write fails, so its title is left for the resume
+        self.server.failing = {"host3.example.com"}
+        result, = self._update(resume=False)
+        self.assertIsNotNone(result.error)
+        self.assertEqual(["host3.example.com"], self._remaining())
+
+        # A resume which can't connect keeps the checkpoint
+        result, = self._update(resume=True, connected=False)
+        self.assertIn("Connection refused", result.error)
+        self.assertEqual(["host3.example.com"], self._remaining())
+
+        # A resume interrupted before reaching the DNS lookups keeps their plan
+        with mock.patch.object(Integrator, "process_dns_lookups", side_effect=RuntimeError("Interrupted")):
+            with self.assertRaises(RuntimeError):
+                self._update(resume=True)
+        self.assertEqual([], self.server.written)
+        self.assertEqual(["host3.example.com"], self._remaining())
+
+        # The final resume writes only what was left
+        self.server.failing = set()
+        result, = self._update(resume=True)
+        self.assertIsNone(result.error)
+        self.assertEqual(["host3.example.com"], self.server.written)
+        self.assertFalse(os.path.exists(self.journal.path))
+
+    def _remaining(self) -> List[str]:
+        return sorted(
+            title
+            for resumed in self.journal.load().values()
+            for _, title, _ in resumed.operations if title not in resumed.done
+        )
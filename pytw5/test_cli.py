@@ -0,0 +1,35 @@
+from click.testing import CliRunner
+from pytw5 import history
+from pytw5.cli import root_cmd
+from pytw5.testing import ConfigTestCase
+
+
+def _network(free_ranges: str, annotations: str) -> dict:
+    return {"network:10.0.0.0/24": {"network": "10.0.0.0/24", "free_ranges": free_ranges, "annotations": annotations}}
+
+
+class TestHistory(ConfigTestCase):
+
+    def _history(self, *states) -> str:
+        recorder = history.History.open()
+        for state in states:
+            recorder.record(state, now="t")
+        result = CliRunner().invoke(root_cmd, ["-p", self.path, "history", "10.0.0.0/24"])
+        self.assertEqual(0, result.exit_code, result.output)
+        return result.output
+
+    def test_list_changes(self) -> None:
+        output = self._history(
+            _network("10.0.0.3-10.0.0.9 10.0.0.20-10.0.0.254", "a"),
+            _network("10.0.0.3-10.0.0.9 10.0.0.21-10.0.0.254", "a b"),
+            _network("10.0.0.21-10.0.0.254 10.0.0.3-10.0.0.9", "a b"),
+        )
+        # Ordered lists are diffed by item like the other lists
+        self.assertIn("    free_ranges: +10.0.0.21-10.0.0.254, -10.0.0.20-10.0.0.254\n", output)
+        self.assertIn("    annotations: +b\n", output)
+        self.assertIn("    free_ranges: reordered\n", output)
+
+    def test_no_history(self) -> None:
+        result = CliRunner().invoke(root_cmd, ["-p", self.path, "history", "10.0.0.0/24"])
+        self.assertEqual(1, result.exit_code)
+        self.assertIn("No history for 'network:10.0.0.0/24'!", result.output)
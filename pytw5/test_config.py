@@ -0,0 +1,81 @@
+import unittest
+from click import ClickException
+from pytw5.config import ChurnLimit, singleton, TargetConfig
+from pytw5.testing import ConfigTestCase
+
+
+def _target(**config) -> TargetConfig:
+    return TargetConfig(dict({"name": "wiki", "host": "http://wiki"}, **config))
+
+
+class TestTargetConfig(unittest.TestCase):
+
+    def test_churn_limit(self) -> None:
+        self.assertEqual(ChurnLimit(), _target().churn_limit("nic"))
+        target = _target(churn_guard={"max_delete": 0.1, "nic": {"max_update": None}, "network": False})
+        self.assertEqual(ChurnLimit(max_delete=0.1, max_update=None), target.churn_limit("nic"))
+        self.assertEqual(ChurnLimit(max_delete=0.1), target.churn_limit("ip_address"))
+        # Off for one class, or for all of them
+        self.assertIsNone(target.churn_limit("network"))
+        self.assertIsNone(_target(churn_guard=False).churn_limit("nic"))
+
+    def test_churn_limit_invalid(self) -> None:
+        for guard, message in (
+                (True, "Expected an object or false for 'churn_guard' of target 'wiki'!"),
+                ({"nic": True}, "Expected an object or false for 'churn_guard.nic' of target 'wiki'!"),
+                ({"nic": [0.1]}, "Expected an object or false for 'churn_guard.nic' of target 'wiki'!"),
+                ({"nic": {"max_deletes": 0.1}}, "Unknown 'churn_guard' keys ['max_deletes'] for target 'wiki'!"),
+        ):
+            with self.assertRaises(ClickException) as raised:
+                _target(churn_guard=guard).churn_limit("nic")
+            self.assertEqual(message, raised.exception.message)
+
+
+class TestInstances(ConfigTestCase):
+
+    def _configure(self, **config) -> None:
+        singleton._lazy_config = config
+
+    def test_sources(self) -> None:
+        self._configure(sources=[
+            {"name": "fw1", "type": "pfsense", "host": "https://fw1"},
+            {"name": "fw2", "type": "pfsense", "host": "https://fw2", "enabled": False},
+            {"name": "leases", "type": "dhcp_leases", "path": "/var/db/dhcpd.leases"},
+        ])
+        self.assertEqual(
+            [("fw1", "pfsense", True), ("fw2", "pfsense", False), ("leases", "dhcp_leases", True)],
+            [(x.name, x.type, x.enabled) for x in singleton.sources],
+        )
+        self.assertEqual("https://fw2", singleton.sources[1].get_key("host"))
+        with self.assertRaisesRegex(ClickException, "Missing 'token' configuration key for source 'fw1'!"):
+            singleton.sources[0].get_key("token")
+
+    def test_legacy_sources(self) -> None:
+        # One instance per source type, from the legacy keys
+        self._configure(pfsense_host="https://fw", pfsense_token="secret", unifi_controller_ip="10.0.0.2")
+        sources = singleton.sources
+        self.assertEqual(["pfsense", "proxmox", "unifi"], [x.name for x in sources])
+        self.assertEqual(["pfsense", "proxmox", "unifi"], [x.type for x in sources])
+        self.assertEqual(("https://fw", "secret"), (sources[0].get_key("host"), sources[0].get_key("token")))
+        self.assertEqual("10.0.0.2", sources[2].get_key("host"))
+        self.assertIsNone(sources[1].get_optional_key("host"))
+
+    def test_invalid_sources(self) -> None:
+        self._configure(sources=[{"name": "fw1", "type": "pfsense"}, {"name": "fw1", "type": "unifi"}])
+        with self.assertRaisesRegex(ClickException, r"Duplicate source names \['fw1'\]!"):
+            singleton.sources
+        self._configure(sources=[{"name": "fw1", "type": "opnsense"}])
+        with self.assertRaisesRegex(ClickException, "Unknown type 'opnsense' for source 'fw1'!"):
+            singleton.sources
+        self._configure(sources=[{"type": "pfsense"}])
+        with self.assertRaisesRegex(ClickException, "Missing 'name' configuration key for source!"):
+            singleton.sources
+
+    def test_targets(self) -> None:
+        self._configure(twserver_host="http://wiki", twserver_user="user", twserver_password="secret")
+        target, = singleton.targets
+        self.assertEqual(("twserver", "http://wiki", "user"), (target.name, target.host, target.user))
+
+        self._configure(targets=[{"name": "a", "host": "http://a"}, {"name": "a", "host": "http://b"}])
+        with self.assertRaisesRegex(ClickException, r"Duplicate target names \['a'\]!"):
+            singleton.targets
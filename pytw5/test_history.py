@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+from pytw5 import history
+
+
+def _state(**entities):
+    return {history.entity_key("ip_address", k): v for k, v in entities.items()}
+
+
+class TestHistory(unittest.TestCase):
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "history")
+        self.history = history.History(self.path)
+
+    def test_guess_key(self) -> None:
+        self.assertEqual("nic:aa:00:00:00:00:01", history.guess_key("AA:00:00:00:00:01"))
+        self.assertEqual("ip_address:10.0.0.1", history.guess_key("10.0.0.1"))
+        self.assertEqual("network:10.0.0.0/24", history.guess_key("10.0.0.0/24"))
+        self.assertEqual("dns_lookup:web01.example.com", history.guess_key("web01.example.com"))
+
+    def test_state_from(self) -> None:
+        rendered = [("ip_address", [{"title": "10.0.0.1", "twit_class": "ip_address", "mac": "aa:00:00:00:00:01"}])]
+        self.assertEqual({"ip_address:10.0.0.1": {"mac": "aa:00:00:00:00:01"}}, history.state_from(rendered))
+
+    def test_record(self) -> None:
+        self.history.CHECKPOINT_INTERVAL = 3
+        states = [
+            _state(a={"mac": "1"}),
+            _state(a={"mac": "2", "hosts": "web"}),
+            _state(a={"mac": "2"}, b={"mac": "3"}),
+            _state(b={"mac": "3"}),
+            _state(b={"mac": "4"}),
+        ]
+        for i, state in enumerate(states):
+            entry = self.history.record(state, now=f"t{i}")
+            self.assertEqual(i + 1, entry.run)
+            self.assertEqual(i in (0, 3), entry.checkpoint)
+        # Unchanged runs aren't recorded
+        self.assertIsNone(self.history.record(states[-1]))
+
+        index = self.history.index()
+        self.assertEqual([1, 2, 3, 4, 5], [x.run for x in index])
+        self.assertEqual(frozenset({"ip_address:a", "ip_address:b"}), index[2].keys)
+
+        # Read back by another instance, from the nearest checkpoint
+        reader = history.History(self.path)
+        for i, state in enumerate(states):
+            self.assertEqual(state, reader.state_at(i + 1))
+        self.assertEqual(states[-1], reader.state_at())
+
+    def test_entity_history(self) -> None:
+        for state in (
+                _state(a={"mac": "1"}),
+                _state(a={"mac": "2", "hosts": "web"}),
+                _state(b={"mac": "3"}),
+                _state(a={"mac": "1"}, b={"mac": "3"}),
+        ):
+            self.history.record(state, now="t")
+
+        changes = self.history.entity_history("ip_address:a")
+        self.assertEqual(
+            [
+                history.Change(1, "t", "created", {"mac": (None, "1")}),
+                history.Change(2, "t", "changed", {"mac": ("1", "2"), "hosts": (None, "web")}),
+                history.Change(3, "t", "removed", {"mac": ("2", None), "hosts": ("web", None)}),
+                history.Change(4, "t", "created", {"mac": (None, "1")}),
+            ],
+            changes,
+        )
+        self.assertEqual([], self.history.entity_history("ip_address:c"))
+
+    def test_torn_index(self) -> None:
+        self.history.record(_state(a={"mac": "1"}))
+        with open(self.history.index_path, "a") as fp:
+            fp.write('{"run": 2, "ti')
+        with open(self.history.log_path, "ab") as fp:
+            fp.write(b"\x1f\x8b")
+
+        with self.assertLogs("pytw5.history", "WARNING"):
+            self.assertEqual([1], [x.run for x in self.history.index()])
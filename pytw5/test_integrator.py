@@ -0,0 +1,341 @@
+import os
+import tempfile
+import unittest
+import time
+from typing import Any, Dict, List
+from unittest import mock
+import pytw5.model
+from pytw5 import checkpoint, progress, schema, twserver
+from pytw5.config import singleton, TargetConfig
+from pytw5.integrator import Integrator
+from pytw5.testing import ConfigTestCase, MemoryServer
+
+COUNT = 40
+
+CONFIG_XML = b"""\
+<?xml version="1.0"?>
+<pfsense>
+  <interfaces>
+    <lan>
+      <if>igb1</if>
+      <descr>LAN</descr>
+      <ipaddr>10.0.0.1</ipaddr>
+      <subnet>24</subnet>
+    </lan>
+  </interfaces>
+  <dhcpd>
+    <lan>
+      <staticmap>
+        <mac>aa:00:00:00:00:05</mac>
+        <ipaddr>10.0.0.5</ipaddr>
+        <descr>printer</descr>
+      </staticmap>
+    </lan>
+  </dhcpd>
+  <unbound>
+    <hosts>
+      <host>printer</host>
+      <domain>example.com</domain>
+      <ip>10.0.0.5</ip>
+    </hosts>
+  </unbound>
+</pfsense>
+"""
+
+KEA_LEASES = """\
+address,hwaddr,client_id,valid_lifetime,expire,subnet_id,fqdn_fwd,fqdn_rev,hostname,state,user_context
+10.0.0.100,aa:00:00:00:00:64,,3600,{expire},1,0,0,laptop,0,
+"""
+
+
+def _dns_lookup(i: int, annotations: List[str] = (), sources: List[str] = ("fw1",)) -> Dict[str, str]:
+    return schema.SCHEMAS["dns_lookup"].encode({
+        "title": f"host{i}.example.com",
+        "host": f"host{i}.example.com",
+        "ip_addresses": [f"10.0.0.{i}"],
+        "annotations": annotations,
+        schema.OWNER_FIELD: sources,
+    })
+
+
+def _listed(encoded: Dict[str, str], **fields: str) -> Dict[str, str]:
+    ret = dict(encoded, tags=Integrator.TAG, revision="1", bag="default")
+    ret.update(fields)
+    return {k: v for k, v in ret.items() if v is not None}
+
+
+class TestChurnGuard(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.integrator = Integrator(pytw5.model.create_model())
+        self.target = TargetConfig({"name": "wiki", "host": "http://wiki"})
+
+    def _guard(self, listing, target_state, target=None):
+        listing = tuple(listing)
+        operations = self.integrator._plan_class(listing=listing, twit_class="dns_lookup", target_state=list(target_state))
+        return self.integrator._guard_class(target or self.target, listing, "dns_lookup", operations)
+
+    def test_partial_data(self) -> None:
+        # Every tiddler loses its annotation, e.g. a source returned nothing
+        listing = [_listed(_dns_lookup(i, ["Printer"])) for i in range(COUNT)]
+        operations, anomalies = self._guard(listing, [_dns_lookup(i) for i in range(COUNT)])
+        self.assertEqual([], operations)
+        self.assertEqual(["dns_lookup: withheld 40 updates of 40 existing tiddlers (limit 50%)"], anomalies)
+
+        # Unless the guard is off
+        target = TargetConfig({"name": "wiki", "host": "http://wiki", "churn_guard": {"dns_lookup": {"max_update": None}}})
+        operations, anomalies = self._guard(listing, [_dns_lookup(i) for i in range(COUNT)], target)
+        self.assertEqual(COUNT, len(operations))
+        self.assertEqual([], anomalies)
+
+    def test_deletes(self) -> None:
+        listing = [_listed(_dns_lookup(i)) for i in range(COUNT)]
+        operations, anomalies = self._guard(listing, [_dns_lookup(i) for i in range(COUNT // 2)])
+        self.assertEqual([], operations)
+        self.assertEqual(["dns_lookup: withheld 20 deletes of 40 existing tiddlers (limit 25%)"], anomalies)
+
+        # Too few to matter
+        operations, anomalies = self._guard(listing[:10], [])
+        self.assertEqual(["delete"] * 10, [x.kind for x in operations])
+        self.assertEqual([], anomalies)
+
+    def test_schema_migration(self) -> None:
+        # Written before the owner field existed, with a list in another order
+        listing = [
+            _listed(_dns_lookup(i, ["b", "a c"]), **{schema.OWNER_FIELD: None, "annotations": "b [[a c]]"})
+            for i in range(COUNT)
+        ]
+        target_state = [_dns_lookup(i, ["b", "a c"]) for i in range(COUNT)]
+        # ...and a few which really changed
+        target_state[:5] = [_dns_lookup(i, ["b"]) for i in range(5)]
+
+        operations, anomalies = self._guard(listing, target_state)
+        self.assertEqual(["update"] * COUNT, [x.kind for x in operations])
+        self.assertEqual([], anomalies)
+
+        # Real changes among the migrations are still guarded
+        target_state = [_dns_lookup(i, ["b"]) for i in range(COUNT)]
+        target_state[:5] = [_dns_lookup(i, ["b", "a c"]) for i in range(5)]
+        operations, anomalies = self._guard(listing, target_state)
+        self.assertEqual([f"host{i}.example.com" for i in range(5)], [x.title for x in operations])
+        self.assertEqual(["dns_lookup: withheld 35 updates of 40 existing tiddlers (limit 50%)"], anomalies)
+
+    def test_migrates(self) -> None:
+        codec = schema.SCHEMAS["network"]
+        encoded = codec.encode({
+            "title": "10.0.0.0/24", "network": "10.0.0.0/24", "vlan": 10, "prefix_length": 24,
+            "annotations": ["b", "a"], "ip_addresses": [], "used": 2, "free": 252, "utilisation": "1%",
+            "free_ranges": ["10.0.0.3-10.0.0.254"], schema.OWNER_FIELD: ["fw1"],
+        })
+        self.assertTrue(codec.migrates(encoded, dict(encoded)))
+        legacy = {k: v for k, v in encoded.items() if k not in ("used", "free", "utilisation", "free_ranges", schema.OWNER_FIELD)}
+        self.assertTrue(codec.migrates(encoded, dict(legacy, annotations="b a", retired="x")))
+        self.assertFalse(codec.migrates(encoded, dict(legacy, vlan="20")))
+        self.assertFalse(codec.migrates(encoded, dict(legacy, used="lots")))
+        self.assertFalse(codec.migrates(encoded, dict(encoded, free_ranges="10.0.0.4-10.0.0.254 10.0.0.3")))
+
+
+class TestPlanOwnership(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.integrator = Integrator(pytw5.model.create_model())
+        # Owned by the selected source, shared with another, and written before sources were recorded
+        self.listing = (
+            _listed(_dns_lookup(1, ["old"])),
+            _listed(_dns_lookup(2, ["old"], sources=["ctl1", "fw1"])),
+            _listed(_dns_lookup(3, ["old"]), **{schema.OWNER_FIELD: None}),
+            _listed(_dns_lookup(11)),
+            _listed(_dns_lookup(12, sources=["ctl1", "fw1"])),
+            _listed(_dns_lookup(13), **{schema.OWNER_FIELD: None}),
+        )
+        # 1-3 are updated, 11-13 are gone and 21 is new
+        self.target_state = [_dns_lookup(i) for i in (1, 2, 3, 21)]
+
+    def _plan(self, owners=None):
+        operations = self.integrator._plan_class(
+            listing=self.listing, twit_class="dns_lookup", target_state=self.target_state, owners=owners,
+        )
+        return sorted((x.kind, x.title.partition(".")[0]) for x in operations)
+
+    def test_full_run(self) -> None:
+        self.assertEqual(
+            [
+                ("create", "host21"),
+                ("delete", "host11"), ("delete", "host12"), ("delete", "host13"),
+                ("update", "host1"), ("update", "host2"), ("update", "host3"),
+            ],
+            self._plan(),
+        )
+
+    def test_partial_run(self) -> None:
+        # Only the tiddlers the selected source owns outright are rewritten or deleted
+        with self.assertLogs("pytw5.integrator", "INFO") as logs:
+            self.assertEqual([("create", "host21"), ("delete", "host11"), ("update", "host1")], self._plan({"fw1"}))
+        self.assertIn("Skipped 4 dns_lookup tiddlers", logs.output[0])
+
+        # Shared tiddlers are owned when every source that contributed is selected
+        self.assertEqual(
+            [("create", "host21"), ("delete", "host11"), ("delete", "host12"), ("update", "host1"), ("update", "host2")],
+            self._plan({"fw1", "ctl1"}),
+        )
+
+
+class RecordingServer(MemoryServer):
+    """
+    Records the order of the writes.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.written: List[str] = list()
+
+    def update_tiddler(self, tiddler: Dict[str, Any]) -> None:
+        self.written.append(f"{tiddler['twit_class']}:{tiddler['title']}")
+        super().update_tiddler(tiddler)
+
+    def delete_tiddler(self, title: str) -> None:
+        self.written.append(f"delete:{title}")
+        super().delete_tiddler(title)
+
+
+class TestApplyPriority(unittest.TestCase):
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+
+        m = pytw5.model.create_model()
+        m.get_network("10.0.0.0/24")
+        ip = m.get_ip_address("10.0.0.1")
+        ip.set_mac(m.get_mac("aa:00:00:00:00:01"))
+        m.get_dns_lookup("host1.example.com").add_ip_address(ip)
+        self.integrator = Integrator(m)
+
+        self.server = RecordingServer()
+        self.server.update_tiddler(_listed(_dns_lookup(9)))
+        self.server.written.clear()
+
+    def _sync(self, **config) -> List[str]:
+        target = TargetConfig(dict({"name": "wiki", "host": "http://wiki", "max_in_flight_writes": 1}, **config))
+        planned = list()
+
+        # The least urgent class first
+        order = ("dns_lookup", "nic", "ip_address", "network")
+
+        def _rendered():
+            for twit_class, process in sorted(self.integrator.twit_classes, key=lambda x: order.index(x[0])):
+                target_state = process()
+                planned.append((twit_class, list(self.server.written)))
+                yield twit_class, target_state, checkpoint.digest(target_state)
+
+        journal = checkpoint.Checkpoint(os.path.join(self.path, "checkpoint.jsonl"))
+        journal.start()
+        report = progress.ProgressFile(os.path.join(self.path, "progress.json"), target.name)
+        result = self.integrator._sync_target(
+            target=target, server=self.server, rendered=_rendered(), journal=journal, report=report, previous=dict(),
+        )
+        self.assertEqual((4, 1), (result.created, result.deleted))
+        self.planned = planned
+        return self.server.written
+
+    def test_default_priority(self) -> None:
+        self.assertEqual(
+            [
+                "network:10.0.0.0/24", "ip_address:10.0.0.1", "nic:aa:00:00:00:00:01",
+                "dns_lookup:host1.example.com", "delete:host9.example.com",
+            ],
+            self._sync(),
+        )
+        # Held back until the network class, which outranks them all, was planned
+        self.assertEqual(
+            [("dns_lookup", []), ("nic", []), ("ip_address", []), ("network", [])],
+            self.planned,
+        )
+
+    def test_configured_priority(self) -> None:
+        self.assertEqual(
+            [
+                "delete:host9.example.com", "nic:aa:00:00:00:00:01", "network:10.0.0.0/24",
+                "dns_lookup:host1.example.com", "ip_address:10.0.0.1",
+            ],
+            self._sync(apply_priority=["delete:*", "create:nic", "create:network"]),
+        )
+
+
+class BrokenServer(MemoryServer):
+
+    def update_tiddler(self, tiddler: Dict[str, Any]) -> None:
+        raise ConnectionError("Connection reset")
+
+
+class TestUpdate(ConfigTestCase):
+    """
+    Sources to model to targets, as pytw5 update runs.
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        config_path = os.path.join(self.path, "config.xml")
+        with open(config_path, "wb") as fp:
+            fp.write(CONFIG_XML)
+        leases_path = os.path.join(self.path, "kea-leases4.csv")
+        with open(leases_path, "w") as fp:
+            fp.write(KEA_LEASES.format(expire=int(time.time()) + 3600))
+        singleton._lazy_config = {
+            "sources": [
+                {"name": "fw1", "type": "pfsense_config", "path": config_path},
+                {"name": "leases", "type": "dhcp_leases", "path": leases_path},
+            ],
+            "targets": [{"name": "wiki", "host": "http://wiki"}],
+        }
+
+        self.server = MemoryServer()
+        patch = mock.patch.object(twserver.Server, "connect", side_effect=self._connect)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def _connect(self, url: str, **kwargs) -> MemoryServer:
+        if url == "http://down":
+            raise ConnectionError("Connection refused")
+        if url == "http://broken":
+            return BrokenServer()
+        return self.server
+
+    def _tiddlers(self, twit_class: str) -> Dict[str, Dict[str, str]]:
+        return {x["title"]: x for x in self.server.all_tiddlers if x.get("twit_class") == twit_class}
+
+    def test_update(self) -> None:
+        wiki, = Integrator().update()
+        self.assertEqual(("wiki", None, 0, 0), (wiki.name, wiki.error, wiki.updated, wiki.deleted))
+
+        # Both sources reach the target, each tiddler recording its sources
+        self.assertEqual(["10.0.0.0/24"], list(self._tiddlers("network")))
+        ip_addresses = self._tiddlers("ip_address")
+        self.assertEqual(["10.0.0.1", "10.0.0.100", "10.0.0.5"], sorted(ip_addresses))
+        self.assertEqual("aa:00:00:00:00:64", ip_addresses["10.0.0.100"]["mac"])
+        self.assertEqual("fw1", ip_addresses["10.0.0.5"][schema.OWNER_FIELD])
+        # ...including the network's, as the tiddler shows which it is in
+        self.assertEqual("fw1 leases", ip_addresses["10.0.0.100"][schema.OWNER_FIELD])
+        self.assertEqual(["aa:00:00:00:00:05", "aa:00:00:00:00:64"], sorted(self._tiddlers("nic")))
+        self.assertEqual(["printer.example.com"], list(self._tiddlers("dns_lookup")))
+        self.assertEqual(len(self.server.all_tiddlers), wiki.created)
+
+        # A second run finds the target in sync
+        wiki, = Integrator().update()
+        self.assertEqual((None, 0, 0, 0), (wiki.error, wiki.created, wiki.updated, wiki.deleted))
+
+    def test_failing_targets(self) -> None:
+        singleton._lazy_config["targets"] = [
+            {"name": "down", "host": "http://down"},
+            {"name": "broken", "host": "http://broken"},
+            {"name": "wiki", "host": "http://wiki"},
+        ]
+        with self.assertLogs("pytw5.integrator", "ERROR"):
+            down, broken, wiki = Integrator().update()
+
+        # Each failure is reported against its target, and doesn't stop the others
+        self.assertEqual(("down", "Connection refused"), (down.name, down.error))
+        self.assertEqual(("broken", "Connection reset"), (broken.name, broken.error))
+        self.assertEqual(("wiki", None), (wiki.name, wiki.error))
+        self.assertEqual(len(self.server.all_tiddlers), wiki.created)
@@ -0,0 +1,65 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from pytw5.listing_cache import ListingCache
+
+TIDDLERS = ({"title": "a", "revision": "1"}, {"title": "b", "revision": "2"})
+
+
+class TestListingCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "listing.json")
+
+    def test_round_trip(self) -> None:
+        cache = ListingCache(self.path)
+        self.assertFalse(cache.usable)
+        cache.replace(TIDDLERS, {"etag": '"abc"', "last_modified": "Thu, 05 Jan 2023 12:00:00 GMT"})
+        cache.save()
+
+        cache = ListingCache(self.path)
+        self.assertTrue(cache.usable)
+        self.assertEqual(TIDDLERS, cache.tiddlers)
+        self.assertEqual(
+            {"If-None-Match": '"abc"', "If-Modified-Since": "Thu, 05 Jan 2023 12:00:00 GMT"},
+            cache.conditional_headers(),
+        )
+
+        # Callers get copies
+        cache.tiddlers[0]["revision"] = "9"
+        self.assertEqual("1", cache.tiddlers[0]["revision"])
+
+    def test_max_age(self) -> None:
+        cache = ListingCache(self.path)
+        cache.replace(TIDDLERS, {"etag": '"abc"'})
+        cache.save()
+        with open(self.path, "r") as fp:
+            record = json.load(fp)
+        record["fetched"] = time.time() - ListingCache.MAX_AGE - 1
+        with open(self.path, "w") as fp:
+            json.dump(record, fp)
+        self.assertFalse(ListingCache(self.path).usable)
+
+    def test_corrupt(self) -> None:
+        with open(self.path, "w") as fp:
+            fp.write('{"tiddlers": [')
+        with self.assertLogs("pytw5.listing_cache", "WARNING"):
+            self.assertFalse(ListingCache(self.path).usable)
+
+    def test_invalidate(self) -> None:
+        cache = ListingCache(self.path)
+        cache.replace(TIDDLERS, {"etag": '"abc"'})
+        cache.save()
+
+        cache = ListingCache(self.path)
+        cache.invalidate()
+        self.assertFalse(cache.usable)
+        self.assertEqual({}, cache.conditional_headers())
+        # Nor does a listing read while writes are under way restore the copy
+        cache.replace(TIDDLERS, {"etag": '"abc"'})
+        cache.save()
+        self.assertFalse(os.path.exists(self.path))
@@ -0,0 +1,99 @@
+import json
+import os
+import tempfile
+import unittest
+from typing import Any, Dict
+from unittest import mock
+from pytw5 import progress
+
+
+class TestProgress(unittest.TestCase):
+
+    def setUp(self) -> None:
+        saved = (progress.interval, progress.trace_every)
+        self.addCleanup(progress.configure, *saved)
+        self.now = 100.0
+        patch = mock.patch.object(progress.time, "monotonic", side_effect=lambda: self.now)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def _record(self, counter: progress.Progress, *events: str) -> list:
+        with self.assertLogs("pytw5.progress", "INFO") as logs:
+            for event in events:
+                counter.record(event, f"title{self.now:.0f}")
+                self.now += 1
+            # assertLogs needs at least one record
+            progress.log.info("end")
+        return [x.getMessage() for x in logs.records[:-1]]
+
+    def test_throttle(self) -> None:
+        progress.configure(progress_interval=5, trace=0)
+        counter = progress.Progress("wiki")
+        # A summary at most every 5 seconds, rather than a line per event
+        self.assertEqual(
+            ["wiki: 3 created, 3 updated (5.0s)", "wiki: 5 created, 6 updated (10.0s)"],
+            self._record(counter, *(["updated", "created"] * 6)),
+        )
+        self.assertEqual({"created": 6, "updated": 6}, counter.counts)
+
+        # Never when disabled
+        progress.configure(progress_interval=-1, trace=0)
+        self.assertEqual([], self._record(progress.Progress("wiki"), *(["updated"] * 20)))
+
+    def test_trace(self) -> None:
+        progress.configure(progress_interval=-1, trace=3)
+        self.assertEqual(
+            ["wiki: updated 'title102' (event 3)", "wiki: created 'title105' (event 6)"],
+            self._record(progress.Progress("wiki"), "updated", "updated", "updated", "created", "created", "created", "created"),
+        )
+
+
+class TestProgressFile(unittest.TestCase):
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.report = progress.ProgressFile(os.path.join(directory.name, "progress.json"), "wiki")
+        self.report.BATCH = 3
+        self.report.INTERVAL = 3600
+
+    def _read(self) -> Dict[str, Any]:
+        with open(self.report.path) as fp:
+            return json.load(fp)
+
+    def test_batches(self) -> None:
+        self.report.planned([("create", "nic")] * 4 + [("delete", "nic")])
+        written = self._read()
+        self.assertEqual("running", written["state"])
+        self.assertEqual({"create:nic": 4, "delete:nic": 1}, written["planned"])
+        self.assertEqual(5, written["remaining"])
+        self.assertIsNone(written["first_write"])
+
+        # Not rewritten until a batch has completed
+        self.report.record("create", "nic")
+        self.report.record("create", "nic")
+        self.assertEqual(written, self._read())
+        self.report.record("create", "nic", ok=False)
+        written = self._read()
+        self.assertEqual({"create:nic": 2}, written["done"])
+        self.assertEqual(1, written["failed"])
+        self.assertEqual(2, written["remaining"])
+        self.assertIsNotNone(written["time_to_first_write"])
+
+        # Operations which wrote nothing are completed, but not done
+        self.report.record("create", "nic", changed=False)
+        self.report.record("delete", "nic", changed=False)
+        self.report.finish()
+        written = self._read()
+        self.assertEqual("finished", written["state"])
+        self.assertEqual({"create:nic": 2}, written["done"])
+        self.assertEqual(2, written["unchanged"])
+        self.assertEqual(0, written["remaining"])
+
+    def test_failed(self) -> None:
+        self.report.planned([("create", "nic")])
+        self.report.finish(error="Connection refused")
+        written = self._read()
+        self.assertEqual("failed", written["state"])
+        self.assertEqual("Connection refused", written["error"])
+        self.assertEqual(1, written["remaining"])
@@ -0,0 +1,97 @@
+import os
+from typing import List, Tuple
+from unittest import mock
+import pytw5.model
+from pytw5 import schedule
+from pytw5.config import SourceConfig
+from pytw5.model import CompactModel
+from pytw5.sources import _loader
+from pytw5.testing import ConfigTestCase
+
+VMS = {"name": "vms", "type": "proxmox", "max_interval": 200}
+FIREWALL = {"name": "fw1", "type": "pfsense"}
+
+
+def _compact(source: str, *addresses: str) -> CompactModel:
+    m = pytw5.model.create_model()
+    m.set_source(source)
+    for address in addresses:
+        m.get_ip_address(address)
+    return m.compact()
+
+
+class TestScheduler(ConfigTestCase):
+
+    CONFIG = {"sources": [VMS, FIREWALL]}
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.scheduler = schedule.Scheduler(os.path.join(self.path, "pytw5.schedule"))
+        self.source = SourceConfig(VMS)
+
+    def test_due(self) -> None:
+        # Unscheduled sources are always fetched, and so is a new one
+        self.assertTrue(self.scheduler.due(SourceConfig(FIREWALL), 0))
+        self.assertTrue(self.scheduler.due(self.source, 0))
+
+        self.assertTrue(self.scheduler.observe(self.source, _compact("vms", "10.0.0.1"), 1000))
+        self.assertEqual(1060, self.scheduler.next_due(self.source))
+        self.assertFalse(self.scheduler.due(self.source, 1059))
+        self.assertTrue(self.scheduler.due(self.source, 1060))
+
+        # As is one whose configuration or cached result changed
+        self.assertTrue(self.scheduler.due(SourceConfig(dict(VMS, host="pve2")), 1000))
+        os.remove(self.scheduler.payload_path(self.source))
+        self.assertTrue(self.scheduler.due(self.source, 1000))
+
+    def test_backoff(self) -> None:
+        compact = _compact("vms", "10.0.0.1", "10.0.0.2")
+        intervals = list()
+        for now, observed in enumerate((compact, compact, compact, compact, _compact("vms", "10.0.0.3"), compact)):
+            changed = self.scheduler.observe(self.source, observed, now)
+            intervals.append((changed, self.scheduler.next_due(self.source) - now))
+        # Doubles while unchanged, up to max_interval, and a change resets it
+        self.assertEqual(
+            [(True, 60), (False, 120), (False, 200), (False, 200), (True, 60), (True, 60)],
+            intervals,
+        )
+
+        # The same records in another order are unchanged
+        reordered = compact._replace(ip_addresses=compact.ip_addresses[::-1])
+        self.assertFalse(self.scheduler.observe(self.source, reordered, 10))
+
+        # Kept across runs
+        self.scheduler.save()
+        reopened = schedule.Scheduler(os.path.join(self.path, "pytw5.schedule"))
+        self.assertEqual(10 + 120, reopened.next_due(self.source))
+        self.assertEqual(compact, reopened.cached(self.source))
+
+    def test_corrupt_state(self) -> None:
+        with open(self.scheduler.state_path, "w") as fp:
+            fp.write("{")
+        with self.assertLogs("pytw5.schedule", "WARNING"):
+            scheduler = schedule.Scheduler(os.path.join(self.path, "pytw5.schedule"))
+        self.assertTrue(scheduler.due(self.source, 0))
+
+    def test_reuses_cached(self) -> None:
+        built: List[Tuple[str, ...]] = list()
+
+        def _build(sources, max_workers=0):
+            built.append(tuple(x.name for x in sources))
+            return [(x, _compact(x.name, "10.0.0.1" if x.name == "vms" else "10.0.0.2")) for x in sources]
+
+        with mock.patch.object(_loader, "build_compacts", side_effect=_build):
+            with mock.patch.object(_loader.time, "time", return_value=1000):
+                first = _loader.load_model()
+            with mock.patch.object(_loader.time, "time", return_value=1030):
+                second = _loader.load_model()
+            with mock.patch.object(_loader.time, "time", return_value=1060):
+                _loader.load_model()
+
+        # The scheduled source is only fetched again once due
+        self.assertEqual([("vms", "fw1"), ("fw1",), ("vms", "fw1")], built)
+        self.assertEqual(
+            sorted(x.ipv4 for x in first.ip_addresses),
+            sorted(x.ipv4 for x in second.ip_addresses),
+        )
+        self.assertEqual(["fw1"], list(second.get_ip_address("10.0.0.2").sources))
@@ -0,0 +1,58 @@
+import unittest
+from pytw5 import schema
+
+
+class TestSchema(unittest.TestCase):
+
+    def test_lists(self) -> None:
+        self.assertEqual("a [[b c]] d", schema.encode_list(["a", "b c", "d"]))
+        self.assertEqual(["b c", "a", "d"], schema.decode_list("a [[b c]] d"))
+        self.assertEqual([], schema.decode_list(""))
+
+    def test_encode(self) -> None:
+        codec = schema.SCHEMAS["ip_address"]
+        encoded = codec.encode({
+            "title": "10.0.0.1",
+            "hosts": ["web01.example.com", "db01.example.com"],
+            "network": None,
+            "mac": "aa:00:00:00:00:01",
+            "ip_address": "10.0.0.1",
+            "annotations": ["Web server", "DHCP"],
+            schema.OWNER_FIELD: ["fw1"],
+        })
+        # Declared order, None as "", and lists sorted
+        self.assertEqual(
+            ["title", "annotations", "ip_address", "mac", "network", "hosts", schema.OWNER_FIELD, "twit_class"],
+            list(encoded),
+        )
+        self.assertEqual("", encoded["network"])
+        self.assertEqual("DHCP [[Web server]]", encoded["annotations"])
+        self.assertEqual("db01.example.com web01.example.com", encoded["hosts"])
+        self.assertEqual("ip_address", encoded["twit_class"])
+
+        decoded = codec.decode(encoded)
+        self.assertEqual(["DHCP", "Web server"], decoded["annotations"])
+        self.assertEqual(encoded, codec.encode(decoded))
+
+    def test_kinds(self) -> None:
+        codec = schema.SCHEMAS["network"]
+        encoded = codec.encode({
+            "title": "10.0.0.0/24", "network": "10.0.0.0/24", "vlan": None, "prefix_length": 24,
+            "annotations": [], "ip_addresses": [], "used": 0, "free": 254, "utilisation": "0%",
+            "free_ranges": ["10.0.0.200-10.0.0.254", "10.0.0.1-10.0.0.100"], schema.OWNER_FIELD: [],
+        })
+        # Ordered lists keep their order, and ints decode back
+        self.assertEqual("10.0.0.200-10.0.0.254 10.0.0.1-10.0.0.100", encoded["free_ranges"])
+        decoded = codec.decode(encoded)
+        self.assertEqual(["10.0.0.200-10.0.0.254", "10.0.0.1-10.0.0.100"], decoded["free_ranges"])
+        self.assertIsNone(decoded["vlan"])
+        self.assertEqual(24, decoded["prefix_length"])
+
+    def test_differs(self) -> None:
+        encoded = {"title": "a", "mac": "aa:00:00:00:00:01", "twit_class": "nic"}
+        tiddler = dict(encoded, revision="3", tags="PyTw5Generated", modified="20230105120000000")
+        self.assertFalse(schema.differs(encoded, tiddler))
+        self.assertTrue(schema.differs(encoded, dict(tiddler, mac="aa:00:00:00:00:02")))
+        # A field which is no longer in the schema, or missing from the tiddler
+        self.assertTrue(schema.differs(encoded, dict(tiddler, retired="x")))
+        self.assertTrue(schema.differs(dict(encoded, hosts=""), tiddler))
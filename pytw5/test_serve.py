@@ -0,0 +1,99 @@
+import http.client
+import json
+import threading
+import unittest
+from typing import Dict, Optional, Tuple
+from unittest import mock
+import pytw5.model
+from pytw5 import serve, sources
+
+
+def _model() -> pytw5.model.Model:
+    m = pytw5.model.create_model()
+    m.get_network("10.0.0.0/24")
+    ip = m.get_ip_address("10.0.0.5")
+    ip.set_mac(m.get_mac("aa:00:00:00:00:05"))
+    ip.add_annotation("printer")
+    m.get_dns_lookup("printer.example.com").add_ip_address(ip)
+    return m
+
+
+class TestServe(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.server = serve.Server("127.0.0.1", 0, 60)
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def _get(self, path: str, etag: Optional[str] = None) -> Tuple[int, Dict[str, str], bytes]:
+        connection = http.client.HTTPConnection(*self.server.server_address[:2], timeout=5)
+        self.addCleanup(connection.close)
+        connection.request("GET", path, headers={"If-None-Match": etag} if etag else {})
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+
+    def _refresh(self) -> None:
+        with mock.patch.object(sources, "load_model", return_value=_model()):
+            self.server.refresh()
+
+    def test_lookup(self) -> None:
+        status, _, body = self._get("/ip/10.0.0.5")
+        self.assertEqual(503, status)
+        self.assertEqual({"error": "Model not yet built"}, json.loads(body))
+
+        self._refresh()
+        status, headers, body = self._get("/")
+        self.assertEqual(200, status)
+        self.assertEqual(
+            {"dns_lookup": 1, "ip_address": 1, "network": 1, "nic": 1},
+            json.loads(body)["counts"],
+        )
+        self.assertEqual("max-age=60", headers["Cache-Control"])
+
+        status, _, body = self._get("/ip/10.0.0.5")
+        self.assertEqual(200, status)
+        self.assertEqual("aa:00:00:00:00:05", json.loads(body)["mac"])
+        self.assertEqual(["printer.example.com"], json.loads(body)["hosts"])
+
+        # MAC addresses are matched in any case, and titles may be quoted
+        status, _, body = self._get("/mac/AA:00:00:00:00:05")
+        self.assertEqual(["10.0.0.5"], json.loads(body)["ip_addresses"])
+        status, _, body = self._get("/network/10.0.0.0%2F24")
+        self.assertEqual(24, json.loads(body)["prefix_length"])
+        status, _, body = self._get("/network/10.0.0.0/24")
+        self.assertEqual(200, status)
+
+        status, _, body = self._get("/host/unknown.example.com")
+        self.assertEqual(404, status)
+        self.assertEqual({"error": "Unknown host 'unknown.example.com'"}, json.loads(body))
+        self.assertEqual(404, self._get("/ip")[0])
+        self.assertEqual(404, self._get("/other/x")[0])
+
+    def test_etag(self) -> None:
+        self._refresh()
+        status, headers, _ = self._get("/host/printer.example.com")
+        etag = headers["ETag"]
+        status, headers, body = self._get("/host/printer.example.com", etag)
+        self.assertEqual(304, status)
+        self.assertEqual(etag, headers["ETag"])
+        self.assertEqual(b"", body)
+
+        # An unchanged entity keeps its ETag across rebuilds
+        self._refresh()
+        self.assertEqual(304, self._get("/host/printer.example.com", etag)[0])
+        self.assertEqual(200, self._get("/host/printer.example.com", '"stale"')[0])
+
+    def test_search(self) -> None:
+        self._refresh()
+        status, _, body = self._get("/search?q=printer")
+        self.assertEqual(200, status)
+        self.assertEqual(
+            {"query": "printer", "results": [{"twit_class": "ip_address", "title": "10.0.0.5"}]},
+            json.loads(body),
+        )
+        # Repeated queries are answered from the cache
+        snapshot = self.server.snapshot
+        self.assertIs(snapshot.search("printer"), snapshot.search("printer"))
+        self.assertEqual([], json.loads(self._get("/search?q=nothing")[2])["results"])
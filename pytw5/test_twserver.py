@@ -0,0 +1,162 @@
+import json
+import os
+import tempfile
+import unittest
+from typing import Any, Dict, List, Tuple
+import requests
+import pytw5.model
+from pytw5 import twserver
+from pytw5.integrator import Integrator
+from pytw5.listing_cache import ListingCache
+
+URL = "http://wiki"
+TITLE = "10.0.0.0/24"
+QUOTED = f"{URL}/recipes/default/tiddlers/10.0.0.0%2F24"
+
+
+def _response(status_code: int, body: Any = None, etag: str = None) -> requests.Response:
+    ret = requests.Response()
+    ret.status_code = status_code
+    ret._content = b"" if body is None else json.dumps(body).encode()
+    if etag:
+        ret.headers["ETag"] = etag
+    return ret
+
+
+def _tw5_tiddler(revision: int, **fields: str) -> Dict[str, Any]:
+    # As the TW5 server returns a single tiddler, with the custom fields nested
+    return {
+        "title": TITLE,
+        "tags": "PyTw5Generated",
+        "fields": fields,
+        "revision": revision,
+        "bag": "default",
+        "type": "text/vnd.tiddlywiki",
+    }
+
+
+class StubSession:
+    """
+    Replays a response per request, recording the requests.
+    """
+
+    def __init__(self, *responses: requests.Response) -> None:
+        self._responses = list(responses)
+        self.requests: List[Tuple[str, str, Dict[str, str]]] = list()
+
+    def _request(self, method: str, url: str, headers: Dict[str, str] = None, **kwargs) -> requests.Response:
+        self.requests.append((method, url, dict(headers or dict())))
+        return self._responses.pop(0)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self._request("GET", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self._request("PUT", url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self._request("DELETE", url, **kwargs)
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.integrator = Integrator(pytw5.model.create_model())
+        self.entity = {"title": TITLE, "twit_class": "network", "network": TITLE}
+        # As listed, before someone else changed it
+        self.current = dict(self.entity, annotations="old", tags="PyTw5Generated", revision="3", bag="default")
+
+    def _server(self, *responses: requests.Response) -> Tuple[twserver.Server, StubSession]:
+        session = StubSession(*responses)
+        server = twserver.Server(url=URL, session=session)
+        server.remember(self.current)
+        return server, session
+
+    def test_get_tiddler(self) -> None:
+        server, session = self._server(_response(200, _tw5_tiddler(4, twit_class="network", network=TITLE)))
+        tiddler = server.get_tiddler(TITLE)
+        self.assertEqual(("GET", QUOTED), session.requests[0][:2])
+        self.assertNotIn("fields", tiddler)
+        self.assertEqual("network", tiddler["twit_class"])
+        self.assertEqual(TITLE, tiddler["network"])
+        self.assertEqual(4, tiddler["revision"])
+
+    def test_update_conflict_unchanged(self) -> None:
+        # Someone else wrote the same fields in the meantime
+        server, session = self._server(
+            _response(412),
+            _response(200, _tw5_tiddler(4, twit_class="network", network=TITLE)),
+        )
+        self.assertIsNone(self.integrator._sync_tiddler(server, self.entity, self.current))
+        self.assertEqual(["PUT", "GET"], [x[0] for x in session.requests])
+        self.assertEqual(QUOTED, session.requests[0][1])
+        self.assertEqual('"default/10.0.0.0%2F24/3:"', session.requests[0][2]["If-Match"])
+
+    def test_update_conflict_retried(self) -> None:
+        server, session = self._server(
+            _response(412),
+            _response(200, _tw5_tiddler(4, twit_class="network", network="10.0.0.0/25"), etag='"default/10.0.0.0%2F24/4:"'),
+            _response(204, etag='"default/10.0.0.0%2F24/5:"'),
+        )
+        self.assertEqual("updated", self.integrator._sync_tiddler(server, self.entity, self.current))
+        self.assertEqual(["PUT", "GET", "PUT"], [x[0] for x in session.requests])
+        self.assertEqual('"default/10.0.0.0%2F24/4:"', session.requests[2][2]["If-Match"])
+
+    def test_delete_conflict(self) -> None:
+        server, session = self._server(
+            _response(412),
+            _response(200, _tw5_tiddler(4, twit_class="network", network=TITLE)),
+            _response(204),
+        )
+        self.assertTrue(self.integrator._delete_tiddler(server, self.current))
+        self.assertEqual(["DELETE", "GET", "DELETE"], [x[0] for x in session.requests])
+        self.assertEqual(f"{URL}/bags/default/tiddlers/10.0.0.0%2F24", session.requests[2][1])
+
+    def test_delete_conflict_reclassified(self) -> None:
+        # Someone else turned it into a different kind of tiddler
+        server, session = self._server(
+            _response(412),
+            _response(200, _tw5_tiddler(4, twit_class="ip_address")),
+        )
+        self.assertFalse(self.integrator._delete_tiddler(server, self.current))
+        self.assertEqual(["DELETE", "GET"], [x[0] for x in session.requests])
+
+
+class TestListing(unittest.TestCase):
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "listing.json")
+        self.listing = [{"title": TITLE, "revision": "3", "bag": "default", "twit_class": "network"}]
+
+    def _server(self, *responses: requests.Response) -> Tuple[twserver.Server, StubSession]:
+        session = StubSession(*responses)
+        return twserver.Server(url=URL, session=session, listing_cache=ListingCache(self.path)), session
+
+    def test_not_modified(self) -> None:
+        server, _ = self._server(_response(200, self.listing, etag='"v1"'))
+        self.assertEqual(tuple(self.listing), server.all_tiddlers)
+        server.save_listing_cache()
+
+        server, session = self._server(_response(304))
+        self.assertEqual(tuple(self.listing), server.all_tiddlers)
+        self.assertEqual('"v1"', session.requests[0][2]["If-None-Match"])
+
+    def test_write_invalidates(self) -> None:
+        server, _ = self._server(_response(200, self.listing, etag='"v1"'), _response(204))
+        server.all_tiddlers
+        server.update_tiddler({"title": "10.0.0.1", "twit_class": "ip_address"})
+        server.save_listing_cache()
+        self.assertFalse(os.path.exists(self.path))
+
+        server, session = self._server(_response(200, self.listing))
+        server.all_tiddlers
+        self.assertNotIn("If-None-Match", session.requests[0][2])
+
+    def test_without_validators(self) -> None:
+        # Nothing to revalidate a copy with, so none is kept
+        server, _ = self._server(_response(200, self.listing))
+        self.assertEqual(tuple(self.listing), server.all_tiddlers)
+        server.save_listing_cache()
+        self.assertFalse(os.path.exists(self.path))
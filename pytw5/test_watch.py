@@ -0,0 +1,101 @@
+import json
+import os
+import unittest
+from typing import Dict
+from unittest import mock
+import pytw5.model
+from pytw5 import sources, twserver
+from pytw5.config import SourceConfig
+from pytw5.integrator import Integrator
+from pytw5.sources import unifi, unifi_events
+from pytw5.testing import ConfigTestCase, MemoryServer
+from pytw5.watch import Watcher
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+SWITCH = "aa:00:00:00:00:f1"
+# Source names may contain "/"
+SOURCE = SourceConfig({"name": "lab/ctl1", "type": "unifi"})
+
+# A client moving port and another connecting, as recorded from the feed
+RECORDED = "\n".join(json.dumps(x) for x in (
+    {"meta": {"message": "sta:sync"}, "data": [
+        {"mac": "aa:00:00:00:00:01", "is_wired": True, "sw_mac": SWITCH, "sw_port": 2},
+    ]},
+    {"meta": {"message": "events"}, "data": [
+        {"key": "EVT_LU_Connected", "user": "aa:00:00:00:00:02", "sw": SWITCH, "port": "1"},
+    ]},
+))
+
+
+def _fetched():
+    device = unifi.Device(mac=SWITCH, name="core-sw1", model="USW", ip_address=None, ports=((1, "Port 1"), (2, "Port 2")))
+    client = unifi.wired_client(unifi.switch_index([device]), "aa:00:00:00:00:01", SWITCH, 1)
+    return [(SOURCE, (unifi.Site(name="default", devices=(device,), clients=(client,)),))]
+
+
+class TestWatcher(ConfigTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.recording = os.path.join(self.path, "events.jsonl")
+        with open(self.recording, "w") as fp:
+            fp.write(RECORDED + "\n")
+
+        self.server = MemoryServer()
+        self.updates = 0
+        update = Integrator.update
+
+        def _counted(integrator: Integrator, *args, **kwargs):
+            self.updates += 1
+            return update(integrator, *args, **kwargs)
+
+        for patch in (
+                mock.patch.object(twserver.Server, "connect", return_value=self.server),
+                mock.patch.object(sources, "select_sources", return_value=(SOURCE,)),
+                mock.patch.object(sources, "fetch_sources", side_effect=lambda x: _fetched()),
+                mock.patch.object(Integrator, "update", autospec=True, side_effect=_counted),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def _annotations(self) -> Dict[str, str]:
+        return {x["title"]: x["annotations"] for x in self.server.all_tiddlers if x["twit_class"] == "nic"}
+
+    def _watch(self, watcher: Watcher, stream) -> None:
+        watcher.watch({"lab/ctl1": {"default": stream}})
+
+        Node = pytw5.model.Node
+        # The ports moved in the model, and one batch pushed them after the full sync
+        self.assertEqual(2, self.updates)
+        self.assertEqual(
+            (Node.port(SWITCH, 2),),
+            watcher._model.topology.neighbours(Node("mac", "aa:00:00:00:00:01"), "port"),
+        )
+        self.assertEqual(
+            (Node.port(SWITCH, 1),),
+            watcher._model.topology.neighbours(Node("mac", "aa:00:00:00:00:02"), "port"),
+        )
+        annotations = self._annotations()
+        self.assertEqual("[[Connected to switch core-sw1 port #2 - Port 2]]", annotations["aa:00:00:00:00:01"])
+        self.assertEqual("[[Connected to switch core-sw1 port #1 - Port 1]]", annotations["aa:00:00:00:00:02"])
+
+    def test_replay(self) -> None:
+        watcher = Watcher(batch_interval=0.2)
+        self._watch(watcher, unifi_events.ReplayEventStream(self.recording))
+
+        # A resync rebuilds from the sources, which still have the old port
+        watcher.resync()
+        self.assertEqual(3, self.updates)
+        self.assertEqual("[[Connected to switch core-sw1 port #1 - Port 1]]", self._annotations()["aa:00:00:00:00:01"])
+        self.assertNotIn("aa:00:00:00:00:02", self._annotations())
+
+    @unittest.skipUnless(websocket, "The live feed needs the websocket-client package")
+    def test_replay_server(self) -> None:
+        replay = unifi_events.ReplayServer(self.recording)
+        replay.start()
+        self.addCleanup(replay.stop)
+        self._watch(Watcher(batch_interval=0.2), unifi_events.WebSocketEventStream(replay.url, timeout=5))
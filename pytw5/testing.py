@@ -0,0 +1,73 @@
+"""
+Description
+===========
+
+Support for the tests and the benchmark: a stand-in for the TiddlyWiki server
+and a test case with its own configuration.
+
+"""
+
+import copy
+import tempfile
+import unittest
+from typing import Any, Dict, Tuple
+from .config import singleton
+from .progress import Progress
+
+
+class MemoryServer:
+    """
+    Stands in for twserver.Server, holding the tiddlers in a dict.
+    """
+
+    def __init__(self) -> None:
+        self._tiddlers: Dict[str, Dict[str, Any]] = dict()
+        self._progress = Progress("memory")
+
+    @property
+    def progress(self) -> Progress:
+        return self._progress
+
+    @property
+    def all_tiddlers(self) -> Tuple[Dict[str, Any], ...]:
+        return tuple(dict(x) for x in self._tiddlers.values())
+
+    def delete_tiddler(self, title: str) -> None:
+        self._tiddlers.pop(title, None)
+
+    def update_tiddler(self, tiddler: Dict[str, Any]) -> None:
+        # TW5 stores field values as strings
+        self._tiddlers[tiddler["title"]] = {k: str(v) for k, v in tiddler.items()}
+
+    def get_tiddler(self, title: str) -> Dict[str, Any]:
+        return dict(self._tiddlers.get(title, dict()))
+
+    def remember(self, tiddler: Dict[str, Any]) -> None:
+        pass
+
+    def save_listing_cache(self) -> None:
+        pass
+
+
+class ConfigTestCase(unittest.TestCase):
+    """
+    Points the configuration singleton at a temporary working path holding
+    CONFIG for each test, and restores it afterwards.
+    """
+
+    CONFIG: Dict[str, Any] = {"targets": [{"name": "wiki", "host": "http://wiki"}]}
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+
+        saved = (singleton._path, singleton._config_loaded, singleton._lazy_config)
+
+        def _restore() -> None:
+            singleton._path, singleton._config_loaded, singleton._lazy_config = saved
+
+        self.addCleanup(_restore)
+        singleton._path = self.path
+        singleton._lazy_config = copy.deepcopy(self.CONFIG)
+        singleton._config_loaded = True
@@ -5,25 +5,64 @@ import requests
 import getpass
 import click
 import json
-from typing import NamedTuple, Dict, Set, Any, List, Tuple
+import urllib.parse
+from typing import NamedTuple, Dict, Set, Any, List, Optional, Tuple
+from .listing_cache import ListingCache
+from .progress import Progress
 
 log = logging.getLogger(__name__)
 CERT_PATH = os.path.join(os.path.dirname(__file__), "root.crt")
 
 
+class ConflictError(Exception):
+    """
+    The tiddler was changed on the server since we last read it.
+    """
+
+    def __init__(self, title: str) -> None:
+        super().__init__(f"Conflict on tiddler '{title}'")
+        self.title = title
+
+
 class Server:
 
-    def __init__(self, url: str, session: requests.Session) -> None:
+    def __init__(
+            self,
+            url: str,
+            session: requests.Session,
+            bag: str = "default",
+            recipe: str = "default",
+            listing_cache: Optional[ListingCache] = None,
+    ) -> None:
         self._session = session
         self._url = url
+        self._bag = bag
+        self._recipe = recipe
         self._dry_run = False
+        self._progress = Progress(url)
+        # Last known ETag per title, used as the write precondition
+        self._etags: Dict[str, str] = dict()
+        self._listing_cache = listing_cache
 
     @classmethod
-    def connect(cls, url: str, user: str, password: str) -> 'Server':
+    def connect(
+            cls,
+            url: str,
+            user: str,
+            password: str,
+            bag: str = "default",
+            recipe: str = "default",
+            pool_size: int = 10,
+            listing_cache: Optional[ListingCache] = None,
+    ) -> 'Server':
         print("Connecting to: {}".format(url))
 
         session = requests.Session()
         session.verify = CERT_PATH
+        # Enough connections for the concurrent writes
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
 
         # Do we need to authenticate?
         auth = session.get("{}/status".format(url))
@@ -35,57 +74,161 @@ class Server:
             raise click.ClickException("Unauthorised!")
 
         assert auth.ok, "Auth status = {}".format(auth.status_code)
-        return Server(session=session, url=url)
+        return Server(session=session, url=url, bag=bag, recipe=recipe, listing_cache=listing_cache)
 
     @property
-    def all_tiddlers(self) -> Tuple[Dict[str, str]]:
+    def progress(self) -> Progress:
+        return self._progress
 
-        response = self._session.get(
-            "{}/recipes/default/tiddlers.json".format(self._url),
+    @property
+    def _listing_url(self) -> str:
+        return "{}/recipes/{}/tiddlers.json".format(self._url, self._recipe)
+
+    @property
+    def all_tiddlers(self) -> Tuple[Dict[str, str]]:
+        cache = self._listing_cache
+        headers = cache.conditional_headers() if cache is not None and cache.usable else dict()
+        response = self._session.get(self._listing_url, headers=headers)
+        if response.status_code == 304:
+            log.info("Listing of %s not modified, using the cached copy", self._url)
+            ret = cache.tiddlers
+        else:
+            assert response.ok
+            assert response.status_code == 200
+
+            # We are going to use this to work out what to do
+            ret = tuple(json.loads(response.text))
+            if cache is not None:
+                validators = self._validators(response)
+                if validators:
+                    cache.replace(ret, validators)
+                else:
+                    # Nothing to revalidate a copy with
+                    cache.invalidate()
+
+        for tiddler in ret:
+            etag = self._etag_from_revision(tiddler)
+            if etag:
+                self._etags[tiddler["title"]] = etag
+        return ret
+
+    @staticmethod
+    def _validators(response: requests.Response) -> Dict[str, str]:
+        ret = dict()
+        if response.headers.get("ETag"):
+            ret["etag"] = response.headers["ETag"]
+        if response.headers.get("Last-Modified"):
+            ret["last_modified"] = response.headers["Last-Modified"]
+        return ret
+
+    def save_listing_cache(self) -> None:
+        """
+        Saves the local copy of the listing, or removes it if this server wrote
+        to the listing since.
+        """
+        if self._listing_cache is not None:
+            self._listing_cache.save()
+
+    def remember(self, tiddler: Dict[str, Any]) -> None:
+        """
+        Seeds the write precondition for a tiddler known from elsewhere (e.g. a checkpoint).
+        """
+        etag = self._etag_from_revision(tiddler)
+        if etag:
+            self._etags[tiddler["title"]] = etag
+
+    def _etag_from_revision(self, tiddler: Dict[str, Any]) -> Optional[str]:
+        # Matches the ETag format of the TW5 server
+        revision = tiddler.get("revision")
+        if revision is None:
+            return None
+        return '"{}/{}/{}:"'.format(
+            tiddler.get("bag", self._bag),
+            urllib.parse.quote(tiddler["title"], safe=""),
+            revision,
         )
-        assert response.ok
-        assert response.status_code == 200
 
-        # We are going to use this to work out what to do
-        return tuple(json.loads(response.text))
+    def _preconditions(self, title: str) -> Dict[str, str]:
+        etag = self._etags.get(title)
+        if etag:
+            return {"If-Match": etag}
+        # Not seen it, so it shouldn't exist
+        return {"If-None-Match": "*"}
+
+    def _record_etag(self, title: str, response: requests.Response) -> None:
+        etag = response.headers.get("Etag")
+        if etag:
+            self._etags[title] = etag
 
     def delete_tiddler(self, title: str) -> None:
         if self._dry_run:
-            print(f"Dry run deleting tiddler: {title}")
+            self._progress.record("dry run deleted", title)
             return
-        print(f"Deleting tiddler: {title}")
         headers = {
             "x-requested-with": "TiddlyWiki"
         }
+        etag = self._etags.get(title)
+        if etag:
+            headers["If-Match"] = etag
         response = self._session.delete(
-            "{}/bags/default/tiddlers/{}".format(self._url, title),
+            self._tiddler_url("bags", self._bag, title),
             headers=headers,
         )
-        assert response.ok, "Got response: {}".format(response.status_code)
+        if response.status_code == 412:
+            raise ConflictError(title)
+        # Someone else got there first
+        if response.status_code != 404:
+            assert response.ok, "Got response: {}".format(response.status_code)
+        self._etags.pop(title, None)
+        if self._listing_cache is not None:
+            self._listing_cache.invalidate()
+        self._progress.record("deleted", title)
 
     def update_tiddler(self, tiddler: Dict[str, str]) -> None:
         title = tiddler["title"]
         if self._dry_run:
-            print("Dry run updating tiddler: {}".format(title))
+            self._progress.record("dry run updated", title)
             return
-            
-        print("Updating tiddler: {}".format(title))
+
         headers = {
             "x-requested-with": "TiddlyWiki"
         }
+        headers.update(self._preconditions(title))
         response = self._session.put(
-            "{}/recipes/default/tiddlers/{}".format(self._url, title),
+            self._tiddler_url("recipes", self._recipe, title),
             data=json.dumps(tiddler),
             headers=headers,
         )
+        if response.status_code == 412:
+            raise ConflictError(title)
         assert response.ok
+        self._record_etag(title, response)
+        if self._listing_cache is not None:
+            self._listing_cache.invalidate()
+        self._progress.record("updated", title)
+
+    def _tiddler_url(self, kind: str, name: str, title: str) -> str:
+        # Titles may contain "/", "#", "?" and spaces
+        return "{}/{}/{}/tiddlers/{}".format(self._url, kind, name, urllib.parse.quote(title, safe=""))
 
     def get_tiddler(self, title: str) -> Dict[str, Any]:
-        response = self._session.get(
-            "{}/recipes/default/tiddlers/{}".format(self._url, title)
-        )
+        """
+        The tiddler in the same shape as the listing. TW5 nests the custom
+        fields (e.g. twit_class) under "fields", so they are flattened into
+        the top level.
+        """
+        response = self._session.get(self._tiddler_url("recipes", self._recipe, title))
         if response.status_code == 404:
+            self._etags.pop(title, None)
             return dict()
         assert response.ok, "Got response: {}".format(response.status_code)
-        return json.loads(response.text)
+        ret = json.loads(response.text)
+        ret.update(ret.pop("fields", dict()))
+        self._etags.pop(title, None)
+        self._record_etag(title, response)
+        if title not in self._etags:
+            etag = self._etag_from_revision(ret)
+            if etag:
+                self._etags[title] = etag
+        return ret
 
@@ -0,0 +1,168 @@
+"""
+Description
+===========
+
+Keeps the targets current between full runs by following the UniFi controller
+event feeds. Wired client port moves update the affected MAC addresses in the
+model, and only the tiddlers which changed are pushed (see Integrator.update).
+
+The whole model is periodically rebuilt from every source and fully synced, as
+a safety net for missed events.
+
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from click import ClickException
+from . import sources
+from .config import SourceConfig
+from .integrator import Integrator, TargetResult
+from .model import Model
+from .sources import unifi, unifi_events
+
+log = logging.getLogger(__name__)
+
+
+class Watcher:
+
+    RECONNECT_DELAY = 5.0
+    MAX_RECONNECT_DELAY = 300.0
+
+    def __init__(self, resync_interval: float = 3600, batch_interval: float = 2.0) -> None:
+        self._resync_interval = resync_interval
+        self._batch_interval = batch_interval
+        self._events: queue.Queue = queue.Queue()
+        self._model: Optional[Model] = None
+        self._integrator: Optional[Integrator] = None
+        # Switch port index per unifi source name
+        self._switches: Dict[str, Dict[str, unifi.Switch]] = dict()
+        self._next_resync = 0.0
+
+    @property
+    def unifi_sources(self) -> Tuple[SourceConfig, ...]:
+        return tuple(x for x in sources.select_sources() if x.type == "unifi")
+
+    def resync(self) -> Tuple[TargetResult, ...]:
+        """
+        Rebuilds the model from every source and pushes it in full.
+        """
+        fetched = sources.fetch_sources(sources.select_sources())
+        self._switches = {
+            source.name: unifi.switch_index(device for site in data for device in site.devices)
+            for source, data in fetched
+            if source.type == "unifi"
+        }
+        self._model = sources.build_model(fetched)
+        self._integrator = Integrator(m=self._model)
+        self._next_resync = time.monotonic() + self._resync_interval
+        return self._report("Full sync", self._integrator.update())
+
+    def _follow(self, source_name: str, stream: Iterable[str], reconnect: bool) -> None:
+        delay = self.RECONNECT_DELAY
+        try:
+            while True:
+                try:
+                    for message in stream:
+                        delay = self.RECONNECT_DELAY
+                        for event in unifi_events.parse_message(message):
+                            self._events.put((source_name, event))
+                except Exception as e:
+                    log.warning("Event feed for '%s' failed: %r", source_name, e)
+                if not reconnect:
+                    return
+                log.info("Reconnecting to the '%s' event feed in %.0fs", source_name, delay)
+                time.sleep(delay)
+                delay = min(delay * 2, self.MAX_RECONNECT_DELAY)
+        finally:
+            # Tells the main loop this stream has ended
+            self._events.put(None)
+
+    def _next_batch(self, timeout: float) -> Tuple[List[Tuple[str, unifi_events.ClientEvent]], int]:
+        """
+        Waits up to timeout for an event, then collects whatever else arrives
+        within the batch interval. Returns the events and how many streams ended.
+        """
+        batch: List[Tuple[str, unifi_events.ClientEvent]] = list()
+        ended = 0
+        try:
+            item = self._events.get(timeout=max(0.0, timeout))
+        except queue.Empty:
+            return batch, ended
+
+        deadline = time.monotonic() + self._batch_interval
+        while True:
+            if item is None:
+                ended += 1
+            else:
+                batch.append(item)
+            try:
+                item = self._events.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                return batch, ended
+
+    def apply(self, batch: Iterable[Tuple[str, unifi_events.ClientEvent]]) -> int:
+        by_source: Dict[str, List[unifi_events.ClientEvent]] = dict()
+        for source_name, event in batch:
+            by_source.setdefault(source_name, []).append(event)
+
+        changed = 0
+        for source_name, events in by_source.items():
+            self._model.set_source(source_name)
+            changed += unifi_events.apply_events(self._model, self._switches.get(source_name, dict()), events)
+        self._model.set_source(None)
+        return changed
+
+    def watch(self, streams: Optional[Dict[str, Dict[str, Iterable[Any]]]] = None) -> None:
+        """
+        Follows the event feeds of every unifi source, or the given streams
+        (keyed by source name, then site) until they end.
+        """
+        self.resync()
+
+        reconnect = streams is None
+        if streams is None:
+            streams = {source.name: unifi_events.event_streams(source) for source in self.unifi_sources}
+        followed = [
+            (source_name, site, stream)
+            for source_name, sites in streams.items()
+            for site, stream in sites.items()
+        ]
+        if not followed:
+            raise ClickException("No enabled unifi sources to watch!")
+
+        for source_name, site, stream in followed:
+            threading.Thread(
+                target=self._follow,
+                args=(source_name, stream, reconnect),
+                name=f"events-{source_name}/{site}",
+                daemon=True,
+            ).start()
+
+        running = len(followed)
+        while running:
+            batch, ended = self._next_batch(self._next_resync - time.monotonic())
+            running -= ended
+            if batch:
+                changed = self.apply(batch)
+                log.debug("%d events changed %d MAC addresses", len(batch), changed)
+                if changed:
+                    self._report(f"{changed} clients moved", self._integrator.update())
+            if time.monotonic() >= self._next_resync:
+                self.resync()
+
+    @staticmethod
+    def _report(reason: str, results: Tuple[TargetResult, ...]) -> Tuple[TargetResult, ...]:
+        for result in results:
+            if result.error:
+                log.error("%s: %s FAILED - %s", reason, result.name, result.error)
+            else:
+                log.info(
+                    "%s: %s %d created, %d updated, %d deleted",
+                    reason, result.name, result.created, result.updated, result.deleted,
+                )
+            for anomaly in result.anomalies:
+                log.warning("%s: %s %s", reason, result.name, anomaly)
+        return results